@@ -1,3 +1,4 @@
+import asyncio
 from datetime import date, datetime
 
 import click
@@ -6,7 +7,9 @@ from crontab import CronTab
 from . import di_container
 from .api_server.app import app
 from .database.db_model import Base
-from .settings import DATABASE_NAME
+from .database.migrations import convert_rate_type, migrate, partition_exchange_rates
+from .managers.update_checkpoint import UpdateCheckpoint
+from .settings import DATABASE_NAME, DATABASE_RATE_PRECISION, DATABASE_RATE_SCALE, UPDATE_MAX_WORKERS
 
 
 def _parse_date(ctx, param, value):
@@ -32,6 +35,7 @@ def cron(**_):
                 # m h dom mon dow command
                 5 0 * * * cd /app && python -m gold_digger update --exclude-providers fixer.io {redirect}
                 5 2 * * * cd /app && python -m gold_digger update --providers fixer.io {redirect}
+                5 1 1 * * cd /app && python -m gold_digger migrate-db {redirect}
                 0 * * * * echo "`date` - cron health check" {redirect}
             """.format(redirect="> /proc/1/fd/1 2>/proc/1/fd/2")  # redirect to stdout/stderr
         )
@@ -52,20 +56,68 @@ def command(**_):
             return
         Base.metadata.drop_all(di.db_connection)
         Base.metadata.create_all(di.db_connection)
+        with di.db_connection.connect() as connection:
+            with connection.begin():
+                convert_rate_type(connection, DATABASE_RATE_PRECISION, DATABASE_RATE_SCALE)
+
+
+@cli.command("migrate-db", help="Update schema of existing tables (indexes etc.)")
+def command(**_):
+    with di_container(__file__) as di:
+        with di.db_connection.connect() as connection:
+            migrate(connection, di.logger())
+
+
+@cli.command("partition-db", help="Convert table of rates to table partitioned by years (copies all rates, the table is locked meanwhile)")
+def command(**_):
+    with di_container(__file__) as di:
+        with di.db_connection.connect() as connection:
+            with connection.begin():
+                partition_exchange_rates(connection)
+
+
+@cli.command("convert-rates", help="Convert stored rates to type set by database_rate_precision and database_rate_scale settings (rewrites all rates)")
+def command(**_):
+    with di_container(__file__) as di:
+        logger = di.logger()
+        with di.db_connection.connect() as connection:
+            with connection.begin():
+                converted = convert_rate_type(connection, DATABASE_RATE_PRECISION, DATABASE_RATE_SCALE)
+        if converted:
+            logger.info("Rates were converted, picking best rates from the converted rates")
+            di.exchange_rate_manager.rebuild_best_rates(logger)
+
+
+@cli.command("rebuild-best-rates", help="Pick best rates of all dates again (after migrate-db created their table)")
+def command(**_):
+    with di_container(__file__) as di:
+        di.exchange_rate_manager.rebuild_best_rates(di.logger())
 
 
 @cli.command("update-all", help="Update rates since origin date (default 2015-01-01)")
 @click.option("--origin-date", default=date(2015, 1, 1), callback=_parse_date, help="Specify date in format 'yyyy-mm-dd'")
+@click.option("--overwrite", is_flag=True, help="Overwrite rates which are already in database.")
+@click.option("--resume", is_flag=True, help="Store progress to checkpoint file and resume the update from it if it exists.")
+@click.option("--checkpoint-file", default="update-all-checkpoint.json", help="Path of checkpoint file used with --resume.")
+@click.option("--concurrency", type=int, help="Update all providers at once, each of them requested for up to this number of dates at once.")
 def command(**kwargs):
     with di_container(__file__) as di:
         logger = di.logger()
-        di.exchange_rate_manager.update_all_historical_rates(kwargs["origin_date"], logger)
+        checkpoint = UpdateCheckpoint(kwargs["checkpoint_file"], kwargs["origin_date"]) if kwargs["resume"] else None
+        if kwargs["concurrency"]:
+            asyncio.run(di.exchange_rate_manager.update_all_historical_rates_async(
+                kwargs["origin_date"], logger, overwrite=kwargs["overwrite"], checkpoint=checkpoint, concurrency=kwargs["concurrency"],
+            ))
+        else:
+            di.exchange_rate_manager.update_all_historical_rates(kwargs["origin_date"], logger, overwrite=kwargs["overwrite"], checkpoint=checkpoint)
 
 
 @cli.command("update", help="Update rates of specified day (default today)")
 @click.option("--date", default=date.today(), callback=_parse_date, help="Specify date in format 'yyyy-mm-dd'")
 @click.option("--providers", type=str, help="Specify data providers names separated by comma.")
 @click.option("--exclude-providers", type=str, help="Specify data providers names separated by comma.")
+@click.option("--overwrite", is_flag=True, help="Overwrite rates which are already in database.")
+@click.option("--max-workers", default=UPDATE_MAX_WORKERS, type=int, help="Number of providers requested concurrently.")
 def command(**kwargs):
     with di_container(__file__) as di:
         logger = di.logger()
@@ -79,7 +131,9 @@ def command(**kwargs):
             providers = [p for p in providers if p not in excluded_providers]
 
         data_providers = [di.data_providers[provider_name] for provider_name in providers]
-        di.exchange_rate_manager.update_all_rates_by_date(kwargs["date"], data_providers, logger)
+        di.exchange_rate_manager.update_all_rates_by_date(
+            kwargs["date"], data_providers, logger, overwrite=kwargs["overwrite"], max_workers=kwargs["max_workers"]
+        )
 
 
 @cli.command("api", help="Run API server (simple)")
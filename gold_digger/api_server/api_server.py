@@ -1,11 +1,12 @@
 import json
-from datetime import date
+from datetime import date, datetime
+from hashlib import blake2b
 from wsgiref import simple_server
 
 import falcon
 from sqlalchemy.exc import DatabaseError
 
-from .helpers import http_api_logger
+from .helpers import SessionMiddleware, http_api_logger
 from .. import di_container
 from ..settings import SUPPORTED_CURRENCIES
 
@@ -109,6 +110,141 @@ class DateRateResource(DatabaseResource):
         )
 
 
+class BatchRateResource(DatabaseResource):
+    MAX_CONVERSIONS = 10000
+
+    @http_api_logger
+    def on_post_batch_rate(self, req, resp, logger):
+        """
+        Request body is JSON list of conversions, e.g. [{"from": "EUR", "to": "USD", "date": "2021-01-31"}, ...].
+        Date is optional, exchange rate of today is used if omitted. Conversions which cannot be computed are reported with error.
+        Rates are computed only from rates stored in database, providers aren't requested for missing rates of so many conversions.
+
+        :type req: falcon.request.Request
+        :type resp: falcon.request.Response
+        :type logger: gold_digger.utils.ContextLogger
+        """
+        exchange_rate_manager = self.container.exchange_rate_manager
+
+        try:
+            conversions = req.media
+        except falcon.HTTPBadRequest:
+            raise falcon.HTTPInvalidParam("Request body is not valid JSON", "body")
+
+        if not isinstance(conversions, list) or not all(isinstance(conversion, dict) for conversion in conversions):
+            raise falcon.HTTPInvalidParam("Request body has to be list of conversions", "body")
+        if len(conversions) > self.MAX_CONVERSIONS:
+            raise falcon.HTTPInvalidParam("Too many conversions, at most %s conversions are allowed" % self.MAX_CONVERSIONS, "body")
+
+        logger.info("Batch rate request: %s conversions", len(conversions))
+
+        results = []
+        valid_conversions = []
+        for conversion in conversions:
+            from_currency = conversion.get("from")
+            to_currency = conversion.get("to")
+            result = {"date": conversion.get("date"), "from_currency": from_currency, "to_currency": to_currency}
+            results.append(result)
+
+            invalid_currencies = [
+                str(currency) for currency in (from_currency, to_currency) if not isinstance(currency, str) or currency not in SUPPORTED_CURRENCIES
+            ]
+            if invalid_currencies:
+                result["error"] = "Invalid currency %s" % " and ".join(invalid_currencies)
+                continue
+
+            try:
+                date_of_exchange = datetime.strptime(conversion["date"], "%Y-%m-%d").date() if conversion.get("date") else date.today()
+            except (TypeError, ValueError):
+                result["error"] = "Invalid date, date should be in format yyyy-mm-dd"
+                continue
+
+            result["date"] = date_of_exchange.strftime("%Y-%m-%d")
+            valid_conversions.append((result, (date_of_exchange, from_currency, to_currency)))
+
+        exchange_rates = None
+        try:
+            exchange_rates = exchange_rate_manager.get_exchange_rates_by_dates(
+                [conversion for _, conversion in valid_conversions], logger, request_missing=False
+            )
+        except DatabaseError:
+            self.container.db_session.rollback()
+            logger.exception("Database error occurred. Rollback session to allow reconnect to the DB on next request.")
+        except Exception:
+            logger.exception("Unexpected exception while batch rate request")
+
+        if exchange_rates is None:
+            raise falcon.HTTPInternalServerError("Exchange rates not found", "Exchange rates not found")
+
+        for (result, (date_of_exchange, from_currency, to_currency)), exchange_rate in zip(valid_conversions, exchange_rates):
+            if exchange_rate:
+                result["exchange_rate"] = str(exchange_rate)
+            else:
+                logger.error("Exchange rate not found: rate %s %s->%s", date_of_exchange, from_currency, to_currency)
+                result["error"] = "Exchange rate not available"
+
+        logger.info("POST batch rate %s conversions, %s failed", len(results), sum(1 for result in results if "error" in result))
+
+        resp.status = falcon.HTTP_200
+        resp.body = json.dumps({"exchange_rates": results})
+
+
+class MatrixRateResource(DatabaseResource):
+    @http_api_logger
+    def on_get_matrix_rate(self, req, resp, logger):
+        """
+        Exchange rates between all pairs of the currencies in rows by "from" currency and columns by "to" currency, in order of the request.
+        Response is compact JSON with strong ETag of its content, so clients can revalidate it by If-None-Match header.
+
+        :type req: falcon.request.Request
+        :type resp: falcon.request.Response
+        :type logger: gold_digger.utils.ContextLogger
+        """
+        exchange_rate_manager = self.container.exchange_rate_manager
+
+        logger.info("Matrix rate request: %s", req.params)
+
+        currencies = list(dict.fromkeys(currency for value in req.get_param_as_list("currencies", required=True) for currency in value.split(",")))
+        date_of_exchange = req.get_param_as_date("date")
+        date_of_exchange = date_of_exchange if date_of_exchange else date.today()
+
+        invalid_currencies = [currency for currency in currencies if currency not in SUPPORTED_CURRENCIES]
+        if invalid_currencies:
+            raise falcon.HTTPInvalidParam("Invalid currency", " and ".join(invalid_currencies))
+
+        exchange_rates = None
+        try:
+            exchange_rates = exchange_rate_manager.get_exchange_rate_matrix_by_date(date_of_exchange, currencies, logger)
+        except DatabaseError:
+            self.container.db_session.rollback()
+            logger.exception("Database error occurred. Rollback session to allow reconnect to the DB on next request.")
+        except Exception:
+            logger.exception("Unexpected exception while matrix rate request %s (%s)", currencies, date_of_exchange)
+
+        if exchange_rates is None or not any(any(row) for row in exchange_rates):
+            logger.error("Exchange rates not found: matrix %s %s", date_of_exchange, currencies)
+            raise falcon.HTTPInternalServerError("Exchange rates not found", "Exchange rates not found")
+
+        logger.info("GET matrix %s %s currencies", date_of_exchange, len(currencies))
+
+        body = json.dumps(
+            {
+                "date": date_of_exchange.strftime("%Y-%m-%d"),
+                "currencies": currencies,
+                "exchange_rates": [[str(exchange_rate) if exchange_rate else None for exchange_rate in row] for row in exchange_rates],
+            },
+            separators=(",", ":"),
+        )
+        etag = blake2b(body.encode(), digest_size=16).hexdigest()
+        resp.etag = etag
+
+        if any(tag in ("*", etag) for tag in req.if_none_match or ()):
+            resp.status = falcon.HTTP_304
+        else:
+            resp.status = falcon.HTTP_200
+            resp.body = body
+
+
 class RangeRateResource(DatabaseResource):
     @http_api_logger
     def on_get_range_rate(self, req, resp, logger):
@@ -192,12 +328,15 @@ class HealthAliveResource(DatabaseResource):
 
 
 class API(falcon.API):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.container = di_container(__file__)
+    def __init__(self, *args, middleware=(), **kwargs):
+        container = di_container(__file__)
+        super().__init__(*args, middleware=[*middleware, SessionMiddleware(container)], **kwargs)
+        self.container = container
         self.add_route("/intervals", IntervalsRateResource(self.container), suffix="intervals_rate")
         self.add_route("/rate", DateRateResource(self.container), suffix="date_rate")
+        self.add_route("/rates/batch", BatchRateResource(self.container), suffix="batch_rate")
         self.add_route("/range", RangeRateResource(self.container), suffix="range_rate")
+        self.add_route("/matrix", MatrixRateResource(self.container), suffix="matrix_rate")
         self.add_route("/health", HealthCheckResource(), suffix="check_readiness")
         self.add_route("/health/alive", HealthAliveResource(self.container), suffix="check_liveness")
 
@@ -12,6 +12,21 @@ class ContextMiddleware:
         req.context.flow_id = DiContainer.flow_id()
 
 
+class SessionMiddleware:
+    def __init__(self, container):
+        """
+        :type container: gold_digger.di.DiContainer
+        """
+        self.container = container
+
+    def process_response(self, *_):
+        """
+        Close database session of the thread which served the request, its connection is returned to the pool and its transaction and objects
+        are discarded, so the next request of the thread starts with a new session.
+        """
+        self.container.db_session.remove()
+
+
 def http_api_logger(func):
     """
     :type func: types.FunctionType
@@ -1,26 +1,58 @@
+import asyncio
 from abc import ABCMeta, abstractmethod
-from datetime import date
+from collections import deque
+from datetime import date, timedelta
 from decimal import Decimal, InvalidOperation
 from functools import wraps
 from inspect import getcallargs
+from threading import Event, Lock
 
 import requests
 import requests.exceptions
 from cachetools import Cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..exceptions import ProviderUnavailable
 
 
 class Provider(metaclass=ABCMeta):
     DEFAULT_REQUEST_TIMEOUT = 15  # 15 seconds for both connect & read timeouts
+    DEFAULT_HTTP_POOL_SIZE = 10
+    DEFAULT_HTTP_MAX_RETRIES = 3
+    DEFAULT_HTTP_RETRY_BACKOFF_FACTOR = 0.5
+
+    all_currencies_in_one_request = False  # get_all_by_date costs the same single request as get_by_date
+    publishes_weekend_rates = True  # providers publishing only working days remember misses of weekends longer
+    http_pool_block = False  # requests wait for free connection of the pool instead of opening connections above size of the pool
+    negative_cache_ttls = {}  # seconds per kind of the miss which override defaults of ExchangeRateManager
 
-    def __init__(self, base_currency):
+    def __init__(
+        self,
+        base_currency,
+        *,
+        http_pool_size=DEFAULT_HTTP_POOL_SIZE,
+        http_max_retries=DEFAULT_HTTP_MAX_RETRIES,
+        http_retry_backoff_factor=DEFAULT_HTTP_RETRY_BACKOFF_FACTOR,
+        http_keep_alive=True,
+    ):
         """
         :type base_currency: str
+        :param http_pool_size: number of connections kept alive per host, or at most open per host if `http_pool_block` is set
+        :type http_pool_size: int
+        :param http_max_retries: number of retries of failed connections, reads and server errors
+        :type http_max_retries: int
+        :param http_retry_backoff_factor: retries are delayed by {backoff factor} * 2 ** {number of previous retries} seconds
+        :type http_retry_backoff_factor: float
+        :type http_keep_alive: bool
         """
         self._base_currency = base_currency
         self.has_request_limit = False
         self.request_limit_reached = False
 
         self._cache = Cache(maxsize=1)
+        self._cache_lock = Lock()  # provider is shared by threads of API worker, cachetools caches aren't thread-safe
+        self._session = self._create_session(http_pool_size, http_max_retries, http_retry_backoff_factor, http_keep_alive, self.http_pool_block)
 
     @property
     def base_currency(self):
@@ -61,30 +93,195 @@ class Provider(metaclass=ABCMeta):
         raise NotImplementedError
 
     @abstractmethod
-    def get_historical(self, origin_date, currencies, logger):
+    def get_historical(self, origin_date, currencies, logger, excluded_dates=frozenset(), stop=None):
         """
+        Generate historical rates since origin date in chunks ordered by date, so they can be stored while the rest is still being downloaded.
+
         :type origin_date: datetime.date
         :type currencies: set[str]
         :type logger: gold_digger.utils.ContextLogger
-        :rtype: dict[date, dict[str, decimal.Decimal]]
+        :param excluded_dates: dates which should not be requested, e.g. because their rates are already in database
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :param stop: once the event is set, no other request is started and the generation ends, e.g. when the update was cancelled
+        :type stop: threading.Event | None
+        :rtype: types.GeneratorType[dict[datetime.date, dict[str, decimal.Decimal]]]
         """
         raise NotImplementedError
 
+    async def get_all_by_date_async(self, date_of_exchange, currencies, logger):
+        """
+        Asynchronous variant of get_all_by_date. Requests are blocking, so they are run in the default executor of the running event loop.
+
+        :type date_of_exchange: datetime.date
+        :type currencies: set[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: dict[str, decimal.Decimal | None]
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_all_by_date, date_of_exchange, currencies, logger)
+
+    async def get_historical_async(self, origin_date, currencies, logger, excluded_dates=frozenset(), *, concurrency=1):
+        """
+        Asynchronous variant of get_historical. Providers which request rates day by day override it to request up to `concurrency` days at once.
+        Chunks are generated by thread of the default executor, which can't be interrupted, so it is stopped before its next request
+        when the iteration ends early, e.g. because the update was cancelled.
+
+        :type origin_date: datetime.date
+        :type currencies: set[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type concurrency: int
+        :rtype: collections.abc.AsyncIterator[dict[datetime.date, dict[str, decimal.Decimal]]]
+        """
+        loop = asyncio.get_running_loop()
+        stop = Event()
+        chunks = self.get_historical(origin_date, currencies, logger, excluded_dates=excluded_dates, stop=stop)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            stop.set()
+
+    def _get_historical_days(self, origin_date, excluded_dates, stop=None):
+        """
+        Generate days since origin date until yesterday which should be requested.
+
+        :type origin_date: datetime.date
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type stop: threading.Event | None
+        :rtype: types.GeneratorType[datetime.date]
+        """
+        date_of_exchange = origin_date
+        date_of_today = date.today()
+        if date_of_exchange > date_of_today:
+            date_of_exchange, date_of_today = date_of_today, date_of_exchange
+
+        step_by_day = timedelta(days=1)
+
+        while date_of_exchange != date_of_today and not self.request_limit_reached and not (stop and stop.is_set()):
+            if date_of_exchange not in excluded_dates:
+                yield date_of_exchange
+            date_of_exchange += step_by_day
+
+    def _get_historical_by_days(self, origin_date, currencies, logger, excluded_dates, stop=None):
+        """
+        Generate rates of each day since origin date until yesterday for providers which offer rates of all currencies by date.
+
+        :type origin_date: datetime.date
+        :type currencies: set[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type stop: threading.Event | None
+        :rtype: types.GeneratorType[dict[datetime.date, dict[str, decimal.Decimal]]]
+        """
+        for date_of_exchange in self._get_historical_days(origin_date, excluded_dates, stop):
+            try:
+                day_rates = self.get_all_by_date(date_of_exchange, currencies, logger)
+            except ProviderUnavailable:
+                continue  # failure is already logged, the day is requested again by the next update
+            if day_rates:
+                yield {date_of_exchange: day_rates}
+
+    async def _get_historical_by_days_async(self, origin_date, currencies, logger, excluded_dates, concurrency):
+        """
+        Asynchronous variant of _get_historical_by_days. Up to `concurrency` days are requested at once while the rates are still generated in order of days.
+
+        :type origin_date: datetime.date
+        :type currencies: set[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type concurrency: int
+        :rtype: collections.abc.AsyncIterator[dict[datetime.date, dict[str, decimal.Decimal]]]
+        """
+        pending = deque()
+        days = self._get_historical_days(origin_date, excluded_dates)
+        try:
+            while True:
+                for date_of_exchange in days:
+                    pending.append((date_of_exchange, asyncio.ensure_future(self.get_all_by_date_async(date_of_exchange, currencies, logger))))
+                    if len(pending) >= concurrency:
+                        break
+
+                if not pending:
+                    return
+
+                date_of_exchange, request = pending.popleft()
+                try:
+                    day_rates = await request
+                except ProviderUnavailable:
+                    continue  # failure is already logged, the day is requested again by the next update
+                if day_rates:
+                    yield {date_of_exchange: day_rates}
+        finally:
+            for _, request in pending:
+                request.cancel()
+
+    @staticmethod
+    def _create_session(pool_size, max_retries, retry_backoff_factor, keep_alive, pool_block=False):
+        """
+        Session is shared by all requests of the provider, so connections to its hosts are pooled and reused.
+
+        :type pool_size: int
+        :type max_retries: int
+        :type retry_backoff_factor: float
+        :type keep_alive: bool
+        :type pool_block: bool
+        :rtype: requests.Session
+        """
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=retry_backoff_factor,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,  # the last response is returned and logged as any other unsuccessful response
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=pool_block)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+
+        return session
+
     def _get(self, url, params=None, *, logger):
         """
         :type url: str
         :type params: dict[str, str]
         :type logger: gold_digger.utils.ContextLogger
         :rtype: requests.Response | None
+        :raises ProviderUnavailable: see _request
+        """
+        response = self._request(url, params, logger=logger)
+        if response.status_code == 200:
+            return response
+        else:
+            logger.error("%s - Status code: %s, URL: %s, Params: %s", self, response.status_code, url, params)
+
+    def _request(self, url, params=None, *, logger):
+        """
+        Failures which don't tell anything about the requested rates are raised, so they aren't mistaken for rates missing in the provider.
+
+        :type url: str
+        :type params: dict[str, str]
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: requests.Response
+        :raises ProviderUnavailable: request failed, timed out or the provider responded with server error or too many requests
         """
         try:
-            response = requests.get(url, params=params, timeout=self.DEFAULT_REQUEST_TIMEOUT)
-            if response.status_code == 200:
-                return response
-            else:
-                logger.error("%s - Status code: %s, URL: %s, Params: %s", self, response.status_code, url, params)
+            response = self._session.get(url, params=params, timeout=self.DEFAULT_REQUEST_TIMEOUT)
         except requests.exceptions.RequestException as e:
             logger.error("%s - Exception: %s, URL: %s, Params: %s", self, e, url, params)
+            raise ProviderUnavailable(f"{self} - {e}") from e
+
+        if response.status_code == 429 or response.status_code >= 500:
+            logger.error("%s - Status code: %s, URL: %s, Params: %s", self, response.status_code, url, params)
+            raise ProviderUnavailable(f"{self} - Status code: {response.status_code}")
+
+        return response
 
     def _to_decimal(self, value, currency=None, *, logger):
         """
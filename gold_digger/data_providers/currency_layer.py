@@ -1,6 +1,4 @@
 import re
-from collections import defaultdict
-from datetime import date, timedelta
 from operator import attrgetter
 
 from cachetools import cachedmethod, keys
@@ -15,6 +13,7 @@ class CurrencyLayer(Provider):
     """
     BASE_URL = "http://www.apilayer.net/api/live?access_key=%s"
     name = "currency_layer"
+    all_currencies_in_one_request = True
 
     def __init__(self, access_key, logger, *args, **kwargs):
         """
@@ -30,7 +29,7 @@ class CurrencyLayer(Provider):
 
         self.has_request_limit = True
 
-    @cachedmethod(cache=attrgetter("_cache"), key=lambda date_of_exchange, _: keys.hashkey(date_of_exchange))
+    @cachedmethod(cache=attrgetter("_cache"), key=lambda date_of_exchange, _: keys.hashkey(date_of_exchange), lock=attrgetter("_cache_lock"))
     def get_supported_currencies(self, date_of_exchange, logger):
         """
         :type date_of_exchange: datetime.date
@@ -108,34 +107,24 @@ class CurrencyLayer(Provider):
                 day_rates[currency] = decimal_value
         return day_rates
 
-    @Provider.check_request_limit(return_value={})
-    def get_historical(self, origin_date, currencies, logger):
+    def get_historical(self, origin_date, currencies, logger, excluded_dates=frozenset(), stop=None):
         """
         :type origin_date: datetime.date
         :type currencies: set[str]
         :type logger: gold_digger.utils.ContextLogger
-        :rtype: dict[date, dict[str, decimal.Decimal]]
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type stop: threading.Event | None
+        :rtype: types.GeneratorType[dict[datetime.date, dict[str, decimal.Decimal]]]
         """
-        day_rates = defaultdict(dict)
-        date_of_exchange = origin_date
-        date_of_today = date.today()
-
-        while date_of_exchange != date_of_today:
-            response = self._get(f"{self._url}&date={date_of_exchange.strftime('%Y-%m-%d')}&currencies={','.join(currencies)}", logger=logger)
-            records = {}
-            if response:
-                response = response.json()
-                if response["success"]:
-                    records = response.get("quotes", {})
-                elif response["error"]["code"] == 104:
-                    self.set_request_limit_reached(logger)
-                    break
-
-            for currency_pair, value in records.items():
-                currency = currency_pair[3:]
-                decimal_value = self._to_decimal(value, currency, logger=logger) if value is not None else None
-                if currency and decimal_value:
-                    day_rates[date_of_exchange][currency] = decimal_value
-            date_of_exchange = date_of_exchange + timedelta(1)
+        return self._get_historical_by_days(origin_date, currencies, logger, excluded_dates, stop)
 
-        return day_rates
+    def get_historical_async(self, origin_date, currencies, logger, excluded_dates=frozenset(), *, concurrency=1):
+        """
+        :type origin_date: datetime.date
+        :type currencies: set[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type concurrency: int
+        :rtype: collections.abc.AsyncIterator[dict[datetime.date, dict[str, decimal.Decimal]]]
+        """
+        return self._get_historical_by_days_async(origin_date, currencies, logger, excluded_dates, concurrency)
@@ -1,4 +1,3 @@
-from datetime import date, timedelta
 from operator import attrgetter
 
 from cachetools import cachedmethod, keys
@@ -14,6 +13,7 @@ class Fixer(Provider):
     """
     BASE_URL = "http://data.fixer.io/api/{path}?access_key=%s"
     name = "fixer.io"
+    all_currencies_in_one_request = True
 
     def __init__(self, access_key, logger, *args, **kwargs):
         """
@@ -29,7 +29,7 @@ class Fixer(Provider):
 
         self.has_request_limit = True
 
-    @cachedmethod(cache=attrgetter("_cache"), key=lambda date_of_exchange, _: keys.hashkey(date_of_exchange))
+    @cachedmethod(cache=attrgetter("_cache"), key=lambda date_of_exchange, _: keys.hashkey(date_of_exchange), lock=attrgetter("_cache_lock"))
     @Provider.check_request_limit(return_value=set())
     def get_supported_currencies(self, date_of_exchange, logger):
         """
@@ -118,28 +118,27 @@ class Fixer(Provider):
         """
         return self._to_decimal(currency_rate / base_currency_rate, logger=logger)
 
-    def get_historical(self, origin_date, currencies, logger):
+    def get_historical(self, origin_date, currencies, logger, excluded_dates=frozenset(), stop=None):
         """
         :type origin_date: datetime.date
         :type currencies: set[str]
         :type logger: gold_digger.utils.ContextLogger
-        :rtype: dict[date, dict[str, decimal.Decimal]]
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type stop: threading.Event | None
+        :rtype: types.GeneratorType[dict[datetime.date, dict[str, decimal.Decimal]]]
         """
-        date_of_exchange = origin_date
-        date_of_today = date.today()
-        if date_of_exchange > date_of_today:
-            date_of_exchange, date_of_today = date_of_today, date_of_exchange
+        return self._get_historical_by_days(origin_date, currencies, logger, excluded_dates, stop)
 
-        step_by_day = timedelta(days=1)
-        historical_rates = {}
-
-        while date_of_exchange != date_of_today:
-            day_rates = self.get_all_by_date(date_of_exchange, currencies, logger)
-            if day_rates:
-                historical_rates[date_of_exchange] = day_rates
-            date_of_exchange += step_by_day
-
-        return historical_rates
+    def get_historical_async(self, origin_date, currencies, logger, excluded_dates=frozenset(), *, concurrency=1):
+        """
+        :type origin_date: datetime.date
+        :type currencies: set[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type concurrency: int
+        :rtype: collections.abc.AsyncIterator[dict[datetime.date, dict[str, decimal.Decimal]]]
+        """
+        return self._get_historical_by_days_async(origin_date, currencies, logger, excluded_dates, concurrency)
 
     @Provider.check_request_limit(return_value=None)
     def _get_by_date(self, date_of_exchange, currency, logger):
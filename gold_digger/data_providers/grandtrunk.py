@@ -1,10 +1,12 @@
 from collections import defaultdict
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from operator import attrgetter
 
 from cachetools import cachedmethod, keys
 
 from ._provider import Provider
+from ..exceptions import ProviderUnavailable
+from ..utils.helpers import concurrent_map
 
 
 class GrandTrunk(Provider):
@@ -13,9 +15,12 @@ class GrandTrunk(Provider):
     It is currently free for use in low-volume and non-commercial settings.
     """
     BASE_URL = "http://currencies.apps.grandtrunk.net"
+    HISTORICAL_PERIOD_DAYS = 366
+    MAX_CONCURRENT_REQUESTS = 8  # GrandTrunk offers rates by currency, so they are requested in parallel
     name = "grandtrunk"
+    http_pool_block = True  # the service isn't overloaded by more connections than size of the pool, even by parallel requests of many threads
 
-    @cachedmethod(cache=attrgetter("_cache"), key=lambda date_of_exchange, _: keys.hashkey(date_of_exchange))
+    @cachedmethod(cache=attrgetter("_cache"), key=lambda date_of_exchange, _: keys.hashkey(date_of_exchange), lock=attrgetter("_cache_lock"))
     def get_supported_currencies(self, date_of_exchange, logger):
         """
         :type date_of_exchange: date
@@ -55,39 +60,89 @@ class GrandTrunk(Provider):
         """
         logger.debug("%s - Requesting for all rates for date %s", self, date_of_exchange)
 
-        day_rates = {}
         supported_currencies = self.get_supported_currencies(date_of_exchange, logger)
-        for currency in currencies:
-            if currency in supported_currencies:
-                response = self._get(f"{self.BASE_URL}/getrate/{date_of_exchange}/{self.base_currency}/{currency}", logger=logger)
-                if response:
-                    decimal_value = self._to_decimal(response.text.strip(), currency, logger=logger)
-                    if decimal_value:
-                        day_rates[currency] = decimal_value
-        return day_rates
+        currencies = [currency for currency in currencies if currency in supported_currencies]
+
+        def _get_rate(currency):
+            response = self._get(f"{self.BASE_URL}/getrate/{date_of_exchange}/{self.base_currency}/{currency}", logger=logger)
+            if response:
+                return self._to_decimal(response.text.strip(), currency, logger=logger)
 
-    def get_historical(self, origin_date, currencies, logger):
+        rates = concurrent_map(_get_rate, currencies, self.MAX_CONCURRENT_REQUESTS)
+        return {currency: decimal_value for currency, decimal_value in zip(currencies, rates) if decimal_value}
+
+    def get_historical(self, origin_date, currencies, logger, excluded_dates=frozenset(), stop=None):
         """
+        GrandTrunk offers ranges of rates by currency. Ranges of all currencies are requested for periods of days,
+        so rates of whole days are generated together.
+
         :type origin_date: date
         :type currencies: set[str]
         :type logger: gold_digger.utils.ContextLogger
-        :rtype: dict[date, dict[str, decimal.Decimal]]
+        :type excluded_dates: set[date] | frozenset[date]
+        :type stop: threading.Event | None
+        :rtype: types.GeneratorType[dict[date, dict[str, decimal.Decimal]]]
+        """
+        def _get_range(currency):
+            return [] if stop and stop.is_set() else self._get_range(start_date, end_date, currency, logger)
+
+        currencies = list(currencies)
+        for start_date, end_date in self._get_historical_periods(origin_date, date.today(), excluded_dates):
+            ranges = concurrent_map(_get_range, currencies, self.MAX_CONCURRENT_REQUESTS)
+            if stop and stop.is_set():
+                return  # ranges of some currencies weren't requested
+
+            day_rates = defaultdict(dict)
+            for currency, currency_range in zip(currencies, ranges):
+                for day, rate in currency_range:
+                    if day not in excluded_dates:
+                        day_rates[day][currency] = rate
+            if day_rates:
+                yield dict(day_rates)
+
+    def _get_historical_periods(self, origin_date, end_date, excluded_dates):
+        """
+        Split days since origin date until end date (inclusive) to periods of at most HISTORICAL_PERIOD_DAYS days.
+        Periods are shrunk to the first and the last day which isn't excluded.
+
+        :type origin_date: date
+        :type end_date: date
+        :type excluded_dates: set[date] | frozenset[date]
+        :rtype: types.GeneratorType[tuple[date, date]]
+        """
+        period_start = origin_date
+        while period_start <= end_date:
+            period_end = min(period_start + timedelta(days=self.HISTORICAL_PERIOD_DAYS - 1), end_date)
+            days = [period_start + timedelta(days=i) for i in range((period_end - period_start).days + 1)]
+            missing_days = [day for day in days if day not in excluded_dates]
+            if missing_days:
+                yield missing_days[0], missing_days[-1]
+            period_start = period_end + timedelta(days=1)
+
+    def _get_range(self, start_date, end_date, currency, logger):
+        """
+        :type start_date: date
+        :type end_date: date
+        :type currency: str
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: list[tuple[date, decimal.Decimal]]
         """
-        day_rates = defaultdict(dict)
-        origin_date_string = origin_date.strftime("%Y-%m-%d")
-        for currency in currencies:
-            response = self._get(f"{self.BASE_URL}/getrange/{origin_date_string}/{date.today()}/{self.base_currency}/{currency}", logger=logger)
-            records = response.text.strip().split("\n") if response else []
-            for record in records:
-                record = record.rstrip()
-                if record:
-                    try:
-                        date_string, exchange_rate_string = record.split(" ")
-                        day = datetime.strptime(date_string, "%Y-%m-%d")
-                    except ValueError as e:
-                        logger.error("%s - Parsing of rate & date on record '%s' failed: %s", self, record, e)
-                        continue
-                    decimal_value = self._to_decimal(exchange_rate_string, currency, logger=logger)
-                    if decimal_value:
-                        day_rates[day][currency] = decimal_value
+        day_rates = []
+        try:
+            response = self._get(f"{self.BASE_URL}/getrange/{start_date}/{end_date}/{self.base_currency}/{currency}", logger=logger)
+        except ProviderUnavailable:
+            return day_rates  # failure is already logged, rates of other currencies of the period are still stored
+        records = response.text.strip().split("\n") if response else []
+        for record in records:
+            record = record.rstrip()
+            if record:
+                try:
+                    date_string, exchange_rate_string = record.split(" ")
+                    day = datetime.strptime(date_string, "%Y-%m-%d").date()
+                except ValueError as e:
+                    logger.error("%s - Parsing of rate & date on record '%s' failed: %s", self, record, e)
+                    continue
+                decimal_value = self._to_decimal(exchange_rate_string, currency, logger=logger)
+                if decimal_value:
+                    day_rates.append((day, decimal_value))
         return day_rates
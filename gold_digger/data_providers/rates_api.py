@@ -1,7 +1,5 @@
-from datetime import date, timedelta
 from operator import attrgetter
 
-import requests
 from cachetools import cachedmethod, keys
 
 from ._provider import Provider
@@ -14,8 +12,10 @@ class RatesAPI(Provider):
     """
     BASE_URL = "http://api.ratesapi.io/api/{date}"
     name = "rates_api"
+    all_currencies_in_one_request = True
+    publishes_weekend_rates = False
 
-    @cachedmethod(cache=attrgetter("_cache"), key=lambda date_of_exchange, _: keys.hashkey(date_of_exchange))
+    @cachedmethod(cache=attrgetter("_cache"), key=lambda date_of_exchange, _: keys.hashkey(date_of_exchange), lock=attrgetter("_cache_lock"))
     def get_supported_currencies(self, date_of_exchange, logger):
         """
         :type date_of_exchange: datetime.date
@@ -103,40 +103,39 @@ class RatesAPI(Provider):
             except ValueError:
                 logger.exception("%s - Exception while parsing of the HTTP response.", self)
 
-    def get_historical(self, origin_date, currencies, logger):
+    def get_historical(self, origin_date, currencies, logger, excluded_dates=frozenset(), stop=None):
         """
         :type origin_date: datetime.date
         :type currencies: set[str]
         :type logger: gold_digger.utils.ContextLogger
-        :rtype: dict[date, dict[str, decimal.Decimal]]
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type stop: threading.Event | None
+        :rtype: types.GeneratorType[dict[datetime.date, dict[str, decimal.Decimal]]]
         """
-        date_of_exchange = origin_date
-        date_of_today = date.today()
-        if date_of_exchange > date_of_today:
-            date_of_exchange, date_of_today = date_of_today, date_of_exchange
+        return self._get_historical_by_days(origin_date, currencies, logger, excluded_dates, stop)
 
-        step_by_day = timedelta(days=1)
-        historical_rates = {}
-
-        while date_of_exchange != date_of_today:
-            day_rates = self.get_all_by_date(date_of_exchange, currencies, logger)
-            if day_rates:
-                historical_rates[date_of_exchange] = day_rates
-            date_of_exchange += step_by_day
-
-        return historical_rates
+    def get_historical_async(self, origin_date, currencies, logger, excluded_dates=frozenset(), *, concurrency=1):
+        """
+        :type origin_date: datetime.date
+        :type currencies: set[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :type excluded_dates: set[datetime.date] | frozenset[datetime.date]
+        :type concurrency: int
+        :rtype: collections.abc.AsyncIterator[dict[datetime.date, dict[str, decimal.Decimal]]]
+        """
+        return self._get_historical_by_days_async(origin_date, currencies, logger, excluded_dates, concurrency)
 
     def _get(self, url, params=None, *, logger):
         """
+        Unsuccessful responses are returned too, because Rates API describes the error in their body.
+
         :type url: str
         :type params: dict[str, str]
         :type logger: gold_digger.utils.ContextLogger
-        :rtype: requests.Response | None
+        :rtype: requests.Response
+        :raises ProviderUnavailable: see Provider._request
         """
-        try:
-            response = requests.get(url, params=params, timeout=self.DEFAULT_REQUEST_TIMEOUT)
-            if response.status_code != 200:
-                logger.error("%s - Status code: %s, URL: %s, Params: %s", self, response.status_code, url, params)
-            return response
-        except requests.exceptions.RequestException as e:
-            logger.error("%s - Exception: %s, URL: %s, Params: %s", self, e, url, params)
+        response = self._request(url, params, logger=logger)
+        if response.status_code != 200:
+            logger.error("%s - Status code: %s, URL: %s, Params: %s", self, response.status_code, url, params)
+        return response
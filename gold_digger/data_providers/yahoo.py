@@ -1,17 +1,20 @@
 from datetime import date
 
 from ._provider import Provider
-from ..utils.helpers import batches
+from ..utils.helpers import batches, concurrent_map
+from ..utils.negative_cache import NegativeCache
 
 
 class Yahoo(Provider):
     BASE_URL = "https://query1.finance.yahoo.com/v7/finance/spark?symbols={}&range=1d&interval=1d"
     SYMBOLS_PATTERN = "{}{}%3DX"
     SYMBOLS_BATCH_SIZE = 20  # Yahoo has recently started returning error for more
+    MAX_CONCURRENT_REQUESTS = 4  # batches of symbols are requested in parallel
     name = "yahoo"
+    negative_cache_ttls = {NegativeCache.MISSING: 7 * 24 * 60 * 60, NegativeCache.WEEKEND: 7 * 24 * 60 * 60}  # rates of past days are never offered
 
-    def __init__(self, base_currency, supported_currencies):
-        super().__init__(base_currency)
+    def __init__(self, base_currency, supported_currencies, **kwargs):
+        super().__init__(base_currency, **kwargs)
         self._downloaded_rates = {}
         self._supported_currencies = supported_currencies - {
             "ATS", "BEF", "BYR", "CUC", "CYP", "DEM", "EEK", "ESP", "FIM", "FRF", "GGP", "GRD", "IEP",
@@ -71,8 +74,12 @@ class Yahoo(Provider):
         currency_rates = {}
         symbols = {self.SYMBOLS_PATTERN.format(self.base_currency, currency) for currency in self.get_supported_currencies()}
 
-        for symbols_batch in batches(symbols, self.SYMBOLS_BATCH_SIZE):
-            response = self._get(self.BASE_URL.format(",".join(symbols_batch)), logger=logger)
+        responses = concurrent_map(
+            lambda symbols_batch: self._get(self.BASE_URL.format(",".join(symbols_batch)), logger=logger),
+            batches(symbols, self.SYMBOLS_BATCH_SIZE),
+            self.MAX_CONCURRENT_REQUESTS,
+        )
+        for response in responses:
             currency_rates.update(self._parse_response(response, logger))
 
         return currency_rates
@@ -101,8 +108,10 @@ class Yahoo(Provider):
 
         return rates
 
-    def get_historical(self, *_):
+    def get_historical(self, *_, **__):
         """
-        :rtype: dict
+        Yahoo offers only the latest rates.
+
+        :rtype: types.GeneratorType[dict]
         """
-        return {}
+        yield from ()
@@ -1,103 +1,428 @@
-from sqlalchemy import and_, func
-from sqlalchemy.exc import IntegrityError
+from contextlib import contextmanager
 
-from .db_model import ExchangeRate
+from sqlalchemy import and_, func, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from .db_model import ExchangeRate, ExchangeRateBest, ExchangeRateCumulativeSum
+from ..utils.helpers import batches
+
+
+_RATE_CHANGES = """
+    SELECT * FROM unnest(
+        CAST(:provider_ids AS integer[]), CAST(:currencies AS text[]), CAST(:dates AS date[]), CAST(:rate_sums AS numeric[]), CAST(:rate_counts AS integer[])
+    ) AS changes (provider_id, currency, date, rate_sum, rate_count)
+"""
+
+# new rows start from the previous running sum, changes are added to them together with the following rows by the next statement
+_INSERT_CUMULATIVE_SUMS = text(f"""
+    INSERT INTO "{ExchangeRateCumulativeSum.__tablename__}" (provider_id, currency, date, rate_sum, rate_count)
+    SELECT changes.provider_id, changes.currency, changes.date, coalesce(previous.rate_sum, 0), coalesce(previous.rate_count, 0)
+    FROM ({_RATE_CHANGES}) AS changes
+    LEFT JOIN LATERAL (
+        SELECT rate_sum, rate_count
+        FROM "{ExchangeRateCumulativeSum.__tablename__}" AS cumulative_sum
+        WHERE cumulative_sum.provider_id = changes.provider_id AND cumulative_sum.currency = changes.currency AND cumulative_sum.date < changes.date
+        ORDER BY cumulative_sum.date DESC
+        LIMIT 1
+    ) AS previous ON true
+    ON CONFLICT DO NOTHING
+""")
+
+# Changes of each currency are turned to shifts of running sums between the date of the change and the date of the next change,
+# so each running sum is updated once by the sum of changes up to its date instead of being joined with all changes before it.
+_UPDATE_CUMULATIVE_SUMS = text(f"""
+    UPDATE "{ExchangeRateCumulativeSum.__tablename__}" AS cumulative_sum
+    SET rate_sum = cumulative_sum.rate_sum + shift.rate_sum, rate_count = cumulative_sum.rate_count + shift.rate_count
+    FROM (
+        SELECT
+            provider_id, currency, date AS start_date, lead(date) OVER currency_changes AS end_date,
+            sum(rate_sum) OVER currency_changes AS rate_sum, sum(rate_count) OVER currency_changes AS rate_count
+        FROM (
+            SELECT provider_id, currency, date, sum(rate_sum) AS rate_sum, sum(rate_count) AS rate_count
+            FROM ({_RATE_CHANGES}) AS changes
+            GROUP BY provider_id, currency, date
+        ) AS date_changes
+        WINDOW currency_changes AS (PARTITION BY provider_id, currency ORDER BY date)
+    ) AS shift
+    WHERE cumulative_sum.provider_id = shift.provider_id AND cumulative_sum.currency = shift.currency
+        AND cumulative_sum.date >= shift.start_date AND (cumulative_sum.date < shift.end_date OR shift.end_date IS NULL)
+""")
+
+_SUM_OF_RATES_IN_PERIOD = text(f"""
+    SELECT provider.id, period_end.rate_count - coalesce(period_start.rate_count, 0), period_end.rate_sum - coalesce(period_start.rate_sum, 0)
+    FROM provider
+    JOIN LATERAL (
+        SELECT rate_sum, rate_count
+        FROM "{ExchangeRateCumulativeSum.__tablename__}"
+        WHERE provider_id = provider.id AND currency = :currency AND date <= :end_date
+        ORDER BY date DESC
+        LIMIT 1
+    ) AS period_end ON true
+    LEFT JOIN LATERAL (
+        SELECT rate_sum, rate_count
+        FROM "{ExchangeRateCumulativeSum.__tablename__}"
+        WHERE provider_id = provider.id AND currency = :currency AND date < :start_date
+        ORDER BY date DESC
+        LIMIT 1
+    ) AS period_start ON true
+    WHERE period_end.rate_count > coalesce(period_start.rate_count, 0)
+    ORDER BY provider.id
+""")
 
 
 class DaoExchangeRate:
+    UNIQUE_COLUMNS = ("date", "provider_id", "currency")
+    INSERT_BATCH_SIZE = 1000
+    CUMULATIVE_SUMS_LOCK = ExchangeRateCumulativeSum.__tablename__
+    # Rates are read as plain rows, ORM entities would be kept in the identity map of long-lived session and cost much more to build
+    RATE_COLUMNS = (ExchangeRate.provider_id, ExchangeRate.currency, ExchangeRate.date, ExchangeRate.rate)
+
     def __init__(self, db_session):
         """
         :type db_session: sqlalchemy.orm.Session
         """
         self.db_session = db_session
 
-    def insert_exchange_rate_to_db(self, records, logger):
+    def insert_exchange_rate_to_db(self, records, logger, *, overwrite=False):
         """
-        It would be much faster to call session.bulk_insert_mappings(ExchangeRate, records)
-        but we have to handle IntegrityError because API requests can perform rate update;
-        so in the case of explicit update some rates could be already in database and they
-        can also come at random times while updating explicitly.
+        Insert records by multi-row INSERT ... ON CONFLICT statements and commit them at once together with changes of cumulative sums.
+        Some rates could be already in database because API requests can perform rate update at random times,
+        such rates are either kept as they are or overwritten by the new rates.
 
         :type records: list[dict[str, decimal.Decimal | None | datetime.datetime | int]]
         :type logger: gold_digger.utils.ContextLogger
+        :type overwrite: bool
+        :return: currencies of records which were already in database (or duplicated in the records)
+        :rtype: set[str]
         """
+        unique_records = {}
         duplicates = set()
         for record in records:
-            try:
-                # TODO: use Postgres feature ON CONFLICT DO UPDATE instead of this
-                self.db_session.add(ExchangeRate(**record))
-                self.db_session.commit()
-            except IntegrityError:
-                self.db_session.rollback()
+            key = self._unique_key(record)
+            if key in unique_records:
                 duplicates.add(record["currency"])
+                if not overwrite:
+                    continue
+            unique_records[key] = record
+
+        self._lock_cumulative_sums({record["provider_id"] for record in unique_records.values()})
+
+        for records_batch in batches(unique_records.values(), self.INSERT_BATCH_SIZE):
+            previous_rates = self._get_rates_for_update(records_batch) if overwrite else {}
+
+            statement = insert(ExchangeRate).values(records_batch)
+            if overwrite:
+                statement = statement.on_conflict_do_update(index_elements=self.UNIQUE_COLUMNS, set_={"rate": statement.excluded.rate})
+            else:
+                statement = statement.on_conflict_do_nothing(index_elements=self.UNIQUE_COLUMNS)
+
+            # rows which weren't read before the insert were inserted by it, other writers of rates of the provider wait for lock of its cumulative sums
+            statement = statement.returning(ExchangeRate.date, ExchangeRate.provider_id, ExchangeRate.currency)
+            stored = {self._unique_key(row) for row in self.db_session.execute(statement)}
+            inserted = stored - previous_rates.keys()
+            duplicates.update(record["currency"] for record in records_batch if self._unique_key(record) not in inserted)
+
+            changes = []
+            for record in records_batch:
+                key = self._unique_key(record)
+                if key in stored:
+                    changes.append((record["provider_id"], record["currency"], record["date"], previous_rates.get(key), record["rate"]))
+            self._update_cumulative_sums(changes)
+
+        self.db_session.commit()
 
-        if duplicates:
+        if duplicates and overwrite:
+            logger.info(
+                "Exchange rates of following currencies were overwritten because rates from this provider were already in DB. Currencies: %s", duplicates
+            )
+        elif duplicates:
             logger.info(
                 "Exchange rates of following currencies were not updated because rates from this provider are already in DB. Currencies: %s", duplicates
             )
 
-        self.db_session.commit()
+        return duplicates
+
+    def _get_rates_for_update(self, records):
+        """
+        Rates of the records which are already in database, the rows are locked until the end of transaction.
+
+        :type records: list[dict[str, decimal.Decimal | None | datetime.datetime | int]]
+        :rtype: dict[tuple, decimal.Decimal | None]
+        """
+        rows = self.db_session\
+            .query(ExchangeRate.date, ExchangeRate.provider_id, ExchangeRate.currency, ExchangeRate.rate)\
+            .filter(
+                and_(
+                    # condition on the date alone lets Postgres scan only partitions of the dates
+                    ExchangeRate.date.in_({record["date"] for record in records}),
+                    tuple_(ExchangeRate.date, ExchangeRate.provider_id, ExchangeRate.currency).in_([self._unique_key(record) for record in records]),
+                )
+            )\
+            .with_for_update()\
+            .all()
+
+        return {(row.date, row.provider_id, row.currency): row.rate for row in rows}
+
+    def _lock_cumulative_sums(self, provider_ids):
+        """
+        Cumulative sums of one provider are changed by one transaction at a time, otherwise concurrent changes of different dates would miss each other.
+        Locks are acquired before the rates are inserted and released at the end of transaction.
+
+        :type provider_ids: set[int]
+        """
+        for provider_id in sorted(provider_ids):
+            self.db_session.execute(
+                text("SELECT pg_advisory_xact_lock(hashtext(:lock), :provider_id)"), {"lock": self.CUMULATIVE_SUMS_LOCK, "provider_id": provider_id}
+            )
+
+    def _update_cumulative_sums(self, changes):
+        """
+        Add changes of rates to the running sums of their dates and all following dates.
+
+        :param changes: changed rates as (provider_id, currency, date, previous rate, new rate), rate None means there wasn't any rate
+        :type changes: list[tuple[int, str, datetime.date, decimal.Decimal | None, decimal.Decimal | None]]
+        """
+        params = {"provider_ids": [], "currencies": [], "dates": [], "rate_sums": [], "rate_counts": []}
+        for provider_id, currency, date_of_exchange, previous_rate, rate in changes:
+            rate_count = (rate is not None) - (previous_rate is not None)
+            rate_sum = (rate or 0) - (previous_rate or 0)
+            if rate_count or rate_sum:
+                params["provider_ids"].append(provider_id)
+                params["currencies"].append(currency)
+                params["dates"].append(date_of_exchange)
+                params["rate_sums"].append(rate_sum)
+                params["rate_counts"].append(rate_count)
+
+        if params["dates"]:
+            self.db_session.execute(_INSERT_CUMULATIVE_SUMS, params)
+            self.db_session.execute(_UPDATE_CUMULATIVE_SUMS, params)
+
+    @classmethod
+    def _unique_key(cls, record):
+        """
+        :type record: dict | sqlalchemy.engine.RowProxy
+        :rtype: tuple
+        """
+        return tuple(record[column] for column in cls.UNIQUE_COLUMNS)
 
     def get_rates_by_date_currency(self, date_of_exchange, currency):
         """
         :type date_of_exchange: datetime.date
         :type currency: str
-        :rtype: list[gold_digger.database.db_model.ExchangeRate]
+        :rtype: list[sqlalchemy.util.KeyedTuple]
         """
-        return self.db_session.query(ExchangeRate).filter(
+        return self.db_session.query(*self.RATE_COLUMNS).filter(
             and_(ExchangeRate.date == date_of_exchange, ExchangeRate.currency == currency)
         ).all()
 
-    def get_rate_by_date_currency_provider(self, date_of_exchange, currency, provider_name):
+    def get_rates_by_dates_currencies(self, dates_of_exchange, currencies):
+        """
+        :type dates_of_exchange: set[datetime.date]
+        :type currencies: set[str]
+        :rtype: list[sqlalchemy.util.KeyedTuple]
+        """
+        return self.db_session.query(*self.RATE_COLUMNS).filter(
+            and_(ExchangeRate.date.in_(dates_of_exchange), ExchangeRate.currency.in_(currencies))
+        ).all()
+
+    def get_rates_by_date_provider(self, date_of_exchange, provider_id):
+        """
+        :type date_of_exchange: datetime.date
+        :type provider_id: int
+        :rtype: list[sqlalchemy.util.KeyedTuple]
+        """
+        return self.db_session.query(*self.RATE_COLUMNS).filter(
+            and_(ExchangeRate.date == date_of_exchange, ExchangeRate.provider_id == provider_id)
+        ).all()
+
+    def get_rates_in_period(self, start_date, end_date, currencies):
+        """
+        :type start_date: datetime.date
+        :type end_date: datetime.date
+        :type currencies: set[str]
+        :return: rates as (provider_id, currency, date, rate), missing rates are omitted
+        :rtype: list[sqlalchemy.util.KeyedTuple]
+        """
+        return self.db_session\
+            .query(*self.RATE_COLUMNS)\
+            .filter(
+                and_(
+                    ExchangeRate.date >= start_date,
+                    ExchangeRate.date <= end_date,
+                    ExchangeRate.currency.in_(currencies),
+                    ExchangeRate.rate.isnot(None)
+                )
+            )\
+            .all()
+
+    def get_rate_by_date_currency_provider(self, date_of_exchange, currency, provider_id):
         """
         :type date_of_exchange: datetime.date
         :type currency: str
-        :type provider_name: str
-        :rtype: gold_digger.database.db_model.ExchangeRate
+        :type provider_id: int
+        :rtype: sqlalchemy.util.KeyedTuple | None
         """
-        return self.db_session.query(ExchangeRate).filter(
-            and_(ExchangeRate.date == date_of_exchange, ExchangeRate.currency == currency, ExchangeRate.provider.has(name=provider_name))
+        return self.db_session.query(*self.RATE_COLUMNS).filter(
+            and_(ExchangeRate.date == date_of_exchange, ExchangeRate.currency == currency, ExchangeRate.provider_id == provider_id)
         ).first()
 
-    def insert_new_rate(self, date_of_exchange, db_provider, currency, rate):
+    def insert_new_rate(self, date_of_exchange, provider_id, currency, rate):
         """
         Insert new exchange rate for the specified date by specified provider.
         Date, currency and provider must be unique, therefore if record is already in database return it (without any update or insert)
 
         :type date_of_exchange: datetime.date
-        :type db_provider: gold_digger.database.db_model.Provider
+        :type provider_id: int
         :type currency: str
         :type rate: decimal.Decimal
-        :rtype: gold_digger.database.db_model.ExchangeRate
+        :rtype: sqlalchemy.engine.RowProxy | sqlalchemy.util.KeyedTuple
+        """
+        self._lock_cumulative_sums({provider_id})
+        statement = insert(ExchangeRate)\
+            .values(date=date_of_exchange, provider_id=provider_id, currency=currency, rate=rate)\
+            .on_conflict_do_nothing(index_elements=self.UNIQUE_COLUMNS)\
+            .returning(*self.RATE_COLUMNS)
+        db_record = self.db_session.execute(statement).first()
+        if db_record is not None:
+            self._update_cumulative_sums([(provider_id, currency, date_of_exchange, None, rate)])
+        self.db_session.commit()
+
+        if db_record is None:  # rate for this currency, date and provider is already in database
+            db_record = self.get_rate_by_date_currency_provider(date_of_exchange, currency, provider_id)
+        return db_record
+
+    @contextmanager
+    def rate_lock(self, date_of_exchange, provider_id, currency=None):
+        """
+        Transaction-level advisory lock of the rate, which is shared by all processes using the database.
+        It is released when the transaction is committed, e.g. by insert of the rate, or at the end of the block at the latest.
+
+        :type date_of_exchange: datetime.date
+        :type provider_id: int
+        :param currency: currency of the rate or None to lock rates of all currencies of the date
+        :type currency: str | None
         """
-        db_record = ExchangeRate(date=date_of_exchange, provider_id=db_provider.id, currency=currency, rate=rate)
+        self.db_session.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:lock))"), {"lock": f"{ExchangeRate.__tablename__}:{date_of_exchange}:{provider_id}:{currency or '*'}"}
+        )
         try:
-            self.db_session.add(db_record)
+            yield
+        except Exception:
+            self.db_session.rollback()
+            raise
+        else:
             self.db_session.commit()
-        except IntegrityError:  # rate for this currency, date and provider is already in database
+
+    @contextmanager
+    def best_rates_lock(self, dates_of_exchange):
+        """
+        Transaction-level advisory locks of best rates of the dates, so their concurrent refreshes are serialized and the last one sees rates
+        stored by all of them. Changes of best rates are committed at the end of the block.
+
+        :type dates_of_exchange: list[datetime.date]
+        """
+        for date_of_exchange in sorted(dates_of_exchange):
+            self.db_session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:lock))"), {"lock": f"{ExchangeRateBest.__tablename__}:{date_of_exchange}"})
+        try:
+            yield
+        except Exception:
             self.db_session.rollback()
-            db_record = self.get_rate_by_date_currency_provider(date_of_exchange, currency, db_provider.name)
-        return db_record
+            raise
+        else:
+            self.db_session.commit()
 
-    def get_sum_of_rates_in_period(self, start_date, end_date, currency):
+    def save_best_rates(self, best_rates):
+        """
+        Best rates which didn't change are not written again.
+
+        :param best_rates: best rate of each (date, currency), None removes the best rate
+        :type best_rates: dict[tuple[datetime.date, str], decimal.Decimal | None]
+        """
+        rows = [dict(date=date_of_exchange, currency=currency, rate=rate) for (date_of_exchange, currency), rate in best_rates.items() if rate is not None]
+        for rows_batch in batches(rows, self.INSERT_BATCH_SIZE):
+            statement = insert(ExchangeRateBest).values(rows_batch)
+            statement = statement.on_conflict_do_update(
+                index_elements=[ExchangeRateBest.date, ExchangeRateBest.currency],
+                set_={"rate": statement.excluded.rate},
+                where=ExchangeRateBest.rate != statement.excluded.rate,
+            )
+            self.db_session.execute(statement)
+
+        removed = [key for key, rate in best_rates.items() if rate is None]
+        for removed_batch in batches(removed, self.INSERT_BATCH_SIZE):
+            self.db_session\
+                .query(ExchangeRateBest)\
+                .filter(tuple_(ExchangeRateBest.date, ExchangeRateBest.currency).in_(removed_batch))\
+                .delete(synchronize_session=False)
+
+    def get_best_rates_by_dates_currencies(self, dates_of_exchange, currencies, provider_ids=None):
+        """
+        :type dates_of_exchange: set[datetime.date]
+        :type currencies: set[str]
+        :param provider_ids: providers whose rates of the date and currency of each best rate are counted as `providers` column
+        :type provider_ids: set[int] | None
+        :rtype: list[sqlalchemy.util.KeyedTuple]
+        """
+        columns = [ExchangeRateBest.date, ExchangeRateBest.currency, ExchangeRateBest.rate]
+        if provider_ids is not None:
+            providers = self.db_session.query(func.count()).filter(
+                and_(
+                    ExchangeRate.date.in_(dates_of_exchange),  # lets the planner prune partitions of other years
+                    ExchangeRate.date == ExchangeRateBest.date,
+                    ExchangeRate.currency == ExchangeRateBest.currency,
+                    ExchangeRate.provider_id.in_(provider_ids),
+                )
+            )
+            columns.append(providers.correlate(ExchangeRateBest).as_scalar().label("providers"))
+
+        return self.db_session.query(*columns).filter(
+            and_(ExchangeRateBest.date.in_(dates_of_exchange), ExchangeRateBest.currency.in_(currencies))
+        ).all()
+
+    def get_dates_with_rates(self):
+        """
+        :rtype: list[datetime.date]
+        """
+        return [day for day, in self.db_session.query(ExchangeRate.date).distinct().order_by(ExchangeRate.date)]
+
+    def get_dates_with_complete_rates(self, provider_id, start_date, end_date, currencies, coverage):
         """
-        SELECT provider_id, count(*), SUM(rate) FROM "USD_exchange_rates" WHERE date >= '%Y-%m-%d' AND date <= '%Y-%m-%d' GROUP BY provider_id
+        Dates on which the provider has rates of at least `coverage` share of the currencies.
 
+        :type provider_id: int
         :type start_date: datetime.date
         :type end_date: datetime.date
-        :type currency: str
-        :rtype: list[tuple[int, int, decimal.Decimal]]
+        :param currencies: currencies which the provider is expected to have rates of
+        :type currencies: set[str]
+        :param coverage: value in interval (0, 1]
+        :type coverage: float
+        :rtype: set[datetime.date]
         """
-        return self.db_session\
-            .query(ExchangeRate.provider_id, func.count(), func.sum(ExchangeRate.rate))\
+        dates = self.db_session\
+            .query(ExchangeRate.date)\
             .filter(
                 and_(
+                    ExchangeRate.provider_id == provider_id,
                     ExchangeRate.date >= start_date,
                     ExchangeRate.date <= end_date,
-                    ExchangeRate.currency == currency,
-                    ExchangeRate.rate.isnot(None)
+                    ExchangeRate.currency.in_(currencies),
                 )
             )\
-            .group_by(ExchangeRate.provider_id)\
-            .order_by(ExchangeRate.provider_id)\
+            .group_by(ExchangeRate.date)\
+            .having(func.count() >= len(currencies) * coverage)\
             .all()
+
+        return {day for day, in dates}
+
+    def get_sum_of_rates_in_period(self, start_date, end_date, currency):
+        """
+        Sum of rates of each provider in the period is difference of cumulative sums at the end of the period and before its start,
+        so it costs two index lookups per provider regardless of length of the period.
+
+        :type start_date: datetime.date
+        :type end_date: datetime.date
+        :type currency: str
+        :rtype: list[tuple[int, int, decimal.Decimal]]
+        """
+        rows = self.db_session.execute(_SUM_OF_RATES_IN_PERIOD, {"start_date": start_date, "end_date": end_date, "currency": currency})
+        return [tuple(row) for row in rows]
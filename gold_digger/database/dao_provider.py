@@ -1,3 +1,7 @@
+from threading import Lock
+
+from sqlalchemy.dialects.postgresql import insert
+
 from .db_model import Provider
 
 
@@ -8,15 +12,42 @@ class DaoProvider:
         """
         self.db_session = db_session
 
-    def get_or_create_provider_by_name(self, name):
+        # Providers are never renamed or deleted, so their ids are loaded once and kept for the whole life of the process
+        self._provider_ids = None
+        self._provider_ids_lock = Lock()
+
+    def get_provider_id(self, name):
         """
         :type name: str
-        :rtype: Provider
+        :return: id of the provider or None if it isn't in database yet
+        :rtype: int | None
         """
-        provider = self.db_session.query(Provider).filter(Provider.name == name).first()
-        if not provider:
-            provider = Provider(name=name)
-            self.db_session.add(provider)
-            self.db_session.commit()
+        with self._provider_ids_lock:
+            return self._get_provider_ids().get(name)
 
-        return provider
+    def get_or_create_provider_id(self, name):
+        """
+        Missing provider is created. It is safe when the same provider is created concurrently by other process.
+
+        :type name: str
+        :rtype: int
+        """
+        with self._provider_ids_lock:
+            provider_ids = self._get_provider_ids()
+            if name not in provider_ids:
+                statement = insert(Provider).values(name=name).on_conflict_do_nothing(index_elements=[Provider.name]).returning(Provider.id)
+                provider_id = self.db_session.execute(statement).scalar()
+                if provider_id is None:  # created by other process meanwhile
+                    provider_id = self.db_session.query(Provider.id).filter(Provider.name == name).scalar()
+                self.db_session.commit()
+                provider_ids[name] = provider_id
+
+            return provider_ids[name]
+
+    def _get_provider_ids(self):
+        """
+        :rtype: dict[str, int]
+        """
+        if self._provider_ids is None:
+            self._provider_ids = {name: provider_id for provider_id, name in self.db_session.query(Provider.id, Provider.name)}
+        return self._provider_ids
@@ -1,9 +1,11 @@
 from decimal import Decimal
 
-from sqlalchemy import BigInteger, Column, DECIMAL, Date, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy import BigInteger, Column, DDL, DECIMAL, Date, ForeignKey, Integer, String, UniqueConstraint, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+from .partitions import create_partitions
+
 Base = declarative_base()
 
 
@@ -16,13 +18,18 @@ class Provider(Base):
 
 
 class ExchangeRate(Base):
+    """
+    Rates are partitioned by years of their dates, so queries of dates or periods scan only partitions of their years
+    and vacuum and index maintenance of old years isn't repeated as history grows. Keys of the table must contain the date.
+    """
     __tablename__ = "USD_exchange_rates"
     __table_args__ = (
         UniqueConstraint("date", "provider_id", "currency"),
+        {"postgresql_partition_by": "RANGE (date)"},
     )
 
-    id = Column(BigInteger, primary_key=True)
-    date = Column(Date)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    date = Column(Date, primary_key=True)
     provider_id = Column(Integer, ForeignKey("provider.id"))
     currency = Column(String, nullable=False)
     rate = Column(DECIMAL)
@@ -37,3 +44,38 @@ class ExchangeRate(Base):
             currency=base_currency,
             rate=Decimal(1.0)
         )
+
+
+class ExchangeRateCumulativeSum(Base):
+    """
+    Running sum and count of rates of the provider and currency up to the date (inclusive), so sum of rates in any period is difference of two rows.
+    Rows exist only for dates with rate and they are maintained by DaoExchangeRate together with the rates.
+    """
+    __tablename__ = "USD_exchange_rates_cumulative_sum"
+
+    provider_id = Column(Integer, ForeignKey("provider.id"), primary_key=True)
+    currency = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    rate_sum = Column(DECIMAL, nullable=False)
+    rate_count = Column(Integer, nullable=False)
+
+
+class ExchangeRateBest(Base):
+    """
+    Best rate of the currency on the date picked from rates of all providers, so reads of past dates don't pick it again.
+    Rows are maintained by ExchangeRateManager whenever rates are stored.
+    """
+    __tablename__ = "USD_exchange_rates_best"
+
+    date = Column(Date, primary_key=True)
+    currency = Column(String, primary_key=True)
+    rate = Column(DECIMAL, nullable=False)
+
+
+# Serves lookups of rates by currency and date or date range with index-only scans. The unique constraint can't, its leading column is date.
+# INCLUDE clause isn't supported by SQLAlchemy 1.3 Index, so the index is created by DDL statement after the table.
+currency_date_index = DDL(
+    'CREATE INDEX IF NOT EXISTS "ix_USD_exchange_rates_currency_date" ON %(table)s (currency, date) INCLUDE (provider_id, rate, id)'
+)
+event.listen(ExchangeRate.__table__, "after_create", currency_date_index)
+event.listen(ExchangeRate.__table__, "after_create", create_partitions)
@@ -0,0 +1,151 @@
+from datetime import date
+
+from sqlalchemy import text
+
+from .db_model import ExchangeRate, ExchangeRateBest, ExchangeRateCumulativeSum, currency_date_index
+from .partitions import create_yearly_partitions, is_partitioned
+from ..exceptions import ImproperlyConfigured
+
+_REBUILD_CUMULATIVE_SUMS = text(f"""
+    INSERT INTO "{ExchangeRateCumulativeSum.__tablename__}" (provider_id, currency, date, rate_sum, rate_count)
+    SELECT provider_id, currency, date, sum(rate) OVER running, count(*) OVER running
+    FROM "{ExchangeRate.__tablename__}"
+    WHERE rate IS NOT NULL
+    WINDOW running AS (PARTITION BY provider_id, currency ORDER BY date)
+""")
+
+
+def create_currency_date_index(connection):
+    """
+    :type connection: sqlalchemy.engine.Connection
+    """
+    connection.execute(currency_date_index.against(ExchangeRate.__table__))
+
+
+def create_cumulative_sums(connection):
+    """
+    :type connection: sqlalchemy.engine.Connection
+    """
+    if not ExchangeRateCumulativeSum.__table__.exists(connection):
+        ExchangeRateCumulativeSum.__table__.create(connection)
+        rebuild_cumulative_sums(connection)
+
+
+def rebuild_cumulative_sums(connection):
+    """
+    Compute cumulative sums from all rates again. Rates can't be changed meanwhile, so the sums are consistent with them.
+
+    :type connection: sqlalchemy.engine.Connection
+    """
+    connection.execute(f'LOCK TABLE "{ExchangeRate.__tablename__}" IN SHARE MODE')
+    connection.execute(f'DELETE FROM "{ExchangeRateCumulativeSum.__tablename__}"')
+    connection.execute(_REBUILD_CUMULATIVE_SUMS)
+
+
+def create_best_rates(connection):
+    """
+    Best rates are picked by ExchangeRateManager, so the table is filled by `rebuild-best-rates` command.
+
+    :type connection: sqlalchemy.engine.Connection
+    """
+    ExchangeRateBest.__table__.create(connection, checkfirst=True)
+
+
+def create_next_year_partitions(connection):
+    """
+    Partitions of rates are created a year ahead, so rates of new year are never stored in default partition.
+    Tables which aren't partitioned yet are converted by `partition-db` command.
+
+    :type connection: sqlalchemy.engine.Connection
+    """
+    if is_partitioned(connection, ExchangeRate.__tablename__):
+        create_yearly_partitions(connection, ExchangeRate.__tablename__, range(date.today().year, date.today().year + 2))
+
+
+def partition_exchange_rates(connection):
+    """
+    Replace table of rates created before it was partitioned by table partitioned by years. Rates are copied to the new table with their ids,
+    the old table is locked meanwhile. Cumulative sums and best rates are kept, they don't refer to rows of rates.
+
+    :type connection: sqlalchemy.engine.Connection
+    """
+    table_name = ExchangeRate.__tablename__
+    if is_partitioned(connection, table_name):
+        return
+
+    old_table_name = f"{table_name}_unpartitioned"
+    connection.execute(f'ALTER TABLE "{table_name}" RENAME TO "{old_table_name}"')
+    connection.execute(f'ALTER SEQUENCE "{table_name}_id_seq" RENAME TO "{old_table_name}_id_seq"')
+    connection.execute('DROP INDEX IF EXISTS "ix_USD_exchange_rates_currency_date"')
+    # names of constraints would clash with constraints of the new table, not-null constraints of primary key can be dropped only after it
+    constraints = connection.execute(
+        text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) ORDER BY contype = 'n'"), {"table": f'"{old_table_name}"'}
+    ).fetchall()
+    for constraint, in constraints:
+        connection.execute(f'ALTER TABLE "{old_table_name}" DROP CONSTRAINT "{constraint}"')
+
+    ExchangeRate.__table__.create(connection)
+    first_year = connection.execute(f'SELECT CAST(extract(year FROM min(date)) AS integer) FROM "{old_table_name}"').scalar() or date.today().year
+    create_yearly_partitions(connection, table_name, range(first_year, date.today().year + 2))
+
+    connection.execute(f"""
+        INSERT INTO "{table_name}" (id, date, provider_id, currency, rate)
+        SELECT id, date, provider_id, currency, rate FROM "{old_table_name}"
+    """)
+    connection.execute(f"SELECT setval(pg_get_serial_sequence('\"{table_name}\"', 'id'), max(id)) FROM \"{old_table_name}\" HAVING count(*) > 0")
+    connection.execute(f'DROP TABLE "{old_table_name}"')
+    connection.execute(f'ANALYZE "{table_name}"')
+
+
+def convert_rate_type(connection, precision, scale):
+    """
+    Store rates and best rates as NUMERIC(precision, scale), or as unbounded NUMERIC if precision is None. Existing rates are rounded to the scale,
+    so cumulative sums are computed again from the rounded rates. Best rates have to be picked again from the rounded rates by the caller.
+
+    :type connection: sqlalchemy.engine.Connection
+    :type precision: int | None
+    :type scale: int
+    :return: whether the type was changed
+    :rtype: bool
+    :raises ImproperlyConfigured: if table of rates doesn't exist
+    """
+    if precision is None:
+        scale = None
+
+    current_type = connection.execute(
+        text("SELECT numeric_precision, numeric_scale FROM information_schema.columns WHERE table_name = :table AND column_name = 'rate'"),
+        {"table": ExchangeRate.__tablename__},
+    ).first()
+    if current_type is None:
+        raise ImproperlyConfigured(f"Table {ExchangeRate.__tablename__} doesn't exist, create it by initialize-db command first.")
+    if tuple(current_type) == (precision, scale):
+        return False
+
+    rate_type = "numeric" if precision is None else f"numeric({precision}, {scale})"
+    for table in (ExchangeRate.__table__, ExchangeRateBest.__table__):
+        if table.exists(connection):
+            connection.execute(f'ALTER TABLE "{table.name}" ALTER COLUMN rate TYPE {rate_type}')
+    rebuild_cumulative_sums(connection)
+    return True
+
+
+MIGRATIONS = (
+    create_currency_date_index,
+    create_cumulative_sums,
+    create_best_rates,
+    create_next_year_partitions,
+)
+
+
+def migrate(connection, logger):
+    """
+    Bring schema of existing database up to date with the model. All migrations are idempotent, so they can be run repeatedly.
+    Every migration runs in its own transaction.
+
+    :type connection: sqlalchemy.engine.Connection
+    :type logger: gold_digger.utils.ContextLogger
+    """
+    for migration in MIGRATIONS:
+        logger.info("Running migration %s", migration.__name__)
+        with connection.begin():
+            migration(connection)
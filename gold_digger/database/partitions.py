@@ -0,0 +1,62 @@
+from datetime import date
+
+from sqlalchemy import text
+
+# default origin of update-all, rates of older years are stored in default partition unless a partition of their year is created
+FIRST_PARTITION_YEAR = 2015
+
+
+def is_partitioned(connection, table_name):
+    """
+    :type connection: sqlalchemy.engine.Connection
+    :type table_name: str
+    :rtype: bool
+    """
+    return connection.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": f'"{table_name}"'}).scalar() is True
+
+
+def create_default_partition(connection, table_name):
+    """
+    Default partition stores rows of dates without partition of their year, so no insert fails for lack of partition.
+
+    :type connection: sqlalchemy.engine.Connection
+    :type table_name: str
+    """
+    connection.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}_default" PARTITION OF "{table_name}" DEFAULT')
+
+
+def create_yearly_partitions(connection, table_name, years):
+    """
+    Create missing partitions of the years. Rows of the year already stored in default partition are moved to the new partition,
+    writes to default partition wait meanwhile. Indexes and constraints of the table are created on the partition when it is attached.
+
+    :type connection: sqlalchemy.engine.Connection
+    :type table_name: str
+    :type years: collections.abc.Iterable[int]
+    """
+    default_partition = f"{table_name}_default"
+    for year in years:
+        partition = f"{table_name}_{year}"
+        with connection.begin():
+            if connection.execute(text("SELECT to_regclass(:partition)"), {"partition": f'"{partition}"'}).scalar() is not None:
+                continue
+
+            start, end = date(year, 1, 1), date(year + 1, 1, 1)
+            connection.execute(f'LOCK TABLE "{default_partition}" IN EXCLUSIVE MODE')
+            connection.execute(f'CREATE TABLE "{partition}" (LIKE "{table_name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+            connection.execute(text(f"""
+                WITH moved AS (DELETE FROM "{default_partition}" WHERE date >= :start AND date < :end RETURNING *)
+                INSERT INTO "{partition}" SELECT * FROM moved
+            """), {"start": start, "end": end})
+            connection.execute(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{partition}" FOR VALUES FROM (\'{start}\') TO (\'{end}\')')
+
+
+def create_partitions(target, connection, **_):
+    """
+    Listener of creation of the table partitioned by years, it creates default partition and partitions up to the next year.
+
+    :type target: sqlalchemy.Table
+    :type connection: sqlalchemy.engine.Connection
+    """
+    create_default_partition(connection, target.name)
+    create_yearly_partitions(connection, target.name, range(FIRST_PARTITION_YEAR, date.today().year + 2))
@@ -5,7 +5,7 @@ from urllib.parse import quote
 from uuid import uuid4
 
 import graypy
-from cached_property import cached_property as service
+from cached_property import threaded_cached_property as service
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
@@ -46,36 +46,58 @@ class DiContainer:
 
     @service
     def db_connection(self):
-        self._db_connection = create_engine("{dialect}://{user}:{password}@{host}:{port}/{name}".format(
-            dialect=settings.DATABASE_DIALECT,
-            user=settings.DATABASE_USER,
-            password=settings.DATABASE_PASSWORD,
-            host=settings.DATABASE_HOST,
-            port=settings.DATABASE_PORT,
-            name=settings.DATABASE_NAME
-        ))
+        self._db_connection = create_engine(
+            "{dialect}://{user}:{password}@{host}:{port}/{name}".format(
+                dialect=settings.DATABASE_DIALECT,
+                user=settings.DATABASE_USER,
+                password=settings.DATABASE_PASSWORD,
+                host=settings.DATABASE_HOST,
+                port=settings.DATABASE_PORT,
+                name=settings.DATABASE_NAME
+            ),
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_recycle=settings.DATABASE_POOL_RECYCLE,
+            pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+            connect_args={
+                "application_name": settings.DATABASE_APPLICATION_NAME,
+                "options": f"-c statement_timeout={settings.DATABASE_STATEMENT_TIMEOUT}",
+            },
+        )
         return self._db_connection
 
     @service
     def db_session(self):
         """
-        :rtype: sqlalchemy.orm.Session
+        Registry of sessions, which is used as session of the current thread, so every thread has its own session.
+        API requests release the session by `remove` when they end, so no session outlives its request.
+
+        :rtype: sqlalchemy.orm.scoping.scoped_session
         """
         self._db_session = scoped_session(sessionmaker(self.db_connection))
-        return self._db_session()
+        return self._db_session
 
     @property
     def base_currency(self):
         return "USD"
 
+    @property
+    def http_options(self):
+        return {
+            "http_pool_size": settings.HTTP_POOL_SIZE,
+            "http_max_retries": settings.HTTP_MAX_RETRIES,
+            "http_retry_backoff_factor": settings.HTTP_RETRY_BACKOFF_FACTOR,
+            "http_keep_alive": settings.HTTP_KEEP_ALIVE,
+        }
+
     @service
     def data_providers(self):
         providers = (
-            GrandTrunk(self.base_currency),
-            CurrencyLayer(settings.SECRETS_CURRENCY_LAYER_ACCESS_KEY, self.logger(), self.base_currency),
-            Yahoo(self.base_currency, settings.SUPPORTED_CURRENCIES),
-            Fixer(settings.SECRETS_FIXER_ACCESS_KEY, self.logger(), self.base_currency),
-            RatesAPI(self.base_currency),
+            GrandTrunk(self.base_currency, **self.http_options),
+            CurrencyLayer(settings.SECRETS_CURRENCY_LAYER_ACCESS_KEY, self.logger(), self.base_currency, **self.http_options),
+            Yahoo(self.base_currency, settings.SUPPORTED_CURRENCIES, **self.http_options),
+            Fixer(settings.SECRETS_FIXER_ACCESS_KEY, self.logger(), self.base_currency, **self.http_options),
+            RatesAPI(self.base_currency, **self.http_options),
         )
         return {provider.name: provider for provider in providers}
 
@@ -87,6 +109,12 @@ class DiContainer:
             list(self.data_providers.values()),
             self.base_currency,
             settings.SUPPORTED_CURRENCIES,
+            settings.BEST_RATES_CACHE_SIZE,
+            settings.TODAY_BEST_RATES_CACHE_TTL,
+            settings.RATE_REQUESTS_ADVISORY_LOCK,
+            settings.NEGATIVE_CACHE_SIZE,
+            settings.NEGATIVE_CACHE_TTLS,
+            settings.BEST_RATES_CACHE_TTL,
         )
 
     @classmethod
@@ -1,2 +1,8 @@
 class ImproperlyConfigured(Exception):
     pass
+
+
+class ProviderUnavailable(Exception):
+    """
+    Request of the provider failed regardless of the requested rates, e.g. for timeout, connection error or server error.
+    """
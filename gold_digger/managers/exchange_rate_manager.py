@@ -1,19 +1,69 @@
+import asyncio
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, timedelta
-from decimal import Decimal
+from decimal import Context, Decimal, localcontext
 from itertools import combinations
+from operator import attrgetter
+from threading import Lock
+from time import time
+
+import numpy as np
+from cachetools import TTLCache
 
 from ..database.db_model import ExchangeRate
+from ..exceptions import ProviderUnavailable
+from ..utils.helpers import batches
+from ..utils.negative_cache import NegativeCache
+from ..utils.single_flight import SingleFlight
 
 
 class ExchangeRateManager:
-    def __init__(self, dao_exchange_rate, dao_provider, data_providers, base_currency, supported_currencies):
+    DEFAULT_BEST_RATES_CACHE_SIZE = 10000
+    DEFAULT_BEST_RATES_CACHE_TTL = 60 * 60  # 1 hour in seconds
+    DEFAULT_TODAY_BEST_RATES_CACHE_TTL = 15 * 60  # 15 minutes in seconds
+    DEFAULT_HISTORICAL_CONCURRENCY = 10
+    DEFAULT_NEGATIVE_CACHE_SIZE = 10000
+    DEFAULT_NEGATIVE_CACHE_TTLS = {  # in seconds
+        NegativeCache.WEEKEND: 24 * 60 * 60,
+        NegativeCache.UNSUPPORTED: 24 * 60 * 60,
+        NegativeCache.MISSING: 60 * 60,
+        NegativeCache.ERROR: 60,
+    }
+    COMPLETE_DATE_COVERAGE = 0.9  # tolerates currencies which are added to or removed from the provider over time
+    SUM_OF_RATES_PRECISION = 100  # rates are stored with arbitrary precision and database sums them exactly
+    BEST_RATES_REFRESH_BATCH_SIZE = 31  # dates whose best rates are refreshed by one transaction
+
+    def __init__(
+        self,
+        dao_exchange_rate,
+        dao_provider,
+        data_providers,
+        base_currency,
+        supported_currencies,
+        best_rates_cache_size=DEFAULT_BEST_RATES_CACHE_SIZE,
+        today_best_rates_cache_ttl=DEFAULT_TODAY_BEST_RATES_CACHE_TTL,
+        rate_requests_advisory_lock=False,
+        negative_cache_size=DEFAULT_NEGATIVE_CACHE_SIZE,
+        negative_cache_ttls=None,
+        best_rates_cache_ttl=DEFAULT_BEST_RATES_CACHE_TTL,
+    ):
         """
         :type dao_exchange_rate: gold_digger.database.DaoExchangeRate
         :type dao_provider: gold_digger.database.DaoProvider
         :type data_providers: list[gold_digger.data_providers.Provider]
         :type base_currency: str
         :type supported_currencies: set[str]
+        :type best_rates_cache_size: int
+        :type today_best_rates_cache_ttl: int
+        :param rate_requests_advisory_lock: deduplicate requests of missing rates across processes by database advisory locks
+        :type rate_requests_advisory_lock: bool
+        :param negative_cache_size: number of remembered misses of providers, misses aren't requested again until they expire
+        :type negative_cache_size: int
+        :param negative_cache_ttls: seconds per kind of the miss, providers can override them by their `negative_cache_ttls`
+        :type negative_cache_ttls: dict[str, int] | None
+        :param best_rates_cache_ttl: seconds for which best rates of past dates are cached, rates stored by other processes are missed meanwhile
+        :type best_rates_cache_ttl: int
         """
         self._dao_exchange_rate = dao_exchange_rate
         self._dao_provider = dao_provider
@@ -21,38 +71,199 @@ class ExchangeRateManager:
         self._base_currency = base_currency
         self._supported_currencies = supported_currencies
 
-    def update_all_rates_by_date(self, date_of_exchange, data_providers, logger):
+        # Concurrent requests of the same missing rate wait for the first one instead of requesting the provider again
+        self._rate_requests = SingleFlight()
+        self._rate_requests_advisory_lock = rate_requests_advisory_lock
+
+        self._negative_cache = NegativeCache(maxsize=negative_cache_size)
+        self._negative_cache_ttls = {**self.DEFAULT_NEGATIVE_CACHE_TTLS, **(negative_cache_ttls or {})}
+
+        # Historical rates rarely change once all providers stored them, today's rates can still be completed by the daily update.
+        # Best rates picked without some provider are kept only until the miss of the provider is requested again.
+        self._best_rates_cache = TTLCache(maxsize=best_rates_cache_size, ttl=best_rates_cache_ttl)
+        self._partial_best_rates_cache = TTLCache(maxsize=best_rates_cache_size, ttl=self._negative_cache_ttls[NegativeCache.ERROR])
+        self._today_best_rates_cache = TTLCache(maxsize=len(supported_currencies) or 1, ttl=today_best_rates_cache_ttl)
+        self._best_rates_cache_lock = Lock()
+
+    def update_all_rates_by_date(self, date_of_exchange, data_providers, logger, *, overwrite=False, max_workers=1):
         """
+        Rates are requested from the providers concurrently. They are stored one by one in the calling thread as the providers finish,
+        because database session must not be shared between threads.
+
         :type date_of_exchange: datetime.date
         :type data_providers: list[gold_digger.data_providers.Provider]
         :type logger: gold_digger.utils.ContextLogger
+        :param overwrite: overwrite rates which are already in database
+        :type overwrite: bool
+        :param max_workers: number of providers requested at the same time
+        :type max_workers: int
+        """
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider") as executor:
+            futures = {
+                executor.submit(self._get_all_rates_by_date, data_provider, date_of_exchange, logger): data_provider for data_provider in data_providers
+            }
+            for future in as_completed(futures):
+                data_provider = futures[future]
+                try:
+                    day_rates = future.result()
+                    if day_rates:
+                        provider_id = self._dao_provider.get_or_create_provider_id(data_provider.name)
+                        records = [dict(currency=currency, rate=rate, date=date_of_exchange, provider_id=provider_id) for currency, rate in day_rates.items()]
+                        self._dao_exchange_rate.insert_exchange_rate_to_db(records, logger, overwrite=overwrite)
+                        self._refresh_best_rates({date_of_exchange}, set(day_rates), logger)
+                        logger.info("Update succeeded: Provider %s, date %s.", data_provider, date_of_exchange)
+                    else:
+                        logger.error("Update failed: Provider %s did not return any exchange rates, date %s.", data_provider, date_of_exchange)
+                except Exception:
+                    logger.exception("Update failed: Provider %s raised unexpected exception, date %s.", data_provider, date_of_exchange)
+
+    def _get_all_rates_by_date(self, data_provider, date_of_exchange, logger):
+        """
+        :type data_provider: gold_digger.data_providers.Provider
+        :type date_of_exchange: datetime.date
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: dict[str, decimal.Decimal | None]
         """
-        for data_provider in data_providers:
+        logger.info("Update started: Provider %s, date %s.", data_provider, date_of_exchange)
+        start = time()
+        try:
+            return data_provider.get_all_by_date(date_of_exchange, self._supported_currencies, logger)
+        finally:
+            duration = time() - start
+            logger.info(
+                "Provider %s responded in %.2f seconds, date %s.", data_provider, duration, date_of_exchange,
+                extra={"provider": data_provider.name, "duration_in_secs": duration},
+            )
+
+    def update_all_historical_rates(self, origin_date, logger, *, overwrite=False, checkpoint=None):
+        """
+        Dates which already have rates of all currencies in database are skipped unless the rates should be overwritten.
+
+        :type origin_date: datetime.date
+        :type logger: gold_digger.utils.ContextLogger
+        :param overwrite: overwrite rates which are already in database
+        :type overwrite: bool
+        :param checkpoint: progress of previous update which should be resumed
+        :type checkpoint: gold_digger.managers.update_checkpoint.UpdateCheckpoint | None
+        """
+        for data_provider in self._data_providers:
+            update = self._start_historical_update(data_provider, origin_date, logger, overwrite, checkpoint)
+            if update is None:
+                continue
+
+            provider_id, provider_origin_date, complete_dates = update
             try:
-                logger.info("Update started: Provider %s, date %s.", data_provider, date_of_exchange)
-                day_rates = data_provider.get_all_by_date(date_of_exchange, self._supported_currencies, logger)
-                if day_rates:
-                    provider = self._dao_provider.get_or_create_provider_by_name(data_provider.name)
-                    records = [dict(currency=currency, rate=rate, date=date_of_exchange, provider_id=provider.id) for currency, rate in day_rates.items()]
-                    self._dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
-                    logger.info("Update succeeded: Provider %s, date %s.", data_provider, date_of_exchange)
-                else:
-                    logger.error("Update failed: Provider %s did not return any exchange rates, date %s.", data_provider, date_of_exchange)
+                # rates are stored chunk by chunk as they are downloaded, so already stored chunks are kept even if the provider fails later
+                for date_rates in data_provider.get_historical(provider_origin_date, self._supported_currencies, logger, excluded_dates=complete_dates):
+                    self._store_historical_rates(data_provider, provider_id, date_rates, logger, overwrite, checkpoint)
             except Exception:
-                logger.exception("Update failed: Provider %s raised unexpected exception, date %s.", data_provider, date_of_exchange)
+                logger.exception("Updating all historical rates from %s provider failed.", data_provider)
 
-    def update_all_historical_rates(self, origin_date, logger):
+    async def update_all_historical_rates_async(
+        self, origin_date, logger, *, overwrite=False, checkpoint=None, concurrency=DEFAULT_HISTORICAL_CONCURRENCY,
+    ):
         """
+        Asynchronous variant of update_all_historical_rates, all providers are updated at once and each of them is requested for up to
+        `concurrency` dates at once. Requests are blocking, so they are run by pool of `concurrency` threads per provider.
+        Rates are stored in the event loop thread, so database session is never shared between threads.
+
         :type origin_date: datetime.date
         :type logger: gold_digger.utils.ContextLogger
+        :param overwrite: overwrite rates which are already in database
+        :type overwrite: bool
+        :param checkpoint: progress of previous update which should be resumed
+        :type checkpoint: gold_digger.managers.update_checkpoint.UpdateCheckpoint | None
+        :param concurrency: number of requests to one provider at the same time
+        :type concurrency: int
         """
-        for data_provider in self._data_providers:
-            logger.info("Updating all historical rates from %s provider", data_provider)
-            date_rates = data_provider.get_historical(origin_date, self._supported_currencies, logger)
-            provider = self._dao_provider.get_or_create_provider_by_name(data_provider.name)
-            for day, day_rates in date_rates.items():
-                records = [dict(currency=currency, rate=rate, date=day, provider_id=provider.id) for currency, rate in day_rates.items()]
-                self._dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+        executor = ThreadPoolExecutor(max_workers=concurrency * max(len(self._data_providers), 1), thread_name_prefix="provider")
+        asyncio.get_running_loop().set_default_executor(executor)
+        try:
+            await asyncio.gather(*(
+                self._update_historical_rates_async(data_provider, origin_date, logger, overwrite, checkpoint, concurrency)
+                for data_provider in self._data_providers
+            ))
+        finally:
+            # Requests waiting for thread of the executor are cancelled with their tasks and providers stop before their next request,
+            # so only requests which are already running are finished when the update is cancelled.
+            executor.shutdown(wait=False)
+
+    async def _update_historical_rates_async(self, data_provider, origin_date, logger, overwrite, checkpoint, concurrency):
+        """
+        :type data_provider: gold_digger.data_providers.Provider
+        :type origin_date: datetime.date
+        :type logger: gold_digger.utils.ContextLogger
+        :type overwrite: bool
+        :type checkpoint: gold_digger.managers.update_checkpoint.UpdateCheckpoint | None
+        :type concurrency: int
+        """
+        update = self._start_historical_update(data_provider, origin_date, logger, overwrite, checkpoint)
+        if update is None:
+            return
+
+        provider_id, provider_origin_date, complete_dates = update
+        try:
+            historical_rates = data_provider.get_historical_async(
+                provider_origin_date, self._supported_currencies, logger, excluded_dates=complete_dates, concurrency=concurrency,
+            )
+            async for date_rates in historical_rates:
+                self._store_historical_rates(data_provider, provider_id, date_rates, logger, overwrite, checkpoint)
+        except Exception:
+            logger.exception("Updating all historical rates from %s provider failed.", data_provider)
+
+    def _start_historical_update(self, data_provider, origin_date, logger, overwrite, checkpoint):
+        """
+        :type data_provider: gold_digger.data_providers.Provider
+        :type origin_date: datetime.date
+        :type logger: gold_digger.utils.ContextLogger
+        :type overwrite: bool
+        :type checkpoint: gold_digger.managers.update_checkpoint.UpdateCheckpoint | None
+        :return: id of the provider, date the update starts from and dates which should be skipped or None if the provider is up to date
+        :rtype: (int, datetime.date, set[datetime.date]) | None
+        """
+        today = date.today()
+        provider_origin_date = origin_date
+        last_date = checkpoint.get_last_date(data_provider.name) if checkpoint else None
+        if last_date and last_date >= origin_date:
+            provider_origin_date = last_date + timedelta(1)
+            logger.info("Resuming update of historical rates from %s provider since %s", data_provider, provider_origin_date)
+        if provider_origin_date > today:
+            logger.info("Historical rates from %s provider are up to date", data_provider)
+            return None
+
+        provider_id = self._dao_provider.get_or_create_provider_id(data_provider.name)
+        complete_dates = set()
+        if not overwrite:
+            try:
+                # without the list of currencies of the provider, dates are complete only with rates of all supported currencies
+                currencies = (data_provider.get_supported_currencies(today, logger) & self._supported_currencies) or self._supported_currencies
+            except ProviderUnavailable:
+                logger.error("Updating all historical rates from %s provider skipped, provider is unavailable.", data_provider)
+                return None
+            complete_dates = self._dao_exchange_rate.get_dates_with_complete_rates(
+                provider_id, provider_origin_date, today, currencies, self.COMPLETE_DATE_COVERAGE
+            )
+
+        logger.info("Updating all historical rates from %s provider, %s dates are already complete", data_provider, len(complete_dates))
+        return provider_id, provider_origin_date, complete_dates
+
+    def _store_historical_rates(self, data_provider, provider_id, date_rates, logger, overwrite, checkpoint):
+        """
+        :type data_provider: gold_digger.data_providers.Provider
+        :type provider_id: int
+        :type date_rates: dict[datetime.date, dict[str, decimal.Decimal]]
+        :type logger: gold_digger.utils.ContextLogger
+        :type overwrite: bool
+        :type checkpoint: gold_digger.managers.update_checkpoint.UpdateCheckpoint | None
+        """
+        records = [
+            dict(currency=currency, rate=rate, date=day, provider_id=provider_id)
+            for day, day_rates in date_rates.items() for currency, rate in day_rates.items()
+        ]
+        self._dao_exchange_rate.insert_exchange_rate_to_db(records, logger, overwrite=overwrite)
+        self._refresh_best_rates(set(date_rates), {record["currency"] for record in records}, logger)
+        if checkpoint:
+            checkpoint.save(data_provider.name, max(date_rates))
 
     def get_or_update_rate_by_date(self, date_of_exchange, currency, logger):
         """
@@ -63,45 +274,223 @@ class ExchangeRateManager:
         :type date_of_exchange: datetime.date
         :type currency: str
         :type logger: gold_digger.utils.ContextLogger
-        :rtype: list[gold_digger.database.db_model.ExchangeRate]
+        :return: rates with provider_id, currency, date and rate
+        :rtype: list[sqlalchemy.util.KeyedTuple | gold_digger.database.db_model.ExchangeRate]
         """
         if currency == self._base_currency:
             return [ExchangeRate.base(self._base_currency)]
 
-        today = date.today()
         exchange_rates = self._dao_exchange_rate.get_rates_by_date_currency(date_of_exchange, currency)
-        exchange_rates_providers = set(r.provider.name for r in exchange_rates)
-        missing_provider_rates = [provider for provider in self._data_providers if provider.name not in exchange_rates_providers]
+        return self._update_missing_rates(date_of_exchange, currency, exchange_rates, logger)
+
+    def _update_missing_rates(self, date_of_exchange, currency, exchange_rates, logger, *, request_missing=True):
+        """
+        Complete rates of the currency already loaded from database with rates of providers which are missing for the date.
+
+        :type date_of_exchange: datetime.date
+        :type currency: str
+        :type exchange_rates: list[sqlalchemy.util.KeyedTuple]
+        :type logger: gold_digger.utils.ContextLogger
+        :param request_missing: request providers for their missing rates, otherwise they are completed only by yesterday's rates from database
+        :type request_missing: bool
+        :rtype: list[sqlalchemy.util.KeyedTuple]
+        """
+        today = date.today()
+        exchange_rates_providers = {r.provider_id for r in exchange_rates}
+        missing_provider_rates = [
+            provider for provider in self._data_providers if self._dao_provider.get_provider_id(provider.name) not in exchange_rates_providers
+        ]
         for data_provider in missing_provider_rates:
             if date_of_exchange == today:
                 logger.info("Today's rates for provider %s aren't ready yet, Using yesterday's rates.", data_provider.name)
                 previous_day = date_of_exchange - timedelta(1)
-                rate = self._dao_exchange_rate.get_rate_by_date_currency_provider(previous_day, currency, data_provider.name)
+                provider_id = self._dao_provider.get_provider_id(data_provider.name)
+                rate = self._dao_exchange_rate.get_rate_by_date_currency_provider(previous_day, currency, provider_id) if provider_id else None
                 if rate:
                     exchange_rates.append(rate)
                     continue
-                else:
+                elif request_missing:
                     logger.info("Yesterday's rates for provider %s not found. Requesting API.", data_provider.name)
-            elif data_provider.has_request_limit:
+
+            if not request_missing:
+                continue
+            elif date_of_exchange != today and data_provider.has_request_limit:
                 #  For providers with request limit we don't want to request rates from API for historical data, because it can easily generate hundreds
                 #  of requests at once and the limit is then soon exceeded.
                 logger.info("Rates for provider %s aren't in database and provider has disabled requests for historical data.", data_provider.name)
                 continue
 
+            day_key, rate_key = (data_provider.name, date_of_exchange, None), (data_provider.name, date_of_exchange, currency)
+            miss = self._negative_cache.get(day_key) or self._negative_cache.get(rate_key)
+            if miss:
+                logger.debug("Rate of %s (%s) of provider %s is skipped for recent miss (%s).", currency, date_of_exchange, data_provider.name, miss)
+                continue
+
             try:
                 if currency not in data_provider.get_supported_currencies(today, logger):
                     continue
-                rate = data_provider.get_by_date(date_of_exchange, currency, logger)
-                if rate:
-                    db_provider = self._dao_provider.get_or_create_provider_by_name(data_provider.name)
-                    exchange_rate = self._dao_exchange_rate.insert_new_rate(date_of_exchange, db_provider, currency, rate)
+                if data_provider.all_currencies_in_one_request:
+                    # rates of all currencies are stored, so requests of other currencies of the date are served from database
+                    day_rates = self._rate_requests.do((data_provider.name, date_of_exchange), self._request_day_rates, data_provider, date_of_exchange, logger)
+                    exchange_rate = day_rates.get(currency)
+                    if not day_rates:
+                        self._add_miss(data_provider, day_key, self._get_missing_kind(data_provider, date_of_exchange), date_of_exchange)
+                    elif not exchange_rate:
+                        self._add_miss(data_provider, rate_key, NegativeCache.UNSUPPORTED, date_of_exchange)
+                else:
+                    exchange_rate = self._rate_requests.do(
+                        (data_provider.name, date_of_exchange, currency), self._request_rate, data_provider, date_of_exchange, currency, logger
+                    )
+                    if not exchange_rate:
+                        self._add_miss(data_provider, rate_key, self._get_missing_kind(data_provider, date_of_exchange), date_of_exchange)
+                if exchange_rate:
                     exchange_rates.append(exchange_rate)
 
+            except ProviderUnavailable:
+                logger.warning("Requesting exchange rate for %s (%s) from provider '%s' failed.", currency, date_of_exchange, data_provider)
+                self._add_miss(data_provider, day_key if data_provider.all_currencies_in_one_request else rate_key, NegativeCache.ERROR, date_of_exchange)
             except Exception:
                 logger.exception("Requesting exchange rate for %s (%s) from provider '%s' failed.", currency, date_of_exchange, data_provider)
+                self._add_miss(data_provider, rate_key, NegativeCache.ERROR, date_of_exchange)
 
         return exchange_rates
 
+    def _request_rate(self, data_provider, date_of_exchange, currency, logger):
+        """
+        Request missing rate from the provider and store it. With advisory lock only one process requests the rate at a time,
+        the others wait for it and then find the rate in database.
+
+        :type data_provider: gold_digger.data_providers.Provider
+        :type date_of_exchange: datetime.date
+        :type currency: str
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: sqlalchemy.util.KeyedTuple | None
+        """
+        provider_id = self._dao_provider.get_or_create_provider_id(data_provider.name)
+        if not self._rate_requests_advisory_lock:
+            return self._request_and_insert_rate(data_provider, provider_id, date_of_exchange, currency, logger)
+
+        with self._dao_exchange_rate.rate_lock(date_of_exchange, provider_id, currency):
+            exchange_rate = self._dao_exchange_rate.get_rate_by_date_currency_provider(date_of_exchange, currency, provider_id)
+            if exchange_rate is None:
+                exchange_rate = self._request_and_insert_rate(data_provider, provider_id, date_of_exchange, currency, logger)
+            return exchange_rate
+
+    def _request_and_insert_rate(self, data_provider, provider_id, date_of_exchange, currency, logger):
+        """
+        :type data_provider: gold_digger.data_providers.Provider
+        :type provider_id: int
+        :type date_of_exchange: datetime.date
+        :type currency: str
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: sqlalchemy.util.KeyedTuple | None
+        """
+        rate = data_provider.get_by_date(date_of_exchange, currency, logger)
+        if rate:
+            exchange_rate = self._dao_exchange_rate.insert_new_rate(date_of_exchange, provider_id, currency, rate)
+            self._refresh_best_rates({date_of_exchange}, {currency}, logger)
+            return exchange_rate
+
+    @staticmethod
+    def _get_missing_kind(data_provider, date_of_exchange):
+        """
+        :type data_provider: gold_digger.data_providers.Provider
+        :type date_of_exchange: datetime.date
+        :rtype: str
+        """
+        if not data_provider.publishes_weekend_rates and date_of_exchange.weekday() >= 5:
+            return NegativeCache.WEEKEND
+        return NegativeCache.MISSING
+
+    def _add_miss(self, data_provider, key, kind, date_of_exchange):
+        """
+        Remember miss of the provider for TTL of its kind. Today's rates can still be published, so they aren't remembered longer than usual miss.
+
+        :type data_provider: gold_digger.data_providers.Provider
+        :type key: tuple
+        :type kind: str
+        :type date_of_exchange: datetime.date
+        """
+        ttl = data_provider.negative_cache_ttls.get(kind, self._negative_cache_ttls[kind])
+        if date_of_exchange == date.today():
+            ttl = min(ttl, self._negative_cache_ttls[NegativeCache.MISSING])
+
+        self._negative_cache.add(key, kind, ttl)
+
+    def _request_day_rates(self, data_provider, date_of_exchange, logger):
+        """
+        Request missing rates of all currencies of the date from the provider and store them. With advisory lock only one process requests the rates
+        at a time, the others wait for it and then find the rates in database.
+
+        :type data_provider: gold_digger.data_providers.Provider
+        :type date_of_exchange: datetime.date
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: dict[str, sqlalchemy.util.KeyedTuple]
+        """
+        provider_id = self._dao_provider.get_or_create_provider_id(data_provider.name)
+        if not self._rate_requests_advisory_lock:
+            exchange_rates = self._request_and_insert_day_rates(data_provider, provider_id, date_of_exchange, logger)
+        else:
+            with self._dao_exchange_rate.rate_lock(date_of_exchange, provider_id):
+                exchange_rates = self._dao_exchange_rate.get_rates_by_date_provider(date_of_exchange, provider_id)
+                if not exchange_rates:
+                    exchange_rates = self._request_and_insert_day_rates(data_provider, provider_id, date_of_exchange, logger)
+
+        return {exchange_rate.currency: exchange_rate for exchange_rate in exchange_rates}
+
+    def _request_and_insert_day_rates(self, data_provider, provider_id, date_of_exchange, logger):
+        """
+        :type data_provider: gold_digger.data_providers.Provider
+        :type provider_id: int
+        :type date_of_exchange: datetime.date
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: list[sqlalchemy.util.KeyedTuple]
+        """
+        day_rates = data_provider.get_all_by_date(date_of_exchange, self._supported_currencies, logger)
+        if not day_rates:
+            return []
+
+        records = [dict(currency=currency, rate=rate, date=date_of_exchange, provider_id=provider_id) for currency, rate in day_rates.items()]
+        self._dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+        self._refresh_best_rates({date_of_exchange}, set(day_rates), logger)
+        return self._dao_exchange_rate.get_rates_by_date_provider(date_of_exchange, provider_id)
+
+    def _refresh_best_rates(self, dates_of_exchange, currencies, logger):
+        """
+        Pick the best rates of the currencies on the dates again from rates of all providers and store them. Dates are refreshed in batches,
+        each of them under advisory locks of its dates. Failure is only logged, because the rates are already stored and best rates can be rebuilt.
+
+        :type dates_of_exchange: set[datetime.date]
+        :type currencies: set[str]
+        :type logger: gold_digger.utils.ContextLogger
+        """
+        try:
+            for dates_batch in batches(sorted(dates_of_exchange), self.BEST_RATES_REFRESH_BATCH_SIZE):
+                with self._dao_exchange_rate.best_rates_lock(dates_batch):
+                    rates = defaultdict(list)
+                    exchange_rates = self._dao_exchange_rate.get_rates_by_dates_currencies(set(dates_batch), currencies)
+                    for exchange_rate in sorted(exchange_rates, key=attrgetter("provider_id")):  # rates are picked in order of providers
+                        if exchange_rate.rate is not None:
+                            rates[(exchange_rate.date, exchange_rate.currency)].append(exchange_rate.rate)
+
+                    keys = [(date_of_exchange, currency) for date_of_exchange in dates_batch for currency in currencies]
+                    best_rates = self.pick_the_best_many([rates[key] for key in keys])
+                    self._dao_exchange_rate.save_best_rates(dict(zip(keys, best_rates)))
+                self._forget_best_rates(keys)
+        except Exception:
+            logger.exception("Refreshing best rates of %s dates failed, they can be fixed by rebuild of best rates.", len(dates_of_exchange))
+
+    def rebuild_best_rates(self, logger):
+        """
+        Pick best rates of all dates with rates in database again, e.g. after they were added to existing database.
+
+        :type logger: gold_digger.utils.ContextLogger
+        """
+        dates = self._dao_exchange_rate.get_dates_with_rates()
+        logger.info("Rebuilding best rates of %s dates", len(dates))
+        for dates_batch in batches(dates, self.BEST_RATES_REFRESH_BATCH_SIZE):
+            self._refresh_best_rates(set(dates_batch), self._supported_currencies, logger)
+
     @staticmethod
     def pick_the_best(rates):
         """
@@ -118,9 +507,12 @@ class ExchangeRateManager:
         if len(rates) in (1, 2):
             return rates[0]
 
+        # floats can't be subtracted from Decimal rates, so rates mixing both are compared as exact Decimals
+        exact = any(isinstance(rate, Decimal) for rate in rates)
         differences = defaultdict(list)
         for a, b in combinations(rates, 2):
-            differences[abs(a - b)].extend((a, b))  # if (a,b)=1 and (b,c)=1 then differences[1]=[a,b,b,c]
+            difference = Decimal(a) - Decimal(b) if exact else a - b
+            differences[abs(difference)].extend((a, b))  # if (a,b)=1 and (b,c)=1 then differences[1]=[a,b,b,c]
 
         minimal_difference, rates = min(differences.items())
         if len(rates) == 2:
@@ -128,6 +520,124 @@ class ExchangeRateManager:
         else:
             return Counter(rates).most_common(1)[0][0]  # [(decimal.Decimal, occurrences)]
 
+    @classmethod
+    def pick_the_best_many(cls, rates):
+        """
+        Vectorized pick_the_best of many currencies at once. Picked rates are identical to the ones picked by pick_the_best from each row.
+        Decimal rates are compared as integers scaled by the same power of ten, rows which don't fit into int64 are compared as objects.
+
+        :param rates: rates of currencies (rows) by providers (columns) in order of the providers, missing rates are None or NaN
+            and shorter rows are completed by missing rates
+        :type rates: numpy.ndarray | list[list[float | decimal.Decimal | None]]
+        :return: the best rate of each currency or None if all its rates are missing
+        :rtype: list[float | decimal.Decimal | None]
+        """
+        if not isinstance(rates, np.ndarray):
+            rows, rates = rates, np.full((len(rates), max(map(len, rates), default=0)), None, dtype=object)
+            for row, row_rates in enumerate(rows):
+                rates[row, :len(row_rates)] = row_rates
+        if rates.ndim != 2:
+            raise ValueError("Rates of currencies by providers have to be two-dimensional.")
+
+        if rates.dtype.kind == "f":
+            present = ~np.isnan(rates)
+            columns = cls._pick_the_best_columns(np.where(present, rates, 0), present)
+        else:
+            present = np.asarray(np.not_equal(rates, None) & (rates == rates), dtype=bool)  # NaN != NaN
+            values, scaled = cls._scale_decimal_rates(rates, present)
+            columns = np.full(len(rates), -1)
+            columns[scaled] = cls._pick_the_best_columns(values[scaled], present[scaled])
+            if not scaled.all():
+                columns[~scaled] = cls._pick_the_best_columns(cls._exact_rates(np.where(present, rates, 0)[~scaled]), present[~scaled])
+
+        return [rates[row, column] if column >= 0 else None for row, column in enumerate(columns)]
+
+    @staticmethod
+    def _scale_decimal_rates(rates, present):
+        """
+        Scale Decimal rates of each row to integers by the highest number of their decimal places. Their differences are then computed exactly
+        as int64, like Decimal subtraction does while the numbers have fewer digits than precision of the context.
+
+        :type rates: numpy.ndarray
+        :type present: numpy.ndarray
+        :return: scaled rates and mask of rows which were scaled
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        values = np.zeros(rates.shape, dtype=np.int64)
+        decimals = np.where(present, rates, Decimal(0))
+        finite = np.asarray(np.frompyfunc(lambda rate: isinstance(rate, Decimal) and rate.is_finite(), 1, 1)(decimals), dtype=bool).all(axis=1)
+
+        # rows with more significant digits than int64 has, e.g. of rates converted from floats, are skipped before looking for exponents
+        scaled = np.zeros(len(rates), dtype=bool)
+        scaled[finite] = np.asarray(np.frompyfunc(Context(prec=18).plus, 1, 1)(decimals[finite]) == decimals[finite], dtype=bool).all(axis=1)
+        decimals = decimals[scaled]
+
+        exponents = np.frompyfunc(lambda rate: rate.as_tuple().exponent, 1, 1)(decimals).astype(np.int64)
+        scales = np.array([10 ** int(scale) for scale in np.maximum(-exponents.min(axis=1, initial=0), 0)], dtype=object)
+        decimals = decimals * scales[:, None]  # exact unless the values have more digits than int64 which they must not have anyway
+        fits = np.asarray(abs(decimals) < 2 ** 62, dtype=bool).all(axis=1)  # differences of the values have to fit into int64 too
+
+        values[scaled] = np.where(fits[:, None], decimals, 0).astype(np.int64)
+        scaled[scaled] = fits
+        return values, scaled
+
+    @staticmethod
+    def _exact_rates(values):
+        """
+        Floats of rows with Decimal rates are converted to exact Decimals, like pick_the_best compares them.
+
+        :type values: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        mixed = np.asarray(np.frompyfunc(lambda rate: isinstance(rate, Decimal), 1, 1)(values), dtype=bool).any(axis=1)
+        if mixed.any():
+            values = values.copy()
+            values[mixed] = np.frompyfunc(lambda rate: Decimal(rate) if isinstance(rate, float) else rate, 1, 1)(values[mixed])
+        return values
+
+    @staticmethod
+    def _pick_the_best_columns(values, present):
+        """
+        For each row, pairs of rates with minimal difference are listed in order of combinations and the most common rate of the pairs wins,
+        ties are decided by the first occurrence of the rate. This is what pick_the_best does, including the rows with one or two rates.
+
+        :type values: numpy.ndarray
+        :type present: numpy.ndarray
+        :return: column of the best rate in each row or -1 if the row has no rate
+        :rtype: numpy.ndarray
+        """
+        n_rows, n_columns = values.shape
+        if n_columns == 0:
+            return np.full(n_rows, -1)
+
+        best_columns = np.where(present.any(axis=1), present.argmax(axis=1), -1)
+        if n_rows == 0 or n_columns == 1:
+            return best_columns
+
+        first, second = np.array(list(combinations(range(n_columns), 2))).T
+        pairs_present = present[:, first] & present[:, second]
+        differences = np.abs(values[:, first] - values[:, second])
+        greatest_difference = differences[pairs_present].max() if pairs_present.any() else 0
+        minimal_differences = np.where(pairs_present, differences, greatest_difference).min(axis=1)
+        closest_pairs = pairs_present & (differences == minimal_differences[:, None])
+
+        # occurrences of the rate of each column (axis 1) in the closest pairs (axis 2) as their first or second rate
+        equal = np.asarray(values[:, :, None] == values[:, None, :], dtype=bool)
+        in_first = closest_pairs[:, None, :] & equal[:, :, first]
+        in_second = closest_pairs[:, None, :] & equal[:, :, second]
+        occurrences = in_first.sum(axis=2) + in_second.sum(axis=2)
+
+        positions = 2 * np.arange(len(first))
+        no_position = 2 * len(first)
+        first_positions = np.minimum(np.where(in_first, positions, no_position), np.where(in_second, positions + 1, no_position)).min(axis=2)
+
+        # the first occurrence of the most common rate is the one returned by Counter.most_common
+        scores = np.where(occurrences > 0, occurrences * (no_position + 1) - first_positions, -1)
+        best_positions = np.minimum(first_positions[np.arange(n_rows), scores.argmax(axis=1)], no_position - 1)  # rows without pairs are ignored
+        pair_columns = np.where(best_positions % 2 == 0, first[best_positions // 2], second[best_positions // 2])
+
+        return np.where(pairs_present.any(axis=1), pair_columns, best_columns)
+
     @staticmethod
     def future_date_to_today(date_of_exchange, logger):
         """
@@ -141,9 +651,152 @@ class ExchangeRateManager:
             return today
         return date_of_exchange
 
+    def get_best_rate_by_date(self, date_of_exchange, currency, logger):
+        """
+        Pick the best rate of the currency for the date. Picked rates are cached in memory of the worker per (date, currency).
+
+        :type date_of_exchange: datetime.date
+        :type currency: str
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: Decimal
+        """
+        return self._get_best_rates_by_date(date_of_exchange, [currency], logger)[0]
+
+    def _get_best_rates_by_date(self, date_of_exchange, currencies, logger):
+        """
+        :type date_of_exchange: datetime.date
+        :type currencies: list[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: list[Decimal]
+        :raises ValueError: if there isn't any rate of some currency
+        """
+        best_rates = self.get_best_rates_by_dates({(date_of_exchange, currency) for currency in currencies}, logger)
+        for currency in currencies:
+            if (date_of_exchange, currency) not in best_rates:
+                raise ValueError(f"Missing exchange rate of {currency} ({date_of_exchange}).")
+
+        return [best_rates[(date_of_exchange, currency)] for currency in currencies]
+
+    def get_best_rates_by_dates(self, dates_currencies, logger, *, request_missing=True):
+        """
+        Pick the best rates for many (date, currency) pairs at once.
+        Rates which aren't cached are loaded from database by single query, missing providers are requested as usual.
+        Pairs without any available rate are omitted from the result.
+
+        :type dates_currencies: set[tuple[datetime.date, str]]
+        :type logger: gold_digger.utils.ContextLogger
+        :param request_missing: request providers for their missing rates, see _update_missing_rates
+        :type request_missing: bool
+        :rtype: dict[tuple[datetime.date, str], Decimal]
+        """
+        best_rates = {}
+        for date_of_exchange, currency in dates_currencies:
+            if currency == self._base_currency:
+                best_rate = ExchangeRate.base(self._base_currency).rate
+            else:
+                best_rate = self._get_cached_best_rate(date_of_exchange, currency)
+            if best_rate is not None:
+                best_rates[(date_of_exchange, currency)] = best_rate
+
+        missing = dates_currencies - set(best_rates)
+        if not missing:
+            return best_rates
+
+        # providers with request limit aren't requested for rates of past dates, so best rates of past dates are complete without them
+        today = date.today()
+        provider_ids = {
+            self._dao_provider.get_provider_id(data_provider.name) for data_provider in self._data_providers if not data_provider.has_request_limit
+        }
+
+        # best rates of past dates are picked when the rates are stored, rates of today and best rates picked without some provider
+        # can still be completed by requests of missing providers
+        past_missing = {(date_of_exchange, currency) for date_of_exchange, currency in missing if date_of_exchange < today}
+        if past_missing:
+            stored_best_rates = self._dao_exchange_rate.get_best_rates_by_dates_currencies(
+                {d for d, _ in past_missing}, {c for _, c in past_missing}, provider_ids
+            )
+            for best_rate in stored_best_rates:
+                if (best_rate.date, best_rate.currency) in past_missing and best_rate.providers == len(provider_ids):
+                    self._cache_best_rate(best_rate.date, best_rate.currency, best_rate.rate)
+                    best_rates[(best_rate.date, best_rate.currency)] = best_rate.rate
+
+            missing = dates_currencies - set(best_rates)
+            if not missing:
+                return best_rates
+
+        rates_by_date_currency = defaultdict(list)
+        for exchange_rate in self._dao_exchange_rate.get_rates_by_dates_currencies({d for d, _ in missing}, {c for _, c in missing}):
+            rates_by_date_currency[(exchange_rate.date, exchange_rate.currency)].append(exchange_rate)
+
+        rates_of_missing = {}
+        complete = set()
+        for date_of_exchange, currency in missing:
+            exchange_rates = self._update_missing_rates(
+                date_of_exchange, currency, rates_by_date_currency[(date_of_exchange, currency)], logger, request_missing=request_missing
+            )
+            # rates are picked in order of providers like when best rates are stored, rates requested from providers were appended
+            rates = [r.rate for r in sorted(exchange_rates, key=attrgetter("provider_id")) if r.rate is not None]
+            if rates:
+                rates_of_missing[(date_of_exchange, currency)] = rates
+            else:
+                logger.warning("Missing exchange rate of %s (%s).", currency, date_of_exchange)
+            if provider_ids <= {r.provider_id for r in exchange_rates}:
+                complete.add((date_of_exchange, currency))
+
+        for (date_of_exchange, currency), best_rate in zip(rates_of_missing, self.pick_the_best_many(list(rates_of_missing.values()))):
+            rates = rates_of_missing[(date_of_exchange, currency)]
+            logger.debug("Pick best rate for %s (%s): %s of [%s]", currency, date_of_exchange, best_rate, ", ".join(map(str, rates)))
+
+            self._cache_best_rate(date_of_exchange, currency, best_rate, complete=(date_of_exchange, currency) in complete)
+            best_rates[(date_of_exchange, currency)] = best_rate
+
+        return best_rates
+
+    def _get_cached_best_rate(self, date_of_exchange, currency):
+        """
+        :type date_of_exchange: datetime.date
+        :type currency: str
+        :rtype: Decimal | None
+        """
+        key = (date_of_exchange, currency)
+        with self._best_rates_cache_lock:
+            if date_of_exchange == date.today():
+                return self._today_best_rates_cache.get(key)
+            best_rate = self._best_rates_cache.get(key)
+            return best_rate if best_rate is not None else self._partial_best_rates_cache.get(key)
+
+    def _cache_best_rate(self, date_of_exchange, currency, best_rate, *, complete=True):
+        """
+        :type date_of_exchange: datetime.date
+        :type currency: str
+        :type best_rate: Decimal
+        :param complete: whether the best rate was picked from rates of all providers (or stored as best rate)
+        :type complete: bool
+        """
+        if date_of_exchange == date.today():
+            cache = self._today_best_rates_cache
+        elif complete:
+            cache = self._best_rates_cache
+        else:
+            cache = self._partial_best_rates_cache
+
+        with self._best_rates_cache_lock:
+            cache[(date_of_exchange, currency)] = best_rate
+
+    def _forget_best_rates(self, keys):
+        """
+        Remove cached best rates, e.g. after they were picked again from new rates, so they are loaded again.
+
+        :type keys: list[tuple[datetime.date, str]]
+        """
+        with self._best_rates_cache_lock:
+            for key in keys:
+                for cache in (self._best_rates_cache, self._partial_best_rates_cache, self._today_best_rates_cache):
+                    cache.pop(key, None)
+
     def get_exchange_rate_by_date(self, date_of_exchange, from_currency, to_currency, logger):
         """
-        Compute exchange rate between 'from_currency' and 'to_currency'.
+        Compute exchange rate between 'from_currency' and 'to_currency'. Rates of both currencies are loaded from database by single query.
         If the date is missing request data providers to update database.
 
         :type date_of_exchange: datetime.date
@@ -154,19 +807,52 @@ class ExchangeRateManager:
         """
         date_of_exchange = self.future_date_to_today(date_of_exchange, logger)
 
-        _from_currency_all_available = self.get_or_update_rate_by_date(date_of_exchange, from_currency, logger)
-        _to_currency_all_available = self.get_or_update_rate_by_date(date_of_exchange, to_currency, logger)
+        _from_currency, _to_currency = self._get_best_rates_by_date(date_of_exchange, [from_currency, to_currency], logger)
 
-        _from_currency_rates = [r.rate for r in _from_currency_all_available]
-        _to_currency_rates = [r.rate for r in _to_currency_all_available]
+        return Decimal(_to_currency / _from_currency)
 
-        _from_currency = self.pick_the_best(_from_currency_rates)
-        _to_currency = self.pick_the_best(_to_currency_rates)
+    def get_exchange_rates_by_dates(self, conversions, logger, *, request_missing=True):
+        """
+        Compute exchange rates of many conversions at once. Conversion which cannot be computed has None in the result.
 
-        logger.debug("Pick best rate for %s: %s of [%s]", from_currency, _from_currency, ", ".join(map(str, _from_currency_rates)))
-        logger.debug("Pick best rate for %s: %s of [%s]", to_currency, _to_currency, ", ".join(map(str, _to_currency_rates)))
+        :type conversions: list[tuple[datetime.date, str, str]]
+        :type logger: gold_digger.utils.ContextLogger
+        :param request_missing: request providers for their missing rates, see _update_missing_rates
+        :type request_missing: bool
+        :rtype: list[Decimal | None]
+        """
+        conversions = [
+            (self.future_date_to_today(date_of_exchange, logger), from_currency, to_currency) for date_of_exchange, from_currency, to_currency in conversions
+        ]
+        best_rates = self.get_best_rates_by_dates(
+            {(date_of_exchange, currency) for date_of_exchange, from_currency, to_currency in conversions for currency in (from_currency, to_currency)},
+            logger,
+            request_missing=request_missing,
+        )
+
+        exchange_rates = []
+        for date_of_exchange, from_currency, to_currency in conversions:
+            _from_currency = best_rates.get((date_of_exchange, from_currency))
+            _to_currency = best_rates.get((date_of_exchange, to_currency))
+            exchange_rates.append(Decimal(_to_currency / _from_currency) if _from_currency and _to_currency else None)
 
-        return Decimal(_to_currency / _from_currency)
+        return exchange_rates
+
+    def get_exchange_rate_matrix_by_date(self, date_of_exchange, currencies, logger):
+        """
+        Compute exchange rates between all pairs of the currencies from the best rate of each currency, which is picked only once.
+
+        :type date_of_exchange: datetime.date
+        :type currencies: list[str]
+        :type logger: gold_digger.utils.ContextLogger
+        :return: exchange rates from currency of the row to currency of the column, rates of currency without any rate are None
+        :rtype: list[list[Decimal | None]]
+        """
+        date_of_exchange = self.future_date_to_today(date_of_exchange, logger)
+        best_rates = self.get_best_rates_by_dates({(date_of_exchange, currency) for currency in currencies}, logger)
+
+        rates = [best_rates.get((date_of_exchange, currency)) for currency in currencies]
+        return [[Decimal(_to_currency / _from_currency) if _from_currency and _to_currency else None for _to_currency in rates] for _from_currency in rates]
 
     def _get_sum_of_rates_in_period(self, start_date, end_date, currency):
         """
@@ -196,11 +882,26 @@ class ExchangeRateManager:
         if today_or_past_date != start_date:
             return self.get_exchange_rate_by_date(today_or_past_date, from_currency, to_currency, logger)
 
-        number_of_days = abs((end_date - start_date).days) + 1  # we want interval <start_date, end_date>
         _from_currency = self._get_sum_of_rates_in_period(start_date, end_date, from_currency)
         _to_currency = self._get_sum_of_rates_in_period(start_date, end_date, to_currency)
 
-        for (from_provider, from_count, from_sum), (to_provider, to_count, to_sum) in zip(_from_currency, _to_currency):
+        return self._get_average_exchange_rate(start_date, end_date, from_currency, _from_currency, to_currency, _to_currency, logger)
+
+    def _get_average_exchange_rate(self, start_date, end_date, from_currency, from_sums, to_currency, to_sums, logger):
+        """
+        :type start_date: datetime.date
+        :type end_date: datetime.date
+        :type from_currency: str
+        :param from_sums: provider, count and sum of rates of the currency by providers
+        :type from_sums: list[tuple[int, int, Decimal]]
+        :type to_currency: str
+        :type to_sums: list[tuple[int, int, Decimal]]
+        :type logger: gold_digger.utils.ContextLogger
+        :rtype: Decimal | None
+        """
+        number_of_days = abs((end_date - start_date).days) + 1  # we want interval <start_date, end_date>
+
+        for (from_provider, from_count, from_sum), (to_provider, to_count, to_sum) in zip(from_sums, to_sums):
 
             logger.info(
                 "Sum of currencies %s (%s records) = %s, %s (%s records) = %s in period %s - %s by (%s, %s)",
@@ -227,8 +928,34 @@ class ExchangeRateManager:
 
         return None
 
+    def _sum_rates_in_period(self, rates, start_date, end_date, currency):
+        """
+        Same as _get_sum_of_rates_in_period, computed from rates already loaded from database.
+
+        :param rates: rates as (provider_id, currency, date, rate)
+        :type rates: list[tuple[int, str, datetime.date, Decimal]]
+        :type start_date: datetime.date
+        :type end_date: datetime.date
+        :type currency: str
+        :rtype: list[tuple[int, int, Decimal]]
+        """
+        if currency == self._base_currency:
+            return [("BASE", 1, ExchangeRate.base(self._base_currency).rate), ]
+
+        sums = defaultdict(lambda: [0, Decimal(0)])
+        with localcontext() as context:
+            context.prec = self.SUM_OF_RATES_PRECISION
+            for provider_id, rate_currency, date_of_exchange, rate in rates:
+                if rate_currency == currency and start_date <= date_of_exchange <= end_date:
+                    sums[provider_id][0] += 1
+                    sums[provider_id][1] += rate
+
+        return [(provider_id, count, rate_sum) for provider_id, (count, rate_sum) in sorted(sums.items())]
+
     def get_exchange_rate_in_intervals_by_date(self, date_of_exchange, from_currency, to_currency, logger):
         """
+        Daily rate is the best rate of the date, weekly and monthly rates are averages computed from rates of the last 31 days loaded at once.
+
         :type date_of_exchange: datetime.date
         :type from_currency: str
         :type to_currency: str
@@ -239,16 +966,27 @@ class ExchangeRateManager:
         if daily is None:
             return []
 
-        start_date, end_date = date_of_exchange - timedelta(days=6), date_of_exchange
-        weekly = self.get_average_exchange_rate_by_dates(start_date, end_date, from_currency, to_currency, logger)
-        if weekly is None:
-            return []
-
-        start_date, end_date = date_of_exchange - timedelta(days=30), date_of_exchange
-        monthly = self.get_average_exchange_rate_by_dates(start_date, end_date, from_currency, to_currency, logger)
-        if monthly is None:
-            return []
-
+        end_date = date_of_exchange
+        rates = None
+        averages = []
+        for days in (7, 31):
+            start_date = end_date - timedelta(days=days - 1)
+            today_or_past_date = self.future_date_to_today(start_date, logger)
+            if today_or_past_date != start_date:
+                average = self.get_exchange_rate_by_date(today_or_past_date, from_currency, to_currency, logger)
+            else:
+                if rates is None:
+                    currencies = {from_currency, to_currency} - {self._base_currency}
+                    rates = self._dao_exchange_rate.get_rates_in_period(end_date - timedelta(days=30), end_date, currencies) if currencies else []
+                from_sums = self._sum_rates_in_period(rates, start_date, end_date, from_currency)
+                to_sums = self._sum_rates_in_period(rates, start_date, end_date, to_currency)
+                average = self._get_average_exchange_rate(start_date, end_date, from_currency, from_sums, to_currency, to_sums, logger)
+
+            if average is None:
+                return []
+            averages.append(average)
+
+        weekly, monthly = averages
         return [
             {
                 "interval": "daily",
@@ -0,0 +1,50 @@
+import json
+from datetime import date
+from os import path, replace
+
+
+class UpdateCheckpoint:
+    """
+    Progress of historical update stored in JSON file, so killed update can be resumed where it stopped.
+    For every provider the last date, whose rates were stored, is kept.
+    """
+
+    def __init__(self, file_path, origin_date):
+        """
+        :type file_path: str
+        :type origin_date: datetime.date
+        """
+        self._file_path = file_path
+        self._origin_date = origin_date
+        self._last_dates = {}
+
+        if path.exists(file_path):
+            with open(file_path) as f:
+                checkpoint = json.load(f)
+            # progress of update with later origin date doesn't cover days before its origin date
+            if date.fromisoformat(checkpoint["origin_date"]) <= origin_date:
+                self._origin_date = date.fromisoformat(checkpoint["origin_date"])
+                self._last_dates = {provider_name: date.fromisoformat(last_date) for provider_name, last_date in checkpoint["last_dates"].items()}
+
+    def get_last_date(self, provider_name):
+        """
+        :type provider_name: str
+        :rtype: datetime.date | None
+        """
+        return self._last_dates.get(provider_name)
+
+    def save(self, provider_name, last_date):
+        """
+        :type provider_name: str
+        :type last_date: datetime.date
+        """
+        self._last_dates[provider_name] = last_date
+
+        checkpoint = {
+            "origin_date": self._origin_date.isoformat(),
+            "last_dates": {provider_name: last_date.isoformat() for provider_name, last_date in self._last_dates.items()},
+        }
+        # write to temporary file first so the checkpoint isn't corrupted if the update is killed while writing
+        with open(self._file_path + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        replace(self._file_path + ".tmp", self._file_path)
@@ -1,6 +1,6 @@
 import logging
 
-from ._utils import get_env
+from ._utils import get_env, to_bool
 
 APP_VERSION = get_env("app_version")
 
@@ -10,6 +10,15 @@ DATABASE_PORT = get_env("database_port", default="5432")
 DATABASE_USER = get_env("database_user", default="postgres")
 DATABASE_PASSWORD = get_env("database_password", default="postgres")
 DATABASE_NAME = get_env("database_name", default="golddigger")
+DATABASE_POOL_SIZE = get_env("database_pool_size", default=5, convert=int)  # connections kept open by every process
+DATABASE_MAX_OVERFLOW = get_env("database_max_overflow", default=5, convert=int)  # connections opened over the pool size under load
+DATABASE_POOL_RECYCLE = get_env("database_pool_recycle", default=30 * 60, convert=int)  # in seconds, connections older than this are reopened
+DATABASE_POOL_PRE_PING = get_env("database_pool_pre_ping", default="true", convert=to_bool)  # dead connections (e.g. after failover) are reopened
+DATABASE_STATEMENT_TIMEOUT = get_env("database_statement_timeout", default=0, convert=int)  # in milliseconds, 0 disables the timeout
+DATABASE_APPLICATION_NAME = get_env("database_application_name", default="gold-digger")  # shown in pg_stat_activity
+# opt-in NUMERIC(precision, scale) type of stored rates instead of unbounded NUMERIC, each rate is rounded by at most half of 10 ** -scale
+DATABASE_RATE_PRECISION = get_env("database_rate_precision", convert=int)
+DATABASE_RATE_SCALE = get_env("database_rate_scale", default=12, convert=int)
 
 LOGGING_FORMAT = "[%(levelname)s] %(asctime)s at %(filename)s:%(lineno)d (%(processName)s-%(process)s-%(threadName)s) -- %(message)s"
 LOGGING_LEVEL = logging.DEBUG
@@ -37,5 +46,24 @@ SUPPORTED_CURRENCIES = {
     "XPD", "XPF", "XPT", "YER", "ZAR", "ZMK", "ZMW", "ZWL"
 }
 
+HTTP_POOL_SIZE = get_env("http_pool_size", default=10, convert=int)
+HTTP_MAX_RETRIES = get_env("http_max_retries", default=3, convert=int)
+HTTP_RETRY_BACKOFF_FACTOR = get_env("http_retry_backoff_factor", default=0.5, convert=float)
+HTTP_KEEP_ALIVE = get_env("http_keep_alive", default="true", convert=to_bool)
+
+UPDATE_MAX_WORKERS = get_env("update_max_workers", default=5, convert=int)  # number of providers requested concurrently by update
+
+BEST_RATES_CACHE_SIZE = get_env("best_rates_cache_size", default=10000, convert=int)
+BEST_RATES_CACHE_TTL = get_env("best_rates_cache_ttl", default=60 * 60, convert=int)  # in seconds, bounds staleness of rates stored by other workers
+TODAY_BEST_RATES_CACHE_TTL = get_env("today_best_rates_cache_ttl", default=15 * 60, convert=int)  # in seconds
+RATE_REQUESTS_ADVISORY_LOCK = get_env("rate_requests_advisory_lock", default="false", convert=to_bool)  # deduplicate provider requests across workers
+NEGATIVE_CACHE_SIZE = get_env("negative_cache_size", default=10000, convert=int)
+NEGATIVE_CACHE_TTLS = {  # in seconds, how long misses of providers aren't requested again
+    "weekend": get_env("negative_cache_ttl_weekend", default=24 * 60 * 60, convert=int),
+    "unsupported": get_env("negative_cache_ttl_unsupported", default=24 * 60 * 60, convert=int),
+    "missing": get_env("negative_cache_ttl_missing", default=60 * 60, convert=int),
+    "error": get_env("negative_cache_ttl_error", default=60, convert=int),
+}
+
 SECRETS_CURRENCY_LAYER_ACCESS_KEY = get_env("secrets_currency_layer_access_key", default="")
 SECRETS_FIXER_ACCESS_KEY = get_env("secrets_fixer_access_key", default="")
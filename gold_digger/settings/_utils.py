@@ -8,3 +8,11 @@ def get_env(variable, *, default=None, convert=None):
         return convert(value)
     else:
         return value
+
+
+def to_bool(value):
+    """
+    :type value: str | bool
+    :rtype: bool
+    """
+    return str(value).lower() in ("1", "true", "yes", "on")
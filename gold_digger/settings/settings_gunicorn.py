@@ -3,7 +3,12 @@ Related article: https://sebest.github.io/post/protips-using-gunicorn-inside-a-d
 
 Parameters you might want to override:
   GUNICORN_WORKERS=1
+  GUNICORN_WORKER_CLASS="gthread"
+  GUNICORN_THREADS=4
   GUNICORN_BIND="0.0.0.0:8080"
+
+Every thread of worker uses its own database session, so keep threads per worker within GOLD_DIGGER_DATABASE_POOL_SIZE
+plus GOLD_DIGGER_DATABASE_MAX_OVERFLOW, otherwise requests wait for connections.
 """
 
 import os
@@ -14,6 +19,8 @@ sys.path.append(".")
 timeout = 300  # 5 minutes in seconds
 bind = "0.0.0.0:8080"
 workers = 1
+worker_class = "gthread"  # requests are served concurrently by threads of the worker
+threads = 4
 
 # Overwrite some Gunicorns params by ENV variables
 for k, v in os.environ.items():
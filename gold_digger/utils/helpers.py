@@ -1,3 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
 def batches(iterable, batch_size):
     """
     :type iterable: collections.abc.Iterable
@@ -13,3 +16,16 @@ def batches(iterable, batch_size):
 
     if bucket:
         yield bucket
+
+
+def concurrent_map(func, iterable, max_workers):
+    """
+    Same as `map` but the function is called by pool of threads. Results are returned in order of the iterable.
+
+    :type func: types.FunctionType
+    :type iterable: collections.abc.Iterable
+    :type max_workers: int
+    :rtype: list
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, iterable))
@@ -0,0 +1,52 @@
+from threading import Lock
+from time import monotonic
+
+from cachetools import LRUCache
+
+
+class NegativeCache:
+    """
+    Remembers keys of unsuccessful requests, so they aren't repeated until the TTL of the kind of the miss expires.
+    """
+    WEEKEND = "weekend"  # providers publishing only working days have no rates for weekends
+    UNSUPPORTED = "unsupported"  # provider returned rates of the date but not of the currency
+    MISSING = "missing"  # provider returned no rates of the date
+    ERROR = "error"  # request of the provider failed
+
+    def __init__(self, maxsize, timer=monotonic):
+        """
+        :type maxsize: int
+        :type timer: types.FunctionType
+        """
+        self._misses = LRUCache(maxsize=maxsize)
+        self._timer = timer
+        self._lock = Lock()
+
+    def add(self, key, kind, ttl):
+        """
+        :type key: collections.abc.Hashable
+        :type kind: str
+        :param ttl: seconds, miss isn't stored if it is not positive
+        :type ttl: int | float
+        """
+        if ttl > 0:
+            with self._lock:
+                self._misses[key] = (kind, self._timer() + ttl)
+
+    def get(self, key):
+        """
+        :type key: collections.abc.Hashable
+        :return: kind of the miss or None if the key isn't stored or the miss already expired
+        :rtype: str | None
+        """
+        with self._lock:
+            miss = self._misses.get(key)
+            if miss is None:
+                return None
+
+            kind, expires_at = miss
+            if expires_at <= self._timer():
+                del self._misses[key]
+                return None
+
+            return kind
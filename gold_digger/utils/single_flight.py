@@ -0,0 +1,39 @@
+from concurrent.futures import Future
+from threading import Lock
+
+
+class SingleFlight:
+    """
+    Calls with the same key which overlap in time are executed only once, the other callers wait and get result (or exception) of the first call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        :type key: collections.abc.Hashable
+        :type func: types.FunctionType
+        :return: result of the func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_first = call is None
+            if is_first:
+                call = self._calls[key] = Future()
+
+        if not is_first:
+            return call.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,23 @@
+from unittest.mock import Mock
+
+import pytest
+from falcon import testing
+
+from gold_digger.api_server.app import app
+from gold_digger.managers.exchange_rate_manager import ExchangeRateManager
+
+
+@pytest.fixture
+def exchange_rate_manager():
+    return Mock(ExchangeRateManager)
+
+
+@pytest.fixture
+def client(exchange_rate_manager):
+    """
+    Client of the API whose container serves the mocked manager and session instead of connecting to database.
+    """
+    app.container.__dict__.update(exchange_rate_manager=exchange_rate_manager, db_session=Mock())
+    yield testing.TestClient(app)
+    for service in ("exchange_rate_manager", "db_session"):
+        app.container.__dict__.pop(service)
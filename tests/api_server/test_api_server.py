@@ -0,0 +1,125 @@
+from datetime import date
+from decimal import Decimal
+from unittest.mock import ANY
+
+from gold_digger.api_server.api_server import BatchRateResource
+
+
+def test_batch_rate(client, exchange_rate_manager):
+    exchange_rate_manager.get_exchange_rates_by_dates.return_value = [Decimal("0.9"), Decimal("25.5")]
+
+    response = client.simulate_post("/rates/batch", json=[
+        {"from": "USD", "to": "EUR", "date": "2021-01-31"},
+        {"from": "EUR", "to": "CZK", "date": "2021-02-01"},
+    ])
+
+    assert response.status_code == 200
+    assert response.json == {"exchange_rates": [
+        {"date": "2021-01-31", "from_currency": "USD", "to_currency": "EUR", "exchange_rate": "0.9"},
+        {"date": "2021-02-01", "from_currency": "EUR", "to_currency": "CZK", "exchange_rate": "25.5"},
+    ]}
+    exchange_rate_manager.get_exchange_rates_by_dates.assert_called_once_with(
+        [(date(2021, 1, 31), "USD", "EUR"), (date(2021, 2, 1), "EUR", "CZK")], ANY, request_missing=False
+    )
+
+
+def test_batch_rate__invalid_conversions_are_reported_per_item(client, exchange_rate_manager):
+    exchange_rate_manager.get_exchange_rates_by_dates.return_value = [Decimal("25.5"), None]
+
+    response = client.simulate_post("/rates/batch", json=[
+        {"from": ["EUR"], "to": "USD"},
+        {"from": "EUR", "to": "XXX"},
+        {"from": "EUR", "to": "CZK", "date": "2021-01-31"},
+        {"from": "EUR", "to": "GBP", "date": "2021-01-31"},
+    ])
+
+    assert response.status_code == 200
+    assert response.json == {"exchange_rates": [
+        {"date": None, "from_currency": ["EUR"], "to_currency": "USD", "error": "Invalid currency ['EUR']"},
+        {"date": None, "from_currency": "EUR", "to_currency": "XXX", "error": "Invalid currency XXX"},
+        {"date": "2021-01-31", "from_currency": "EUR", "to_currency": "CZK", "exchange_rate": "25.5"},
+        {"date": "2021-01-31", "from_currency": "EUR", "to_currency": "GBP", "error": "Exchange rate not available"},
+    ]}
+
+
+def test_batch_rate__invalid_date(client, exchange_rate_manager):
+    exchange_rate_manager.get_exchange_rates_by_dates.return_value = []
+
+    response = client.simulate_post("/rates/batch", json=[{"from": "EUR", "to": "USD", "date": "2021-13-01"}, {"from": "EUR", "to": "USD", "date": 20210101}])
+
+    assert response.status_code == 200
+    assert [result["error"] for result in response.json["exchange_rates"]] == ["Invalid date, date should be in format yyyy-mm-dd"] * 2
+    exchange_rate_manager.get_exchange_rates_by_dates.assert_called_once_with([], ANY, request_missing=False)
+
+
+def test_batch_rate__body_is_not_list_of_conversions(client, exchange_rate_manager):
+    for body in ({"from": "EUR", "to": "USD"}, ["EUR"]):
+        response = client.simulate_post("/rates/batch", json=body)
+
+        assert response.status_code == 400
+    exchange_rate_manager.get_exchange_rates_by_dates.assert_not_called()
+
+
+def test_batch_rate__too_many_conversions(client, exchange_rate_manager, monkeypatch):
+    monkeypatch.setattr(BatchRateResource, "MAX_CONVERSIONS", 2)
+
+    response = client.simulate_post("/rates/batch", json=[{"from": "EUR", "to": "USD"}] * 3)
+
+    assert response.status_code == 400
+    exchange_rate_manager.get_exchange_rates_by_dates.assert_not_called()
+
+
+def test_matrix_rate(client, exchange_rate_manager):
+    exchange_rate_manager.get_exchange_rate_matrix_by_date.return_value = [
+        [Decimal(1), Decimal("0.9"), None],
+        [Decimal("1.1"), Decimal(1), None],
+        [None, None, None],
+    ]
+
+    response = client.simulate_get("/matrix", params={"currencies": "USD,EUR,CZK", "date": "2021-01-31"})
+
+    assert response.status_code == 200
+    assert response.json == {
+        "date": "2021-01-31",
+        "currencies": ["USD", "EUR", "CZK"],
+        "exchange_rates": [["1", "0.9", None], ["1.1", "1", None], [None, None, None]],
+    }
+    exchange_rate_manager.get_exchange_rate_matrix_by_date.assert_called_once_with(date(2021, 1, 31), ["USD", "EUR", "CZK"], ANY)
+
+
+def test_matrix_rate__strong_etag(client, exchange_rate_manager):
+    exchange_rate_manager.get_exchange_rate_matrix_by_date.return_value = [[Decimal(1), Decimal("0.9")], [Decimal("1.1"), Decimal(1)]]
+    params = {"currencies": "USD,EUR", "date": "2021-01-31"}
+
+    response = client.simulate_get("/matrix", params=params)
+    etag = response.headers["ETag"]
+
+    assert etag.startswith('"') and not etag.startswith('W/')
+    assert client.simulate_get("/matrix", params=params).headers["ETag"] == etag
+
+    not_modified = client.simulate_get("/matrix", params=params, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == etag
+
+    modified = client.simulate_get("/matrix", params=params, headers={"If-None-Match": '"other"'})
+    assert modified.status_code == 200
+    assert modified.json == response.json
+
+    exchange_rate_manager.get_exchange_rate_matrix_by_date.return_value = [[Decimal(1), Decimal("0.91")], [Decimal("1.1"), Decimal(1)]]
+    changed = client.simulate_get("/matrix", params=params, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_matrix_rate__invalid_or_duplicate_currencies(client, exchange_rate_manager):
+    exchange_rate_manager.get_exchange_rate_matrix_by_date.return_value = [[Decimal(1), Decimal("0.9")], [Decimal("1.1"), Decimal(1)]]
+
+    response = client.simulate_get("/matrix", params={"currencies": "USD,XXX"})
+    assert response.status_code == 400
+    exchange_rate_manager.get_exchange_rate_matrix_by_date.assert_not_called()
+
+    response = client.simulate_get("/matrix", params={"currencies": "USD,EUR,USD"})
+    assert response.status_code == 200
+    assert response.json["currencies"] == ["USD", "EUR"]
+    exchange_rate_manager.get_exchange_rate_matrix_by_date.assert_called_once_with(date.today(), ["USD", "EUR"], ANY)
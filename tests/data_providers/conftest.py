@@ -1,6 +1,6 @@
 import pytest
 
-from gold_digger.data_providers import CurrencyLayer, Fixer, RatesAPI, Yahoo
+from gold_digger.data_providers import CurrencyLayer, Fixer, GrandTrunk, RatesAPI, Yahoo
 
 
 @pytest.fixture
@@ -21,3 +21,8 @@ def rates_api(base_currency):
 @pytest.fixture
 def currency_layer(base_currency, logger):
     return CurrencyLayer("simple_access_key", logger, base_currency)
+
+
+@pytest.fixture
+def grandtrunk(base_currency):
+    return GrandTrunk(base_currency)
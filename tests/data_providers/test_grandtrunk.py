@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from threading import Barrier
+from unittest.mock import Mock
+
+from requests import Response
+
+
+def _response(content):
+    """
+    :type content: bytes
+    :rtype: requests.Response
+    """
+    response = Response()
+    response.status_code = 200
+    response._content = content
+    return response
+
+
+def test_get_historical(grandtrunk, logger):
+    """
+    Ranges of all currencies are requested by periods, so rates of whole days are generated together. Excluded days are not requested.
+
+    :type grandtrunk: gold_digger.data_providers.grandtrunk.GrandTrunk
+    :type logger: logging.Logger
+    """
+    grandtrunk.HISTORICAL_PERIOD_DAYS = 2
+    origin_date = date.today() - timedelta(days=3)
+    days = [origin_date + timedelta(days=i) for i in range(4)]
+
+    def _get(url, **_):
+        start_date, end_date, _, currency = url.split("/")[-4:]
+        rate = {"EUR": "0.9", "CZK": "22.5"}[currency]
+        return _response("".join(f"{day} {rate}\n" for day in days if start_date <= str(day) <= end_date).encode())
+
+    grandtrunk._get = Mock(side_effect=_get)
+
+    historical_rates = list(grandtrunk.get_historical(origin_date, {"EUR", "CZK"}, logger, excluded_dates={days[0], days[3]}))
+
+    assert historical_rates == [
+        {days[1]: {"EUR": Decimal("0.9"), "CZK": Decimal("22.5")}},
+        {days[2]: {"EUR": Decimal("0.9"), "CZK": Decimal("22.5")}},
+    ]
+    assert sorted(args[0].split("/")[-4] for args, _ in grandtrunk._get.call_args_list) == [str(days[1])] * 2 + [str(days[2])] * 2
+
+
+def test_get_all_by_date__currencies_are_requested_concurrently(grandtrunk, logger):
+    """
+    Both currencies have to be requested at the same time to pass the barrier. Unsupported currencies are not requested.
+
+    :type grandtrunk: gold_digger.data_providers.grandtrunk.GrandTrunk
+    :type logger: logging.Logger
+    """
+    barrier = Barrier(2, timeout=5)
+
+    def _get(url, **_):
+        barrier.wait()
+        return _response({"EUR": b"0.9", "CZK": b"22.5"}[url.split("/")[-1]])
+
+    grandtrunk._get = Mock(side_effect=_get)
+    grandtrunk.get_supported_currencies = Mock(return_value={"EUR", "CZK"})
+
+    day_rates = grandtrunk.get_all_by_date(date(2016, 2, 17), {"EUR", "CZK", "XXX"}, logger)
+
+    assert day_rates == {"EUR": Decimal("0.9"), "CZK": Decimal("22.5")}
+    assert grandtrunk._get.call_count == 2
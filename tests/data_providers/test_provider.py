@@ -0,0 +1,148 @@
+import asyncio
+from datetime import date, timedelta
+from decimal import Decimal
+from threading import Event
+from unittest.mock import Mock
+
+import pytest
+import requests.exceptions
+from requests import Response
+
+from gold_digger.data_providers import GrandTrunk, RatesAPI
+from gold_digger.exceptions import ProviderUnavailable
+
+
+def test_session__pooled_connections_with_retries(base_currency):
+    """
+    :type base_currency: str
+    """
+    provider = RatesAPI(base_currency, http_pool_size=4, http_max_retries=2, http_retry_backoff_factor=0.1)
+
+    adapter = provider._session.get_adapter(provider.BASE_URL)
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+    assert adapter.max_retries.backoff_factor == 0.1
+    assert set(adapter.max_retries.status_forcelist) == {502, 503, 504}
+    assert provider._session.headers["Connection"] == "keep-alive"
+
+
+def test_session__blocking_pool_of_configured_size(base_currency):
+    """
+    Parallel requests of GrandTrunk are capped by size of the pool.
+
+    :type base_currency: str
+    """
+    provider = GrandTrunk(base_currency, http_pool_size=4, http_max_retries=2)
+
+    adapter = provider._session.get_adapter(provider.BASE_URL)
+    assert adapter._pool_maxsize == 4
+    assert adapter._pool_block is True
+    assert adapter.max_retries.total == 2
+    assert RatesAPI(base_currency)._session.get_adapter(RatesAPI.BASE_URL)._pool_block is False
+
+
+def test_session__keep_alive_disabled(base_currency):
+    """
+    :type base_currency: str
+    """
+    provider = RatesAPI(base_currency, http_keep_alive=False)
+
+    assert provider._session.headers["Connection"] == "close"
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_get__server_error_is_raised(rates_api, logger, status_code):
+    """
+    Failed request tells nothing about the requested rates, so it isn't reported as missing rates.
+
+    :type rates_api: gold_digger.data_providers.rates_api.RatesAPI
+    :type logger: logging.Logger
+    :type status_code: int
+    """
+    response = Response()
+    response.status_code = status_code
+    rates_api._session.get = Mock(return_value=response)
+
+    with pytest.raises(ProviderUnavailable):
+        rates_api.get_all_by_date(date(2019, 4, 15), {"EUR"}, logger)
+
+
+def test_get__connection_error_is_raised(grandtrunk, logger):
+    """
+    :type grandtrunk: gold_digger.data_providers.grandtrunk.GrandTrunk
+    :type logger: logging.Logger
+    """
+    grandtrunk._session.get = Mock(side_effect=requests.exceptions.ConnectionError("Connection refused"))
+
+    with pytest.raises(ProviderUnavailable):
+        grandtrunk.get_by_date(date(2019, 4, 15), "EUR", logger)
+
+
+def test_get__client_error_is_missing_rate(grandtrunk, logger):
+    """
+    :type grandtrunk: gold_digger.data_providers.grandtrunk.GrandTrunk
+    :type logger: logging.Logger
+    """
+    response = Response()
+    response.status_code = 404
+    grandtrunk._session.get = Mock(return_value=response)
+
+    assert grandtrunk.get_by_date(date(2019, 4, 15), "EUR", logger) is None
+
+
+def test_get_historical__unavailable_days_are_skipped(rates_api, logger):
+    """
+    :type rates_api: gold_digger.data_providers.rates_api.RatesAPI
+    :type logger: logging.Logger
+    """
+    origin_date = date.today() - timedelta(days=3)
+    rates_api.get_all_by_date = Mock(side_effect=[{"EUR": Decimal("0.9")}, ProviderUnavailable("timeout"), {"EUR": Decimal("0.8")}])
+
+    historical_rates = list(rates_api.get_historical(origin_date, {"EUR"}, logger))
+
+    assert historical_rates == [{origin_date: {"EUR": Decimal("0.9")}}, {origin_date + timedelta(days=2): {"EUR": Decimal("0.8")}}]
+
+
+def test_get_historical__stops_before_next_request(rates_api, logger):
+    """
+    :type rates_api: gold_digger.data_providers.rates_api.RatesAPI
+    :type logger: logging.Logger
+    """
+    origin_date = date.today() - timedelta(days=3)
+    stop = Event()
+
+    def _get_all_by_date(*_):
+        stop.set()
+        return {"EUR": Decimal("0.9")}
+
+    rates_api.get_all_by_date = Mock(side_effect=_get_all_by_date)
+
+    assert list(rates_api.get_historical(origin_date, {"EUR"}, logger, stop=stop)) == [{origin_date: {"EUR": Decimal("0.9")}}]
+    assert rates_api.get_all_by_date.call_count == 1
+
+
+def test_get_historical_async__closed_iteration_stops_provider(grandtrunk, logger):
+    """
+    Chunks generated by thread of executor are stopped when asynchronous iteration ends early, e.g. because the update was cancelled.
+
+    :type grandtrunk: gold_digger.data_providers.grandtrunk.GrandTrunk
+    :type logger: logging.Logger
+    """
+    stops = []
+
+    def _get_historical(*_, stop, **__):
+        stops.append(stop)
+        while not stop.is_set():
+            yield {date(2016, 2, 17): {"EUR": Decimal("0.9")}}
+
+    grandtrunk.get_historical = _get_historical
+
+    async def _update():
+        historical_rates = grandtrunk.get_historical_async(date(2016, 2, 17), {"EUR"}, logger, concurrency=2)
+        async for _ in historical_rates:
+            break
+        await historical_rates.aclose()
+
+    asyncio.run(_update())
+
+    assert [stop.is_set() for stop in stops] == [True]
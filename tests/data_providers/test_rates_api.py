@@ -1,5 +1,8 @@
-from datetime import date
+import asyncio
+from datetime import date, timedelta
 from decimal import Decimal
+from threading import Barrier
+from unittest.mock import Mock
 
 import pytest
 from requests import Response
@@ -259,3 +262,63 @@ def test_get_all_by_date__eur_base_eur_target(rates_api, response, logger):
         "CZK": Decimal(25.663000000000000255795384873636066913604736328125),
         "EUR": Decimal(1)
     }
+
+
+def test_get_historical(rates_api, logger):
+    """
+    Historical rates are generated day by day, days without rates are skipped.
+
+    :type rates_api: gold_digger.data_providers.rates_api.RatesAPI
+    :type logger: logging.Logger
+    """
+    origin_date = date.today() - timedelta(days=3)
+    rates_api.get_all_by_date = Mock(side_effect=[{"EUR": Decimal(1)}, {}, {"EUR": Decimal(2)}])
+
+    historical_rates = rates_api.get_historical(origin_date, {"EUR"}, logger)
+
+    assert rates_api.get_all_by_date.call_count == 0
+    assert list(historical_rates) == [
+        {origin_date: {"EUR": Decimal(1)}},
+        {origin_date + timedelta(days=2): {"EUR": Decimal(2)}},
+    ]
+    assert rates_api.get_all_by_date.call_count == 3
+
+
+def test_get_historical__excluded_dates(rates_api, logger):
+    """
+    :type rates_api: gold_digger.data_providers.rates_api.RatesAPI
+    :type logger: logging.Logger
+    """
+    origin_date = date.today() - timedelta(days=3)
+    rates_api.get_all_by_date = Mock(return_value={"EUR": Decimal(1)})
+
+    historical_rates = list(rates_api.get_historical(origin_date, {"EUR"}, logger, excluded_dates={origin_date + timedelta(days=1)}))
+
+    assert historical_rates == [{origin_date: {"EUR": Decimal(1)}}, {origin_date + timedelta(days=2): {"EUR": Decimal(1)}}]
+    assert [args[0] for args, _ in rates_api.get_all_by_date.call_args_list] == [origin_date, origin_date + timedelta(days=2)]
+
+
+def test_get_historical_async(rates_api, logger):
+    """
+    Days are requested concurrently, but rates are still generated in order of days.
+
+    :type rates_api: gold_digger.data_providers.rates_api.RatesAPI
+    :type logger: logging.Logger
+    """
+    origin_date = date.today() - timedelta(days=4)
+    barrier = Barrier(2, timeout=5)
+
+    def get_all_by_date(date_of_exchange, *_):
+        barrier.wait()  # blocks until the other day is requested at the same time
+        return {"EUR": Decimal((date_of_exchange - origin_date).days)} if date_of_exchange != origin_date + timedelta(days=1) else {}
+
+    rates_api.get_all_by_date = get_all_by_date
+
+    async def collect():
+        return [chunk async for chunk in rates_api.get_historical_async(origin_date, {"EUR"}, logger, concurrency=2)]
+
+    assert asyncio.run(collect()) == [
+        {origin_date: {"EUR": Decimal(0)}},
+        {origin_date + timedelta(days=2): {"EUR": Decimal(2)}},
+        {origin_date + timedelta(days=3): {"EUR": Decimal(3)}},
+    ]
@@ -0,0 +1,54 @@
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from gold_digger.database.dao_exchange_rate import DaoExchangeRate
+from gold_digger.database.dao_provider import DaoProvider
+from gold_digger.database.db_model import ExchangeRate
+
+
+def _allocated_memory(read):
+    """
+    Memory allocated by the read and still held by its result, the same read is done once before to warm up caches of compiled queries.
+
+    :type read: callable
+    :rtype: int
+    """
+    read()
+    tracemalloc.start()
+    try:
+        result = read()
+        allocated, _ = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return allocated
+
+
+@pytest.mark.slow
+def test_rates_are_read_without_orm_entities(db_session, logger):
+    """
+    Rates of a month for /intervals-like request: plain rows cost a fraction of ORM entities and the session doesn't keep any of them.
+    """
+    dao_exchange_rate = DaoExchangeRate(db_session)
+    dao_provider = DaoProvider(db_session)
+    dates = {date(2016, 1, 1) + timedelta(days=days) for days in range(31)}
+    records = [
+        dict(currency=currency, rate=Decimal("1.2345"), date=day, provider_id=dao_provider.get_or_create_provider_id(name))
+        for name in ("test1", "test2", "test3") for day in dates for currency in ("EUR", "CZK")
+    ]
+    dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+
+    def read_entities():
+        entities = db_session.query(ExchangeRate).filter(ExchangeRate.date.in_(dates), ExchangeRate.currency.in_({"EUR", "CZK"})).all()
+        db_session.expunge_all()
+        return entities
+
+    entities_memory = _allocated_memory(read_entities)
+    rows_memory = _allocated_memory(lambda: dao_exchange_rate.get_rates_by_dates_currencies(dates, {"EUR", "CZK"}))
+
+    assert len(dao_exchange_rate.get_rates_by_dates_currencies(dates, {"EUR", "CZK"})) == len(records)
+    assert rows_memory < entities_memory / 2, (rows_memory, entities_memory)
+    assert len(db_session.identity_map) == 0
@@ -1,10 +1,14 @@
-from datetime import date
+import random
+from datetime import date, timedelta
 from decimal import Decimal
 
 import pytest
 
 from gold_digger.database.dao_exchange_rate import DaoExchangeRate
 from gold_digger.database.dao_provider import DaoProvider
+from gold_digger.database.db_model import ExchangeRateCumulativeSum, Provider
+from gold_digger.database.migrations import convert_rate_type, rebuild_cumulative_sums
+from gold_digger.exceptions import ImproperlyConfigured
 
 
 @pytest.fixture
@@ -17,11 +21,27 @@ def dao_provider(db_session):
     return DaoProvider(db_session)
 
 
+@pytest.mark.slow
+def test_get_or_create_provider_id(dao_provider, db_session):
+    provider_id = dao_provider.get_or_create_provider_id("test1")
+
+    assert dao_provider.get_or_create_provider_id("test1") == provider_id
+    assert dao_provider.get_provider_id("test1") == provider_id
+    assert dao_provider.get_provider_id("test2") is None
+
+    other_process_dao_provider = DaoProvider(db_session)
+    other_process_dao_provider.get_provider_id("test1")  # loads providers before "test2" is created
+    test2_id = dao_provider.get_or_create_provider_id("test2")
+
+    assert other_process_dao_provider.get_or_create_provider_id("test2") == test2_id
+    assert db_session.query(Provider).count() == 2
+
+
 @pytest.mark.slow
 def test_insert_new_rate(dao_exchange_rate, dao_provider):
     assert dao_exchange_rate.get_rates_by_date_currency(date.today(), "USD") == []
 
-    provider1 = dao_provider.get_or_create_provider_by_name("test1")
+    provider1 = dao_provider.get_or_create_provider_id("test1")
     dao_exchange_rate.insert_new_rate(date.today(), provider1, "USD", Decimal(1))
 
     assert len(dao_exchange_rate.get_rates_by_date_currency(date.today(), "USD")) == 1
@@ -31,33 +51,307 @@ def test_insert_new_rate(dao_exchange_rate, dao_provider):
     assert len(dao_exchange_rate.get_rates_by_date_currency(date.today(), "USD")) == 1
 
 
+@pytest.mark.slow
+def test_insert_new_rate__returns_stored_rate(dao_exchange_rate, dao_provider, db_session):
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+
+    inserted = dao_exchange_rate.insert_new_rate(date(2016, 1, 1), provider1, "EUR", Decimal(1))
+    existing = dao_exchange_rate.insert_new_rate(date(2016, 1, 1), provider1, "EUR", Decimal(2))
+
+    assert tuple(inserted) == tuple(existing) == (provider1, "EUR", date(2016, 1, 1), Decimal(1))
+    assert dao_exchange_rate.get_sum_of_rates_in_period(date(2016, 1, 1), date(2016, 1, 1), "EUR") == [(provider1, 1, Decimal(1))]
+    assert len(db_session.identity_map) == 0
+
+
 @pytest.mark.slow
 def test_insert_exchange_rate_to_db(dao_exchange_rate, dao_provider, logger):
     assert dao_exchange_rate.get_rates_by_date_currency(date.today(), "USD") == []
 
-    provider1 = dao_provider.get_or_create_provider_by_name("test1")
-    provider2 = dao_provider.get_or_create_provider_by_name("test2")
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    provider2 = dao_provider.get_or_create_provider_id("test2")
 
     records = [
-        {"date": date.today(), "currency": "USD", "provider_id": provider1.id, "rate": Decimal(1)},
-        {"date": date.today(), "currency": "USD", "provider_id": provider2.id, "rate": Decimal(1)},
-        {"date": date.today(), "currency": "USD", "provider_id": provider1.id, "rate": Decimal(1)}
+        {"date": date.today(), "currency": "USD", "provider_id": provider1, "rate": Decimal(1)},
+        {"date": date.today(), "currency": "USD", "provider_id": provider2, "rate": Decimal(1)},
+        {"date": date.today(), "currency": "USD", "provider_id": provider1, "rate": Decimal(1)}
     ]
-    dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+    duplicates = dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
 
+    assert duplicates == {"USD"}
     assert len(dao_exchange_rate.get_rates_by_date_currency(date.today(), "USD")) == 2
 
 
+@pytest.mark.slow
+def test_insert_exchange_rate_to_db__keep_or_overwrite_existing(dao_exchange_rate, dao_provider, logger):
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    dao_exchange_rate.insert_new_rate(date.today(), provider1, "EUR", Decimal(1))
+
+    records = [
+        {"date": date.today(), "currency": "EUR", "provider_id": provider1, "rate": Decimal(2)},
+        {"date": date.today(), "currency": "CZK", "provider_id": provider1, "rate": Decimal(3)},
+    ]
+    duplicates = dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+
+    assert duplicates == {"EUR"}
+    assert [r.rate for r in dao_exchange_rate.get_rates_by_date_currency(date.today(), "EUR")] == [1]
+    assert [r.rate for r in dao_exchange_rate.get_rates_by_date_currency(date.today(), "CZK")] == [3]
+
+    records[1]["rate"] = Decimal(4)
+    duplicates = dao_exchange_rate.insert_exchange_rate_to_db(records, logger, overwrite=True)
+    dao_exchange_rate.db_session.expire_all()
+
+    assert duplicates == {"EUR", "CZK"}
+    assert [r.rate for r in dao_exchange_rate.get_rates_by_date_currency(date.today(), "EUR")] == [2]
+    assert [r.rate for r in dao_exchange_rate.get_rates_by_date_currency(date.today(), "CZK")] == [4]
+
+
 @pytest.mark.slow
 def test_get_sum_of_rates_in_period(dao_exchange_rate, dao_provider):
     start_date = date(2016, 1, 1)
     end_date = date(2016, 1, 10)
     assert dao_exchange_rate.get_sum_of_rates_in_period(start_date, end_date, "USD") == []
 
-    provider1 = dao_provider.get_or_create_provider_by_name("test1")
+    provider1 = dao_provider.get_or_create_provider_id("test1")
     dao_exchange_rate.insert_new_rate(date(2016, 1, 1), provider1, "USD", Decimal(1))
     dao_exchange_rate.insert_new_rate(date(2016, 1, 2), provider1, "USD", Decimal(2))
     dao_exchange_rate.insert_new_rate(date(2016, 1, 3), provider1, "USD", Decimal(3))
 
     records = dao_exchange_rate.get_sum_of_rates_in_period(start_date, end_date, "USD")
-    assert records == [(provider1.id, 3, 6)]
+    assert records == [(provider1, 3, 6)]
+
+
+@pytest.mark.slow
+def test_get_sum_of_rates_in_period__cumulative_sums_follow_changes(dao_exchange_rate, dao_provider, db_session, logger):
+    """
+    Rates inserted in any order, overwritten or missing give the same sums as the rates themselves and as cumulative sums rebuilt from scratch.
+    """
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    provider2 = dao_provider.get_or_create_provider_id("test2")
+
+    def records(provider_id, days, rate):
+        return [dict(currency="EUR", rate=rate(day), date=date(2016, 1, day), provider_id=provider_id) for day in days]
+
+    dao_exchange_rate.insert_exchange_rate_to_db(records(provider1, [5, 6, 7, 8], lambda day: Decimal(day)), logger)
+    dao_exchange_rate.insert_exchange_rate_to_db(records(provider1, [1, 3], lambda day: Decimal(day)), logger)
+    dao_exchange_rate.insert_exchange_rate_to_db(records(provider1, [2, 3, 6], lambda day: Decimal("0.5") * day), logger, overwrite=True)
+    dao_exchange_rate.insert_exchange_rate_to_db(records(provider1, [7], lambda day: None), logger, overwrite=True)
+    dao_exchange_rate.insert_exchange_rate_to_db(records(provider2, [4, 2], lambda day: Decimal(10 * day)), logger)
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 3), provider2, "EUR", Decimal(30))
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 4), provider2, "EUR", Decimal(99))
+
+    def sums_of_rates(start_day, end_day):
+        sums = {}
+        for rate in dao_exchange_rate.get_rates_by_dates_currencies({date(2016, 1, day) for day in range(start_day, end_day + 1)}, {"EUR"}):
+            if rate.rate is not None:
+                count, total = sums.get(rate.provider_id, (0, 0))
+                sums[rate.provider_id] = (count + 1, total + rate.rate)
+        return [(provider_id, count, total) for provider_id, (count, total) in sorted(sums.items())]
+
+    periods = [(start_day, end_day) for start_day in range(1, 10) for end_day in range(start_day, 10)]
+    for start_day, end_day in periods:
+        assert dao_exchange_rate.get_sum_of_rates_in_period(date(2016, 1, start_day), date(2016, 1, end_day), "EUR") == sums_of_rates(start_day, end_day)
+
+    cumulative_sums = db_session.query(ExchangeRateCumulativeSum).order_by(ExchangeRateCumulativeSum.provider_id, ExchangeRateCumulativeSum.date).all()
+    maintained = [(r.provider_id, r.date, r.rate_sum, r.rate_count) for r in cumulative_sums]
+    rebuild_cumulative_sums(db_session.connection())
+    db_session.expire_all()
+    cumulative_sums = db_session.query(ExchangeRateCumulativeSum).order_by(ExchangeRateCumulativeSum.provider_id, ExchangeRateCumulativeSum.date).all()
+    rebuilt = [(r.provider_id, r.date, r.rate_sum, r.rate_count) for r in cumulative_sums]
+
+    assert [row for row in maintained if row[1] != date(2016, 1, 7)] == rebuilt  # rebuilt sums skip days without rate
+
+
+@pytest.mark.slow
+def test_insert_exchange_rate_to_db__cumulative_sums_of_multi_day_backfill(dao_exchange_rate, dao_provider, db_session, logger):
+    """
+    Days backfilled by one batch between and before already stored days shift the following running sums by all changes up to their date.
+    """
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    provider2 = dao_provider.get_or_create_provider_id("test2")
+
+    def records(provider_id, currency, days, rate):
+        return [dict(currency=currency, rate=rate, date=date(2016, 1, 1) + timedelta(days=day), provider_id=provider_id) for day in days]
+
+    dao_exchange_rate.insert_exchange_rate_to_db(records(provider1, "EUR", range(10, 60, 3), Decimal(1)), logger)
+    dao_exchange_rate.insert_exchange_rate_to_db(records(provider2, "EUR", range(0, 60, 7), Decimal(2)), logger)
+    dao_exchange_rate.insert_exchange_rate_to_db(
+        records(provider1, "EUR", range(0, 60), Decimal("0.5")) + records(provider1, "CZK", range(5, 50, 2), Decimal(25))
+        + records(provider2, "EUR", range(20, 40), Decimal(3)),
+        logger,
+        overwrite=True,
+    )
+
+    cumulative_sums = db_session.query(ExchangeRateCumulativeSum).order_by(
+        ExchangeRateCumulativeSum.provider_id, ExchangeRateCumulativeSum.currency, ExchangeRateCumulativeSum.date
+    ).all()
+    maintained = [(r.provider_id, r.currency, r.date, r.rate_sum, r.rate_count) for r in cumulative_sums]
+    rebuild_cumulative_sums(db_session.connection())
+    db_session.expire_all()
+    cumulative_sums = db_session.query(ExchangeRateCumulativeSum).order_by(
+        ExchangeRateCumulativeSum.provider_id, ExchangeRateCumulativeSum.currency, ExchangeRateCumulativeSum.date
+    ).all()
+    rebuilt = [(r.provider_id, r.currency, r.date, r.rate_sum, r.rate_count) for r in cumulative_sums]
+
+    assert maintained == rebuilt
+    assert dao_exchange_rate.get_sum_of_rates_in_period(date(2016, 1, 1), date(2016, 3, 1), "EUR") == [
+        (provider1, 60, Decimal(30)), (provider2, 26, 6 * Decimal(2) + 20 * Decimal(3)),
+    ]
+
+
+@pytest.mark.slow
+def test_get_rates_in_period(dao_exchange_rate, dao_provider):
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 1), provider1, "EUR", Decimal(1))
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 2), provider1, "EUR", None)
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 2), provider1, "CZK", Decimal(2))
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 3), provider1, "GBP", Decimal(3))
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 4), provider1, "EUR", Decimal(4))
+
+    rates = dao_exchange_rate.get_rates_in_period(date(2016, 1, 1), date(2016, 1, 3), {"EUR", "CZK"})
+
+    assert sorted(rates) == [(provider1, "CZK", date(2016, 1, 2), Decimal(2)), (provider1, "EUR", date(2016, 1, 1), Decimal(1))]
+
+
+@pytest.mark.slow
+def test_get_rates_by_dates_currencies(dao_exchange_rate, dao_provider):
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 1), provider1, "EUR", Decimal(1))
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 2), provider1, "EUR", Decimal(2))
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 2), provider1, "CZK", Decimal(3))
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 3), provider1, "EUR", Decimal(4))
+
+    records = dao_exchange_rate.get_rates_by_dates_currencies({date(2016, 1, 1), date(2016, 1, 2)}, {"EUR", "CZK"})
+    assert sorted((r.date, r.currency, r.rate) for r in records) == [
+        (date(2016, 1, 1), "EUR", 1),
+        (date(2016, 1, 2), "CZK", 3),
+        (date(2016, 1, 2), "EUR", 2),
+    ]
+
+
+@pytest.mark.slow
+def test_get_dates_with_complete_rates(dao_exchange_rate, dao_provider, logger):
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    provider2 = dao_provider.get_or_create_provider_id("test2")
+    records = [
+        {"date": date(2016, 1, 1), "currency": "EUR", "provider_id": provider1, "rate": Decimal(1)},
+        {"date": date(2016, 1, 1), "currency": "CZK", "provider_id": provider1, "rate": Decimal(1)},
+        {"date": date(2016, 1, 2), "currency": "EUR", "provider_id": provider1, "rate": Decimal(1)},
+        {"date": date(2016, 1, 3), "currency": "EUR", "provider_id": provider1, "rate": Decimal(1)},
+        {"date": date(2016, 1, 3), "currency": "CZK", "provider_id": provider1, "rate": Decimal(1)},
+        {"date": date(2016, 1, 2), "currency": "EUR", "provider_id": provider2, "rate": Decimal(1)},
+        {"date": date(2016, 1, 2), "currency": "CZK", "provider_id": provider2, "rate": Decimal(1)},
+    ]
+    dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+
+    currencies = {"EUR", "CZK"}
+    assert dao_exchange_rate.get_dates_with_complete_rates(provider1, date(2016, 1, 1), date(2016, 1, 10), currencies, 1) == {
+        date(2016, 1, 1), date(2016, 1, 3)
+    }
+    # coverage is relative to the currencies, not to the best covered date of the period
+    assert dao_exchange_rate.get_dates_with_complete_rates(provider1, date(2016, 1, 2), date(2016, 1, 2), currencies, 1) == set()
+    assert dao_exchange_rate.get_dates_with_complete_rates(provider1, date(2016, 1, 1), date(2016, 1, 10), currencies, 0.5) == {
+        date(2016, 1, 1), date(2016, 1, 2), date(2016, 1, 3)
+    }
+    assert dao_exchange_rate.get_dates_with_complete_rates(provider1, date(2016, 1, 1), date(2016, 1, 10), {"EUR"}, 1) == {
+        date(2016, 1, 1), date(2016, 1, 2), date(2016, 1, 3)
+    }
+
+
+@pytest.mark.slow
+def test_save_best_rates(dao_exchange_rate, db_session):
+    dao_exchange_rate.save_best_rates({(date(2016, 1, 1), "EUR"): Decimal("0.9"), (date(2016, 1, 1), "CZK"): Decimal(25), (date(2016, 1, 2), "EUR"): None})
+    db_session.commit()
+    dao_exchange_rate.save_best_rates({(date(2016, 1, 1), "EUR"): Decimal("0.91"), (date(2016, 1, 1), "CZK"): None})
+    db_session.commit()
+
+    best_rates = dao_exchange_rate.get_best_rates_by_dates_currencies({date(2016, 1, 1), date(2016, 1, 2)}, {"EUR", "CZK"})
+    assert [(r.date, r.currency, r.rate) for r in best_rates] == [(date(2016, 1, 1), "EUR", Decimal("0.91"))]
+
+
+@pytest.mark.slow
+def test_get_best_rates_by_dates_currencies__providers_of_best_rates(dao_exchange_rate, dao_provider, db_session, logger):
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    provider2 = dao_provider.get_or_create_provider_id("test2")
+    records = [
+        {"date": date(2016, 1, 1), "currency": "EUR", "provider_id": provider1, "rate": Decimal("0.9")},
+        {"date": date(2016, 1, 1), "currency": "EUR", "provider_id": provider2, "rate": Decimal("0.91")},
+        {"date": date(2016, 1, 1), "currency": "CZK", "provider_id": provider2, "rate": Decimal(25)},
+        {"date": date(2016, 1, 2), "currency": "EUR", "provider_id": provider1, "rate": Decimal("0.92")},
+    ]
+    dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+    dao_exchange_rate.save_best_rates({(date(2016, 1, 1), "EUR"): Decimal("0.9"), (date(2016, 1, 1), "CZK"): Decimal(25)})
+    db_session.commit()
+
+    best_rates = dao_exchange_rate.get_best_rates_by_dates_currencies({date(2016, 1, 1), date(2016, 1, 2)}, {"EUR", "CZK"}, {provider1, provider2})
+    assert sorted((r.currency, r.providers) for r in best_rates) == [("CZK", 1), ("EUR", 2)]
+
+    best_rates = dao_exchange_rate.get_best_rates_by_dates_currencies({date(2016, 1, 1)}, {"EUR", "CZK"}, {provider1})
+    assert sorted((r.currency, r.providers) for r in best_rates) == [("CZK", 0), ("EUR", 1)]
+
+
+@pytest.mark.slow
+def test_best_rates_lock__commits_changes(dao_exchange_rate, db_session):
+    with dao_exchange_rate.best_rates_lock([date(2016, 1, 2), date(2016, 1, 1)]):
+        dao_exchange_rate.save_best_rates({(date(2016, 1, 1), "EUR"): Decimal("0.9")})
+
+    with pytest.raises(RuntimeError):
+        with dao_exchange_rate.best_rates_lock([date(2016, 1, 1)]):
+            dao_exchange_rate.save_best_rates({(date(2016, 1, 1), "CZK"): Decimal(25)})
+            raise RuntimeError
+
+    locks = db_session.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory'").scalar()
+    assert locks == 0
+    assert [r.currency for r in dao_exchange_rate.get_best_rates_by_dates_currencies({date(2016, 1, 1)}, {"EUR", "CZK"})] == ["EUR"]
+
+
+@pytest.mark.slow
+def test_convert_rate_type__rounding_error_is_bounded(dao_exchange_rate, dao_provider, db_connection, logger):
+    provider1 = dao_provider.get_or_create_provider_id("test1")
+    random_generator = random.Random(23)
+    currencies = [f"C{currency:02}" for currency in range(20)]
+    # rates parsed from floats have about 50 digits, from bitcoin to hyperinflation currencies
+    rates = {
+        (date(2016, 1, day), currency): Decimal(random_generator.uniform(1, 10) * 10 ** random_generator.randint(-5, 8))
+        for day in range(1, 11) for currency in currencies
+    }
+    records = [{"date": day, "currency": currency, "provider_id": provider1, "rate": rate} for (day, currency), rate in rates.items()]
+    dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+
+    with db_connection.begin():
+        assert convert_rate_type(db_connection, 24, 12)
+    with db_connection.begin():
+        assert not convert_rate_type(db_connection, 24, 12)
+
+    error_bound = Decimal("0.5e-12")
+    stored_rates = {(r.date, r.currency): r.rate for r in dao_exchange_rate.get_rates_in_period(date(2016, 1, 1), date(2016, 1, 10), set(currencies))}
+    assert stored_rates.keys() == rates.keys()
+    for key, rate in rates.items():
+        assert abs(stored_rates[key] - rate) <= error_bound
+        assert stored_rates[key] == round(rate, 12)
+
+    for currency in currencies:
+        [(_, count, rate_sum)] = dao_exchange_rate.get_sum_of_rates_in_period(date(2016, 1, 1), date(2016, 1, 10), currency)
+        original_sum = sum(rate for (_, rate_currency), rate in rates.items() if rate_currency == currency)
+        assert abs(rate_sum / count - original_sum / count) <= error_bound
+
+    for (day, from_currency), from_rate in list(rates.items())[:50]:
+        to_rate = rates[(day, "C00")]
+        conversion = stored_rates[(day, "C00")] / stored_rates[(day, from_currency)]
+        relative_error_bound = error_bound / to_rate + error_bound / from_rate + Decimal("1e-25")  # plus rounding of the division
+        assert abs(conversion / (to_rate / from_rate) - 1) <= relative_error_bound
+
+    dao_exchange_rate.insert_new_rate(date(2016, 1, 11), provider1, "C00", Decimal(1 / 3))
+    assert dao_exchange_rate.get_rate_by_date_currency_provider(date(2016, 1, 11), "C00", provider1).rate == Decimal("0.333333333333")
+
+    with db_connection.begin():
+        assert convert_rate_type(db_connection, None, 12)
+    assert dao_exchange_rate.get_rate_by_date_currency_provider(date(2016, 1, 1), "C00", provider1).rate == stored_rates[(date(2016, 1, 1), "C00")]
+
+
+@pytest.mark.slow
+def test_convert_rate_type__missing_table(db_session, db_connection):
+    db_connection.execute('DROP TABLE "USD_exchange_rates"')
+
+    with pytest.raises(ImproperlyConfigured):
+        with db_connection.begin():
+            convert_rate_type(db_connection, 24, 12)
@@ -0,0 +1,235 @@
+import re
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from gold_digger.database.dao_exchange_rate import DaoExchangeRate
+from gold_digger.database.dao_provider import DaoProvider
+from gold_digger.database.migrations import migrate, partition_exchange_rates, rebuild_cumulative_sums
+from gold_digger.database.partitions import is_partitioned
+from gold_digger.managers.exchange_rate_manager import ExchangeRateManager
+
+
+@pytest.fixture
+def seeded_db_session(db_session, db_connection_string):
+    """
+    Five years of rates of 30 currencies from 3 providers with fresh statistics and visibility map, as in long running database.
+    """
+    dao_provider = DaoProvider(db_session)
+    for name in ("test1", "test2", "test3"):
+        dao_provider.get_or_create_provider_id(name)
+
+    db_session.execute("""
+        INSERT INTO "USD_exchange_rates" (date, provider_id, currency, rate)
+        SELECT day, provider.id, 'C' || lpad(currency::text, 2, '0'), random() * 100
+        FROM generate_series('2015-01-01'::date, '2019-12-31'::date, '1 day') AS day, provider, generate_series(1, 30) AS currency
+    """)
+    db_session.commit()
+
+    rebuild_cumulative_sums(db_session.connection())
+    db_session.commit()
+
+    engine = create_engine(db_connection_string, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute('VACUUM ANALYZE "USD_exchange_rates"')
+        connection.execute('VACUUM ANALYZE "USD_exchange_rates_cumulative_sum"')
+    engine.dispose()
+
+    return db_session
+
+
+def _explain(db_session, query):
+    """
+    Run the query and return plan of the last statement it executed.
+
+    :type db_session: sqlalchemy.orm.Session
+    :type query: callable
+    :rtype: str
+    """
+    connection = db_session.connection()
+    statements = []
+
+    def before_cursor_execute(_connection, _cursor, statement, parameters, *_):
+        statements.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        query()
+    finally:
+        event.remove(connection, "before_cursor_execute", before_cursor_execute)
+
+    statement, parameters = statements[-1]
+    cursor = connection.connection.cursor()
+    cursor.execute("EXPLAIN " + statement, parameters)
+    return "\n".join(row for row, in cursor.fetchall())
+
+
+def _scanned_partitions(plan):
+    """
+    :type plan: str
+    :rtype: set[str]
+    """
+    return set(re.findall(r' on "USD_exchange_rates_(\d{4}|default)"', plan))
+
+
+@pytest.mark.slow
+def test_covering_index_only_scans(seeded_db_session):
+    dao_exchange_rate = DaoExchangeRate(seeded_db_session)
+
+    queries = (
+        lambda: dao_exchange_rate.get_rates_by_date_currency(date(2017, 6, 15), "C07"),
+        lambda: dao_exchange_rate.get_rate_by_date_currency_provider(date(2017, 6, 15), "C07", 2),
+    )
+    for query in queries:
+        plan = _explain(seeded_db_session, query)
+        assert 'Index Only Scan using "USD_exchange_rates_2017_currency_date_provider_id_rate_id_idx" on "USD_exchange_rates_2017"' in plan, plan
+
+
+@pytest.mark.slow
+def test_range_queries__prune_partitions(seeded_db_session):
+    dao_exchange_rate = DaoExchangeRate(seeded_db_session)
+    records = [
+        {"date": date(2016, 12, 31), "provider_id": 1, "currency": "C07", "rate": Decimal(1)},
+        {"date": date(2018, 1, 1), "provider_id": 1, "currency": "C07", "rate": Decimal(1)},
+    ]
+
+    queries = (
+        (lambda: dao_exchange_rate.get_rates_in_period(date(2017, 3, 1), date(2017, 4, 30), {"C07"}), {"2017"}),
+        (lambda: dao_exchange_rate.get_rates_by_dates_currencies({date(2016, 5, 1), date(2018, 5, 1)}, {"C07", "C12"}), {"2016", "2018"}),
+        (lambda: dao_exchange_rate.get_rates_by_date_provider(date(2019, 2, 1), 2), {"2019"}),
+        (lambda: dao_exchange_rate.get_dates_with_complete_rates(2, date(2018, 11, 1), date(2019, 1, 31), {"C01", "C02"}, 0.9), {"2018", "2019"}),
+        (lambda: dao_exchange_rate._get_rates_for_update(records), {"2016", "2018"}),
+    )
+    for query, partitions in queries:
+        plan = _explain(seeded_db_session, query)
+        assert _scanned_partitions(plan) == partitions, plan
+
+
+@pytest.mark.slow
+def test_sum_of_rates_in_period__point_lookups_of_cumulative_sums(seeded_db_session):
+    dao_exchange_rate = DaoExchangeRate(seeded_db_session)
+
+    plan = _explain(seeded_db_session, lambda: dao_exchange_rate.get_sum_of_rates_in_period(date(2016, 1, 1), date(2018, 12, 31), "C07"))
+
+    assert plan.count('Index Scan Backward using "USD_exchange_rates_cumulative_sum_pkey"') == 2, plan
+    assert 'on "USD_exchange_rates" ' not in plan, plan
+
+
+@pytest.mark.slow
+def test_insert_exchange_rate_to_db__backfill_shifts_each_cumulative_sum_once(seeded_db_session, logger):
+    """
+    Backfill of many days joins each following running sum with one shift, not with every backfilled day before it.
+    """
+    dao_exchange_rate = DaoExchangeRate(seeded_db_session)
+    days = [date(2015, 1, 1) + timedelta(days=day) for day in range(0, 1800)]
+    dao_exchange_rate.insert_exchange_rate_to_db([dict(currency="C31", rate=Decimal(1), date=day, provider_id=1) for day in days[1::2]], logger)
+
+    connection = seeded_db_session.connection()
+    statements = []
+
+    def before_cursor_execute(_connection, _cursor, statement, parameters, *_):
+        if statement.lstrip().startswith('UPDATE "USD_exchange_rates_cumulative_sum"'):
+            statements.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        dao_exchange_rate.insert_exchange_rate_to_db([dict(currency="C31", rate=Decimal(2), date=day, provider_id=1) for day in days[:1000:2]], logger)
+    finally:
+        event.remove(connection, "before_cursor_execute", before_cursor_execute)
+
+    statement, parameters = statements[-1]
+    cursor = connection.connection.cursor()
+    cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + statement, parameters)
+    plan, = cursor.fetchone()
+
+    def join_rows(node):
+        rows = [node["Actual Rows"]] if node["Node Type"] in ("Nested Loop", "Hash Join", "Merge Join") else []
+        return rows + [row for child in node.get("Plans", []) for row in join_rows(child)]
+
+    assert max(join_rows(plan[0]["Plan"])) <= len(days), plan
+
+
+@pytest.mark.slow
+def test_best_rates__point_lookups(seeded_db_session, db_connection_string, logger):
+    dao_exchange_rate = DaoExchangeRate(seeded_db_session)
+    currencies = {f"C{currency:02}" for currency in range(1, 31)}
+    ExchangeRateManager(dao_exchange_rate, DaoProvider(seeded_db_session), [], "USD", currencies).rebuild_best_rates(logger)
+
+    rates = sorted(dao_exchange_rate.get_rates_by_date_currency(date(2017, 6, 15), "C07"), key=lambda r: r.provider_id)
+    best_rates = dao_exchange_rate.get_best_rates_by_dates_currencies({date(2017, 6, 15)}, {"C07"})
+    assert [r.rate for r in best_rates] == [ExchangeRateManager.pick_the_best([r.rate for r in rates])]
+
+    engine = create_engine(db_connection_string, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute('VACUUM ANALYZE "USD_exchange_rates_best"')
+    engine.dispose()
+
+    plan = _explain(seeded_db_session, lambda: dao_exchange_rate.get_best_rates_by_dates_currencies({date(2017, 6, 15)}, {"C07", "C12"}))
+    assert 'Index Scan using "USD_exchange_rates_best_pkey"' in plan, plan
+
+
+@pytest.mark.slow
+def test_migrate__creates_covering_index(db_session, db_connection, logger):
+    db_connection.execute('DROP INDEX "ix_USD_exchange_rates_currency_date"')
+
+    migrate(db_connection, logger)
+    migrate(db_connection, logger)
+
+    indexes = db_connection.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_USD_exchange_rates_currency_date'").fetchall()
+    assert len(indexes) == 1
+    assert "INCLUDE (provider_id, rate, id)" in indexes[0][0]
+
+
+@pytest.mark.slow
+def test_partition_exchange_rates(db_session, db_connection, logger):
+    dao_exchange_rate = DaoExchangeRate(db_session)
+    provider_id = DaoProvider(db_session).get_or_create_provider_id("test1")
+    db_session.commit()
+
+    db_connection.execute('DROP TABLE "USD_exchange_rates"')
+    db_connection.execute("""
+        CREATE TABLE "USD_exchange_rates" (
+            id BIGSERIAL PRIMARY KEY, date DATE, provider_id INTEGER REFERENCES provider (id), currency VARCHAR NOT NULL, rate NUMERIC,
+            UNIQUE (date, provider_id, currency)
+        )
+    """)
+    migrate(db_connection, logger)
+    records = [
+        {"date": date(2012, 5, 1), "provider_id": provider_id, "currency": "EUR", "rate": Decimal("0.8")},
+        {"date": date(2018, 5, 1), "provider_id": provider_id, "currency": "EUR", "rate": Decimal("0.9")},
+    ]
+    dao_exchange_rate.insert_exchange_rate_to_db(records, logger)
+    rows = db_connection.execute('SELECT * FROM "USD_exchange_rates" ORDER BY id').fetchall()
+
+    assert not is_partitioned(db_connection, "USD_exchange_rates")
+
+    with db_connection.begin():
+        partition_exchange_rates(db_connection)
+    with db_connection.begin():
+        partition_exchange_rates(db_connection)
+
+    assert is_partitioned(db_connection, "USD_exchange_rates")
+    assert db_connection.execute('SELECT * FROM "USD_exchange_rates" ORDER BY id').fetchall() == rows
+    assert db_connection.execute('SELECT count(*) FROM "USD_exchange_rates_2012"').scalar() == 1
+    assert db_connection.execute('SELECT count(*) FROM "USD_exchange_rates_default"').scalar() == 0
+
+    dao_exchange_rate.insert_new_rate(date(2019, 5, 1), provider_id, "EUR", Decimal(1))
+
+    assert db_connection.execute('SELECT max(id) FROM "USD_exchange_rates"').scalar() > rows[-1].id
+    assert dao_exchange_rate.get_sum_of_rates_in_period(date(2012, 1, 1), date(2019, 12, 31), "EUR") == [(provider_id, 3, Decimal("2.7"))]
+
+
+@pytest.mark.slow
+def test_migrate__creates_partitions_of_rates_stored_in_default_partition(db_session, db_connection, logger):
+    provider_id = DaoProvider(db_session).get_or_create_provider_id("test1")
+    db_session.commit()
+    next_year = date.today().year + 1
+    db_connection.execute(f'DROP TABLE "USD_exchange_rates_{next_year}"')
+    DaoExchangeRate(db_session).insert_new_rate(date(next_year, 1, 1), provider_id, "EUR", Decimal(1))
+
+    migrate(db_connection, logger)
+
+    assert db_connection.execute(f'SELECT count(*) FROM "USD_exchange_rates_{next_year}"').scalar() == 1
+    assert db_connection.execute('SELECT count(*) FROM "USD_exchange_rates_default"').scalar() == 0
@@ -1,32 +1,43 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from decimal import Decimal
-from unittest.mock import Mock
+from threading import Barrier, current_thread
+from time import sleep
+from unittest.mock import MagicMock, Mock
 
+import numpy as np
 import pytest
 
 from gold_digger.data_providers import CurrencyLayer, Fixer, GrandTrunk
 from gold_digger.database.dao_exchange_rate import DaoExchangeRate
 from gold_digger.database.dao_provider import DaoProvider
 from gold_digger.database.db_model import ExchangeRate, Provider
+from gold_digger.exceptions import ProviderUnavailable
 from gold_digger.managers.exchange_rate_manager import ExchangeRateManager
+from gold_digger.managers.update_checkpoint import UpdateCheckpoint
+from gold_digger.utils.negative_cache import NegativeCache
 
 
 @pytest.fixture
 def dao_exchange_rate():
-    return Mock(DaoExchangeRate)
+    m = Mock(DaoExchangeRate)
+    m.get_best_rates_by_dates_currencies.return_value = []
+    m.get_rates_by_dates_currencies.return_value = []
+    m.best_rates_lock.return_value = MagicMock()
+    return m
 
 
 @pytest.fixture
 def dao_provider():
     m = Mock(DaoProvider)
 
-    def _get_or_create_provider_by_name(name):
-        return {
-            "currency_layer": Provider(id=1, name="currency_layer"),
-            "grandtrunk": Provider(id=2, name="grandtrunk")
-        }.get(name)
+    def _get_provider_id(name):
+        return {"currency_layer": 1, "grandtrunk": 2}.get(name)
 
-    m.get_or_create_provider_by_name.side_effect = _get_or_create_provider_by_name
+    m.get_provider_id.side_effect = _get_provider_id
+    m.get_or_create_provider_id.side_effect = _get_provider_id
     return m
 
 
@@ -37,6 +48,9 @@ def currency_layer(currencies):
     provider.get_all_by_date.return_value = {"EUR": Decimal(0.77), "USD": Decimal(1)}
     provider.get_supported_currencies.return_value = currencies
     provider.has_request_limit = True
+    provider.all_currencies_in_one_request = True
+    provider.publishes_weekend_rates = True
+    provider.negative_cache_ttls = {}
     return provider
 
 
@@ -46,6 +60,9 @@ def fixer(currencies):
     provider.name = "fixer.io"
     provider.get_supported_currencies.return_value = currencies
     provider.has_request_limit = True
+    provider.all_currencies_in_one_request = True
+    provider.publishes_weekend_rates = True
+    provider.negative_cache_ttls = {}
     return provider
 
 
@@ -56,6 +73,9 @@ def grandtrunk(currencies):
     provider.get_all_by_date.return_value = {"EUR": Decimal(0.75), "USD": Decimal(1)}
     provider.get_supported_currencies.return_value = currencies
     provider.has_request_limit = False
+    provider.all_currencies_in_one_request = False
+    provider.publishes_weekend_rates = True
+    provider.negative_cache_ttls = {}
     return provider
 
 
@@ -69,7 +89,7 @@ def test_update_all_rates_by_date(dao_exchange_rate, dao_provider, currency_laye
     exchange_rate_manager.update_all_rates_by_date(_date, [currency_layer], logger)
 
     (actual_records, _), _ = dao_exchange_rate.insert_exchange_rate_to_db.call_args
-    (provider_name,), _ = dao_provider.get_or_create_provider_by_name.call_args
+    (provider_name,), _ = dao_provider.get_or_create_provider_id.call_args
 
     assert provider_name == currency_layer.name
     assert sorted(actual_records, key=lambda x: x["currency"]) == [
@@ -78,6 +98,208 @@ def test_update_all_rates_by_date(dao_exchange_rate, dao_provider, currency_laye
     ]
 
 
+def test_update_all_rates_by_date__refreshes_best_rates(dao_exchange_rate, dao_provider, currency_layer, base_currency, currencies, logger):
+    """
+    Best rates of the stored currencies are picked again from rates of all providers in order of the providers and stored.
+    """
+    _date = date(2016, 2, 17)
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [
+        ExchangeRate(provider_id=2, date=_date, currency="EUR", rate=Decimal("0.75")),
+        ExchangeRate(provider_id=1, date=_date, currency="EUR", rate=Decimal("0.77")),
+        ExchangeRate(provider_id=1, date=_date, currency="USD", rate=Decimal(1)),
+        ExchangeRate(provider_id=1, date=_date, currency="CZK", rate=Decimal(25)),
+    ]
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer], base_currency, currencies)
+    exchange_rate_manager.update_all_rates_by_date(_date, [currency_layer], logger)
+
+    dao_exchange_rate.best_rates_lock.assert_called_once_with([_date])
+    dao_exchange_rate.get_rates_by_dates_currencies.assert_called_once_with({_date}, {"EUR", "USD"})
+    dao_exchange_rate.save_best_rates.assert_called_once_with({(_date, "EUR"): Decimal("0.77"), (_date, "USD"): Decimal(1)})
+
+
+def test_get_exchange_rate_by_date__past_date_from_stored_best_rates(
+    dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger
+):
+    """
+    Best rates of past dates are read as they were stored, neither rates of providers nor the providers are requested.
+    Provider with request limit isn't requested for past dates, so best rates with rate of the other provider are complete.
+    """
+    _date = date(2016, 2, 17)
+
+    dao_exchange_rate.get_best_rates_by_dates_currencies.return_value = [
+        Mock(date=_date, currency="EUR", rate=Decimal("0.8"), providers=1),
+        Mock(date=_date, currency="CZK", rate=Decimal(20), providers=1),
+    ]
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies)
+
+    assert exchange_rate_manager.get_exchange_rate_by_date(_date, "EUR", "CZK", logger) == Decimal(20) / Decimal("0.8")
+    dao_exchange_rate.get_best_rates_by_dates_currencies.assert_called_once_with({_date}, {"EUR", "CZK"}, {2})
+    assert dao_exchange_rate.get_rates_by_dates_currencies.call_count == 0
+    assert grandtrunk.get_by_date.call_count == 0
+
+
+def test_get_exchange_rate_by_date__stored_best_rates_without_some_provider_are_completed(
+    dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger
+):
+    """
+    Stored best rate picked without rate of some provider is picked again after the provider is requested.
+    Rates are picked in order of providers like when best rates are stored, although the requested rate of the first provider comes last.
+    """
+    _date = date(2016, 2, 17)
+
+    currency_layer.has_request_limit = False
+    dao_exchange_rate.get_best_rates_by_dates_currencies.return_value = [Mock(date=_date, currency="EUR", rate=Decimal("0.75"), providers=1)]
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [ExchangeRate(provider_id=2, date=_date, currency="EUR", rate=Decimal("0.75"))]
+    dao_exchange_rate.get_rates_by_date_provider.return_value = [ExchangeRate(provider_id=1, date=_date, currency="EUR", rate=Decimal("0.77"))]
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies)
+
+    assert exchange_rate_manager.get_best_rate_by_date(_date, "EUR", logger) == Decimal("0.77")
+    currency_layer.get_all_by_date.assert_called_once_with(_date, currencies, logger)
+    assert grandtrunk.get_by_date.call_count == 0
+
+
+def test_get_exchange_rate_by_date__stored_best_rates_expire(dao_exchange_rate, dao_provider, base_currency, currencies, logger):
+    """
+    Best rates can be stored again by other processes, so they are cached only for limited time.
+    """
+    _date = date(2016, 2, 17)
+
+    dao_exchange_rate.get_best_rates_by_dates_currencies.return_value = [Mock(date=_date, currency="EUR", rate=Decimal("0.8"), providers=0)]
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, currencies, best_rates_cache_ttl=0)
+    for _ in range(2):
+        assert exchange_rate_manager.get_best_rate_by_date(_date, "EUR", logger) == Decimal("0.8")
+
+    assert dao_exchange_rate.get_best_rates_by_dates_currencies.call_count == 2
+
+
+def test_update_all_rates_by_date__providers_are_requested_concurrently(
+    dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger
+):
+    """
+    Both providers have to be requested at the same time to pass the barrier. Rates are stored in the calling thread.
+    """
+    _date = date(2016, 2, 17)
+    barrier = Barrier(2, timeout=5)
+    storing_threads = []
+
+    def _get_all_by_date_after_other_provider(day_rates):
+        def _get_all_by_date(*_):
+            barrier.wait()
+            return day_rates
+        return _get_all_by_date
+
+    currency_layer.get_all_by_date.side_effect = _get_all_by_date_after_other_provider({"EUR": Decimal(0.77)})
+    grandtrunk.get_all_by_date.side_effect = _get_all_by_date_after_other_provider({"EUR": Decimal(0.75)})
+    dao_exchange_rate.insert_exchange_rate_to_db.side_effect = lambda *_, **__: storing_threads.append(current_thread())
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies)
+    exchange_rate_manager.update_all_rates_by_date(_date, [currency_layer, grandtrunk], logger, max_workers=2)
+
+    assert storing_threads == [current_thread(), current_thread()]
+    assert sorted(args[0][0]["provider_id"] for args, _ in dao_exchange_rate.insert_exchange_rate_to_db.call_args_list) == [1, 2]
+
+
+def test_update_all_historical_rates__chunks_are_stored_as_they_arrive(dao_exchange_rate, dao_provider, currency_layer, base_currency, currencies, logger):
+    """
+    Historical rates are stored chunk by chunk. Chunks downloaded before the provider failed are kept.
+    """
+    def _get_historical(*_, **__):
+        yield {date(2016, 2, 17): {"EUR": Decimal(0.77)}}
+        yield {date(2016, 2, 18): {"EUR": Decimal(0.78)}, date(2016, 2, 19): {"EUR": Decimal(0.79)}}
+        raise ValueError("Provider failed")
+
+    currency_layer.get_historical.side_effect = _get_historical
+    dao_exchange_rate.get_dates_with_complete_rates.return_value = set()
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer], base_currency, currencies)
+    exchange_rate_manager.update_all_historical_rates(date(2016, 2, 17), logger)
+
+    assert [args[0] for args, _ in dao_exchange_rate.insert_exchange_rate_to_db.call_args_list] == [
+        [{"provider_id": 1, "date": date(2016, 2, 17), "currency": "EUR", "rate": Decimal(0.77)}],
+        [
+            {"provider_id": 1, "date": date(2016, 2, 18), "currency": "EUR", "rate": Decimal(0.78)},
+            {"provider_id": 1, "date": date(2016, 2, 19), "currency": "EUR", "rate": Decimal(0.79)},
+        ],
+    ]
+
+
+def test_update_all_historical_rates_async(dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger):
+    """
+    Providers are updated at the same time, rates are stored in the event loop thread and failure of one provider doesn't stop the others.
+    """
+    storing_threads = []
+    dao_exchange_rate.insert_exchange_rate_to_db.side_effect = lambda *_, **__: storing_threads.append(current_thread())
+    dao_exchange_rate.get_dates_with_complete_rates.return_value = set()
+
+    async def _get_historical_currency_layer(*_, concurrency, **__):
+        yield {date(2016, 2, 17): {"EUR": Decimal(0.77)}}
+        await asyncio.sleep(0)
+        raise ValueError("Provider failed")
+
+    async def _get_historical_grandtrunk(*_, concurrency, **__):
+        await asyncio.sleep(0)
+        yield {date(2016, 2, 17): {"EUR": Decimal(0.75)}}
+        yield {date(2016, 2, 18): {"EUR": Decimal(0.76)}}
+
+    currency_layer.get_historical_async = _get_historical_currency_layer
+    grandtrunk.get_historical_async = _get_historical_grandtrunk
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies)
+    asyncio.run(exchange_rate_manager.update_all_historical_rates_async(date(2016, 2, 17), logger, concurrency=2))
+
+    assert [args[0] for args, _ in dao_exchange_rate.insert_exchange_rate_to_db.call_args_list] == [
+        [{"provider_id": 1, "date": date(2016, 2, 17), "currency": "EUR", "rate": Decimal(0.77)}],
+        [{"provider_id": 2, "date": date(2016, 2, 17), "currency": "EUR", "rate": Decimal(0.75)}],
+        [{"provider_id": 2, "date": date(2016, 2, 18), "currency": "EUR", "rate": Decimal(0.76)}],
+    ]
+    assert storing_threads == [current_thread()] * 3
+
+
+def test_update_all_historical_rates__resume_and_skip_complete_dates(
+    dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger, tmp_path
+):
+    """
+    Update is resumed since the day after the last stored date of the provider and dates with complete rates in database are not requested.
+    Dates are complete with rates of the supported currencies which the provider offers.
+    """
+    origin_date = date(2016, 2, 1)
+    checkpoint = UpdateCheckpoint(str(tmp_path / "checkpoint.json"), origin_date)
+    checkpoint.save("grandtrunk", date(2016, 2, 17))
+
+    currency_layer.get_historical.return_value = [{date(2016, 2, 2): {"EUR": Decimal(0.77)}}]
+    grandtrunk.get_historical.return_value = [{date(2016, 2, 18): {"EUR": Decimal(0.75)}}, {date(2016, 2, 20): {"EUR": Decimal(0.76)}}]
+    grandtrunk.get_supported_currencies.return_value = {"EUR", "CZK", "XXX"}
+    dao_exchange_rate.get_dates_with_complete_rates.return_value = {date(2016, 2, 19)}
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies)
+    exchange_rate_manager.update_all_historical_rates(origin_date, logger, checkpoint=checkpoint)
+
+    assert [args[3] for args, _ in dao_exchange_rate.get_dates_with_complete_rates.call_args_list] == [currencies, {"EUR", "CZK"}]
+
+    assert currency_layer.get_historical.call_args == ((origin_date, currencies, logger), {"excluded_dates": {date(2016, 2, 19)}})
+    assert grandtrunk.get_historical.call_args == ((date(2016, 2, 18), currencies, logger), {"excluded_dates": {date(2016, 2, 19)}})
+    assert dao_exchange_rate.insert_exchange_rate_to_db.call_count == 3
+
+    checkpoint = UpdateCheckpoint(str(tmp_path / "checkpoint.json"), origin_date)
+    assert checkpoint.get_last_date("currency_layer") == date(2016, 2, 2)
+    assert checkpoint.get_last_date("grandtrunk") == date(2016, 2, 20)
+
+
+def test_update_checkpoint__ignored_for_earlier_origin_date(tmp_path):
+    """
+    Progress of update since later origin date doesn't cover days before it.
+    """
+    UpdateCheckpoint(str(tmp_path / "checkpoint.json"), date(2016, 2, 1)).save("grandtrunk", date(2016, 2, 17))
+
+    assert UpdateCheckpoint(str(tmp_path / "checkpoint.json"), date(2016, 3, 1)).get_last_date("grandtrunk") == date(2016, 2, 17)
+    assert UpdateCheckpoint(str(tmp_path / "checkpoint.json"), date(2015, 1, 1)).get_last_date("grandtrunk") is None
+
+
 def test_get_or_update_rate_by_date(dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger):
     """
     Get all rates by date.
@@ -91,17 +313,17 @@ def test_get_or_update_rate_by_date(dao_exchange_rate, dao_provider, currency_la
 
     grandtrunk.get_by_date.return_value = Decimal(0.75)
     dao_exchange_rate.get_rates_by_date_currency.return_value = [
-        ExchangeRate(provider=Provider(name="currency_layer"), date=_date, currency="EUR", rate=Decimal(0.77))
+        ExchangeRate(provider_id=1, date=_date, currency="EUR", rate=Decimal(0.77))
     ]
     dao_exchange_rate.insert_new_rate.return_value = [
-        ExchangeRate(provider=Provider(name="grandtrunk"), date=_date, currency="EUR", rate=Decimal(0.75))
+        ExchangeRate(provider_id=2, date=_date, currency="EUR", rate=Decimal(0.75))
     ]
 
     exchange_rates = exchange_rate_manager.get_or_update_rate_by_date(_date, currency="EUR", logger=logger)
     insert_new_rate_args, _ = dao_exchange_rate.insert_new_rate.call_args
 
     assert dao_exchange_rate.insert_new_rate.call_count == 1
-    assert insert_new_rate_args[1].name == "grandtrunk"
+    assert insert_new_rate_args[1] == 2
     assert len(exchange_rates) == 2
 
 
@@ -118,8 +340,8 @@ def test_get_or_update_rate_by_date__today_after_cron_update(dao_exchange_rate,
 
     grandtrunk.get_by_date.return_value = Decimal(0.75)
     dao_exchange_rate.get_rates_by_date_currency.return_value = [
-        ExchangeRate(provider=Provider(name="currency_layer"), date=today, currency="EUR", rate=Decimal(0.77)),
-        ExchangeRate(provider=Provider(name="grandtrunk"), date=today, currency="EUR", rate=Decimal(0.75)),
+        ExchangeRate(provider_id=1, date=today, currency="EUR", rate=Decimal(0.77)),
+        ExchangeRate(provider_id=2, date=today, currency="EUR", rate=Decimal(0.75)),
     ]
     dao_exchange_rate.get_rate_by_date_currency_provider.return_value = []
 
@@ -143,16 +365,16 @@ def test_get_or_update_rate_by_date__today_before_cron_update(dao_exchange_rate,
 
     grandtrunk.get_by_date.return_value = Decimal(0.75)
     dao_exchange_rate.get_rates_by_date_currency.return_value = [
-        ExchangeRate(provider=Provider(name="currency_layer"), date=today, currency="EUR", rate=Decimal(0.77))
+        ExchangeRate(provider_id=1, date=today, currency="EUR", rate=Decimal(0.77))
     ]
     dao_exchange_rate.get_rate_by_date_currency_provider.return_value = [
-        ExchangeRate(provider=Provider(name="grandtrunk"), date=yesterday, currency="EUR", rate=Decimal(0.75))
+        ExchangeRate(provider_id=2, date=yesterday, currency="EUR", rate=Decimal(0.75))
     ]
 
     exchange_rates = exchange_rate_manager.get_or_update_rate_by_date(today, currency="EUR", logger=logger)
 
     assert dao_exchange_rate.get_rate_by_date_currency_provider.call_count == 1
-    assert dao_exchange_rate.get_rate_by_date_currency_provider.call_args[0] == (yesterday, "EUR", "grandtrunk")
+    assert dao_exchange_rate.get_rate_by_date_currency_provider.call_args[0] == (yesterday, "EUR", 2)
     assert len(exchange_rates) == 2
 
 
@@ -173,20 +395,20 @@ def test_get_or_update_rate_by_date__today_before_cron_update_no_yesterday_rates
 
     grandtrunk.get_by_date.return_value = Decimal(0.75)
     dao_exchange_rate.get_rates_by_date_currency.return_value = [
-        ExchangeRate(provider=Provider(name="currency_layer"), date=today, currency="EUR", rate=Decimal(0.77))
+        ExchangeRate(provider_id=1, date=today, currency="EUR", rate=Decimal(0.77))
     ]
     dao_exchange_rate.get_rate_by_date_currency_provider.return_value = []
     dao_exchange_rate.insert_new_rate.return_value = [
-        ExchangeRate(provider=Provider(name="grandtrunk"), date=today, currency="EUR", rate=Decimal(0.75))
+        ExchangeRate(provider_id=2, date=today, currency="EUR", rate=Decimal(0.75))
     ]
 
     exchange_rates = exchange_rate_manager.get_or_update_rate_by_date(today, currency="EUR", logger=logger)
     insert_new_rate_args, _ = dao_exchange_rate.insert_new_rate.call_args
 
     assert dao_exchange_rate.insert_new_rate.call_count == 1
-    assert insert_new_rate_args[1].name == "grandtrunk"
+    assert insert_new_rate_args[1] == 2
     assert dao_exchange_rate.get_rate_by_date_currency_provider.call_count == 1
-    assert dao_exchange_rate.get_rate_by_date_currency_provider.call_args[0] == (yesterday, "EUR", "grandtrunk")
+    assert dao_exchange_rate.get_rate_by_date_currency_provider.call_args[0] == (yesterday, "EUR", 2)
     assert len(exchange_rates) == 2
 
 
@@ -212,21 +434,314 @@ def test_get_or_update_rate_by_date__no_api_requests_for_historical_data_on_limi
     assert len(exchange_rates) == 1
 
 
-def test_get_exchange_rate_by_date(dao_exchange_rate, dao_provider, base_currency, logger):
+def test_get_or_update_rate_by_date__concurrent_requests_of_missing_rate(
+    dao_exchange_rate, dao_provider, grandtrunk, base_currency, currencies, logger
+):
+    """
+    Concurrent requests of the same missing rate request the provider only once and all of them get the stored rate.
+    """
     _date = date(2016, 2, 17)
+    requests = 5
+    barrier = Barrier(requests, timeout=5)
 
-    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, set())
+    def _get_rates_by_date_currency(*_):
+        barrier.wait()  # all requests miss the rate at the same time
+        return []
 
-    def _get_rates_by_date_currency(_, currency):
-        return {
-            "EUR": [ExchangeRate(id=1, currency="EUR", rate=Decimal(0.89), provider=Provider(name="currency_layer"))],
-            "CZK": [ExchangeRate(id=2, currency="CZK", rate=Decimal(24.20), provider=Provider(name="currency_layer"))]
-        }.get(currency)
+    def _get_by_date(*_):
+        sleep(0.1)  # the other requests join meanwhile
+        return Decimal(0.75)
 
+    grandtrunk.get_by_date.side_effect = _get_by_date
     dao_exchange_rate.get_rates_by_date_currency.side_effect = _get_rates_by_date_currency
+    dao_exchange_rate.insert_new_rate.return_value = ExchangeRate(provider_id=2, date=_date, currency="EUR", rate=Decimal(0.75))
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [grandtrunk], base_currency, currencies)
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        results = list(executor.map(lambda _: exchange_rate_manager.get_or_update_rate_by_date(_date, "EUR", logger), range(requests)))
+
+    assert grandtrunk.get_by_date.call_count == 1
+    assert dao_exchange_rate.insert_new_rate.call_count == 1
+    assert [[r.rate for r in rates] for rates in results] == [[Decimal(0.75)]] * requests
+
+
+def test_get_or_update_rate_by_date__whole_day_of_provider_with_all_currencies_in_one_request(
+    dao_exchange_rate, dao_provider, currency_layer, base_currency, currencies, logger
+):
+    """
+    Missing rate of provider returning all currencies in one response is requested with the whole day, which is stored at once.
+    """
+    _date = date(2016, 2, 17)
+
+    currency_layer.has_request_limit = False
+    dao_exchange_rate.get_rates_by_date_currency.return_value = []
+    dao_exchange_rate.get_rates_by_date_provider.return_value = [
+        ExchangeRate(provider_id=1, date=_date, currency="EUR", rate=Decimal(0.77)),
+        ExchangeRate(provider_id=1, date=_date, currency="USD", rate=Decimal(1)),
+    ]
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer], base_currency, currencies)
+    exchange_rates = exchange_rate_manager.get_or_update_rate_by_date(_date, "EUR", logger)
+    (records, _), _ = dao_exchange_rate.insert_exchange_rate_to_db.call_args
+
+    currency_layer.get_all_by_date.assert_called_once_with(_date, currencies, logger)
+    assert currency_layer.get_by_date.call_count == 0
+    assert dao_exchange_rate.insert_new_rate.call_count == 0
+    assert sorted(r["currency"] for r in records) == ["EUR", "USD"]
+    assert [(r.currency, r.rate) for r in exchange_rates] == [("EUR", Decimal(0.77))]
+
+
+def test_get_or_update_rate_by_date__misses_of_providers_are_not_requested_again(
+    dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger
+):
+    """
+    Weekend without rates and currency missing in the day of provider are requested only once until their TTL expires.
+    Errors are remembered for TTL of their own, which is disabled here, so the failed request is repeated.
+    """
+    saturday = date(2016, 2, 20)
+
+    currency_layer.has_request_limit = False
+    currency_layer.get_all_by_date.return_value = {"USD": Decimal(1)}
+    grandtrunk.get_by_date.return_value = None
+    dao_exchange_rate.get_rates_by_date_currency.return_value = []
+    dao_exchange_rate.get_rates_by_date_provider.return_value = [ExchangeRate(provider_id=1, date=saturday, currency="USD", rate=Decimal(1))]
+
+    exchange_rate_manager = ExchangeRateManager(
+        dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies, negative_cache_ttls={"error": 0}
+    )
+    for _ in range(3):
+        assert exchange_rate_manager.get_or_update_rate_by_date(saturday, "EUR", logger) == []
+
+    assert currency_layer.get_all_by_date.call_count == 1
+    assert grandtrunk.get_by_date.call_count == 1
+
+    grandtrunk.get_by_date.side_effect = Exception("Connection refused")
+    for _ in range(2):
+        exchange_rate_manager.get_or_update_rate_by_date(saturday - timedelta(1), "EUR", logger)
+
+    assert grandtrunk.get_by_date.call_count == 3
+
+
+def test_get_or_update_rate_by_date__kinds_of_misses(dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger):
+    """
+    Unavailable provider is remembered as error of the whole day for providers requested by days, so it is requested again soon.
+    Missing rates of weekend are remembered as weekend only for providers which don't publish rates of weekends.
+    """
+    saturday = date(2016, 2, 20)
+
+    currency_layer.has_request_limit = False
+    currency_layer.get_all_by_date.side_effect = ProviderUnavailable("Status code: 503")
+    grandtrunk.get_by_date.return_value = None
+    dao_exchange_rate.get_rates_by_date_currency.return_value = []
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies)
+    exchange_rate_manager.get_or_update_rate_by_date(saturday, "EUR", logger)
+
+    assert exchange_rate_manager._negative_cache.get(("currency_layer", saturday, None)) == NegativeCache.ERROR
+    assert exchange_rate_manager._negative_cache.get(("grandtrunk", saturday, "EUR")) == NegativeCache.MISSING
+
+    grandtrunk.publishes_weekend_rates = False
+    exchange_rate_manager.get_or_update_rate_by_date(saturday, "CZK", logger)
+
+    assert exchange_rate_manager._negative_cache.get(("grandtrunk", saturday, "CZK")) == NegativeCache.WEEKEND
+
+
+def test_get_or_update_rate_by_date__rate_stored_by_other_process(dao_exchange_rate, dao_provider, grandtrunk, base_currency, currencies, logger):
+    """
+    With advisory lock the rate is requested only if other process didn't store it while this one waited for the lock.
+    """
+    _date = date(2016, 2, 17)
+
+    dao_exchange_rate.get_rates_by_date_currency.return_value = []
+    dao_exchange_rate.rate_lock.return_value = MagicMock()
+    dao_exchange_rate.get_rate_by_date_currency_provider.return_value = ExchangeRate(provider_id=2, date=_date, currency="EUR", rate=Decimal(0.75))
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [grandtrunk], base_currency, currencies, rate_requests_advisory_lock=True)
+    exchange_rates = exchange_rate_manager.get_or_update_rate_by_date(_date, "EUR", logger)
+
+    dao_exchange_rate.rate_lock.assert_called_once_with(_date, 2, "EUR")
+    assert grandtrunk.get_by_date.call_count == 0
+    assert [r.rate for r in exchange_rates] == [Decimal(0.75)]
+
+
+def test_get_exchange_rate_by_date(dao_exchange_rate, dao_provider, base_currency, logger):
+    _date = date(2016, 2, 17)
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, set())
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [
+        ExchangeRate(id=1, date=_date, currency="EUR", rate=Decimal(0.89), provider_id=1),
+        ExchangeRate(id=2, date=_date, currency="CZK", rate=Decimal(24.20), provider_id=1),
+    ]
     exchange_rate = exchange_rate_manager.get_exchange_rate_by_date(_date, "EUR", "CZK", logger)
 
     assert exchange_rate == Decimal(24.20) / Decimal(0.89)
+    dao_exchange_rate.get_rates_by_dates_currencies.assert_called_once_with({_date}, {"EUR", "CZK"})
+
+
+def test_get_exchange_rate_by_date__missing_rate(dao_exchange_rate, dao_provider, base_currency, logger):
+    _date = date(2016, 2, 17)
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, set())
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [
+        ExchangeRate(id=1, date=_date, currency="EUR", rate=Decimal(0.89), provider_id=1),
+    ]
+    with pytest.raises(ValueError):
+        exchange_rate_manager.get_exchange_rate_by_date(_date, "EUR", "CZK", logger)
+
+
+def test_get_exchange_rate_by_date__best_rates_are_cached(dao_exchange_rate, dao_provider, base_currency, logger):
+    """
+    Historical rates are picked only once and repeated requests are answered from the cache without touching the database.
+    """
+    _date = date(2016, 2, 17)
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, set())
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [
+        ExchangeRate(id=1, date=_date, currency="EUR", rate=Decimal(0.89), provider_id=1),
+        ExchangeRate(id=2, date=_date, currency="CZK", rate=Decimal(24.20), provider_id=1),
+    ]
+    exchange_rate_manager.get_exchange_rate_by_date(_date, "EUR", "CZK", logger)
+    exchange_rate = exchange_rate_manager.get_exchange_rate_by_date(_date, "CZK", "EUR", logger)
+
+    assert exchange_rate == Decimal(0.89) / Decimal(24.20)
+    assert dao_exchange_rate.get_rates_by_dates_currencies.call_count == 1
+
+
+def test_get_best_rate_by_date__best_rates_without_some_provider_are_picked_again(
+    dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger
+):
+    """
+    Best rate picked while request of some provider failed is cached only until the miss of the provider expires,
+    the best rate picked from rates of all providers is cached for good.
+    """
+    _date = date(2016, 2, 17)
+
+    grandtrunk.get_by_date.side_effect = Exception("Connection refused")
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [ExchangeRate(id=1, date=_date, currency="EUR", rate=Decimal(0.89), provider_id=1)]
+
+    exchange_rate_manager = ExchangeRateManager(
+        dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies, negative_cache_ttls={"error": 0}
+    )
+    for _ in range(2):
+        assert exchange_rate_manager.get_best_rate_by_date(_date, "EUR", logger) == Decimal(0.89)
+
+    assert grandtrunk.get_by_date.call_count == 2
+
+    grandtrunk.get_by_date.side_effect = None
+    grandtrunk.get_by_date.return_value = Decimal(0.75)
+    dao_exchange_rate.insert_new_rate.return_value = ExchangeRate(provider_id=2, date=_date, currency="EUR", rate=Decimal(0.75))
+    for _ in range(2):
+        assert exchange_rate_manager.get_best_rate_by_date(_date, "EUR", logger) == Decimal(0.89)
+
+    assert grandtrunk.get_by_date.call_count == 3
+
+
+def test_rebuild_best_rates__cached_best_rates_are_forgotten(dao_exchange_rate, dao_provider, base_currency, currencies, logger):
+    _date = date(2016, 2, 17)
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [ExchangeRate(id=1, date=_date, currency="EUR", rate=Decimal(0.89), provider_id=1)]
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, currencies)
+    assert exchange_rate_manager.get_best_rate_by_date(_date, "EUR", logger) == Decimal(0.89)
+
+    dao_exchange_rate.get_dates_with_rates.return_value = [_date]
+    dao_exchange_rate.get_best_rates_by_dates_currencies.return_value = [Mock(date=_date, currency="EUR", rate=Decimal("0.9"), providers=0)]
+    exchange_rate_manager.rebuild_best_rates(logger)
+
+    assert exchange_rate_manager.get_best_rate_by_date(_date, "EUR", logger) == Decimal("0.9")
+
+
+def test_get_exchange_rate_by_date__today_best_rates_expire(dao_exchange_rate, dao_provider, base_currency, logger):
+    """
+    Today's rates can still be completed by the daily update so their cache entries expire.
+    """
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, set(), today_best_rates_cache_ttl=0)
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [
+        ExchangeRate(id=1, date=date.today(), currency="EUR", rate=Decimal(0.89), provider_id=1)
+    ]
+    exchange_rate_manager.get_exchange_rate_by_date(date.today(), "EUR", "USD", logger)
+    exchange_rate_manager.get_exchange_rate_by_date(date.today(), "EUR", "USD", logger)
+
+    assert dao_exchange_rate.get_rates_by_dates_currencies.call_count == 2
+
+
+def test_get_exchange_rates_by_dates(dao_exchange_rate, dao_provider, base_currency, logger):
+    """
+    Rates of all conversions are loaded from database by single query. Conversion without available rates has None as a result.
+    """
+    _date = date(2016, 2, 17)
+    _next_date = date(2016, 2, 18)
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, set())
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [
+        ExchangeRate(id=1, date=_date, currency="EUR", rate=Decimal(0.89), provider_id=1),
+        ExchangeRate(id=2, date=_date, currency="CZK", rate=Decimal(24.20), provider_id=1),
+        ExchangeRate(id=3, date=_next_date, currency="EUR", rate=Decimal(0.90), provider_id=1),
+    ]
+    exchange_rates = exchange_rate_manager.get_exchange_rates_by_dates(
+        [(_date, "EUR", "CZK"), (_next_date, "EUR", "USD"), (_next_date, "EUR", "CZK")],
+        logger,
+    )
+
+    assert exchange_rates == [Decimal(24.20) / Decimal(0.89), Decimal(1) / Decimal(0.90), None]
+    assert dao_exchange_rate.get_rates_by_dates_currencies.call_count == 1
+    assert dao_exchange_rate.get_rates_by_dates_currencies.call_args[0] == ({_date, _next_date}, {"EUR", "CZK"})
+    assert dao_exchange_rate.get_rates_by_date_currency.call_count == 0
+
+
+def test_get_exchange_rates_by_dates__missing_rates_are_not_requested(
+    dao_exchange_rate, dao_provider, currency_layer, grandtrunk, base_currency, currencies, logger
+):
+    """
+    Without requests of missing rates, only rates in database are used, including yesterday's rates of providers missing today.
+    """
+    _date = date(2016, 2, 17)
+    today = date.today()
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [
+        ExchangeRate(date=_date, currency="EUR", rate=Decimal("0.89"), provider_id=1),
+        ExchangeRate(date=today, currency="EUR", rate=Decimal("0.9"), provider_id=1),
+    ]
+    dao_exchange_rate.get_rate_by_date_currency_provider.return_value = ExchangeRate(date=today, currency="EUR", rate=Decimal("0.9"), provider_id=2)
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer, grandtrunk], base_currency, currencies)
+    exchange_rates = exchange_rate_manager.get_exchange_rates_by_dates(
+        [(_date, "USD", "EUR"), (today, "USD", "EUR"), (_date, "USD", "CZK")], logger, request_missing=False
+    )
+
+    assert exchange_rates == [Decimal("0.89"), Decimal("0.9"), None]
+    dao_exchange_rate.get_rate_by_date_currency_provider.assert_called_once_with(today - timedelta(1), "EUR", 2)
+    assert grandtrunk.get_by_date.call_count == 0
+    assert grandtrunk.get_supported_currencies.call_count == 0
+
+
+def test_get_exchange_rate_matrix_by_date(dao_exchange_rate, dao_provider, base_currency, logger):
+    """
+    Best rate of each currency is loaded once and cross rates of all pairs are computed from them, currency without rate has None rates.
+    """
+    _date = date(2016, 2, 17)
+
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [], base_currency, set())
+
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = [
+        ExchangeRate(date=_date, currency="EUR", rate=Decimal(0.89), provider_id=1),
+        ExchangeRate(date=_date, currency="CZK", rate=Decimal(24.20), provider_id=1),
+    ]
+    exchange_rates = exchange_rate_manager.get_exchange_rate_matrix_by_date(_date, ["EUR", "USD", "CZK", "GBP"], logger)
+
+    assert exchange_rates == [
+        [Decimal(1), Decimal(1) / Decimal(0.89), Decimal(24.20) / Decimal(0.89), None],
+        [Decimal(0.89) / Decimal(1), Decimal(1), Decimal(24.20) / Decimal(1), None],
+        [Decimal(0.89) / Decimal(24.20), Decimal(1) / Decimal(24.20), Decimal(1), None],
+        [None, None, None, None],
+    ]
+    assert exchange_rates[0][2] == exchange_rate_manager.get_exchange_rate_by_date(_date, "EUR", "CZK", logger)
+    assert dao_exchange_rate.get_rates_by_dates_currencies.call_count == 1
 
 
 def test_get_average_exchange_rate_by_dates(dao_exchange_rate, dao_provider, base_currency, logger):
@@ -288,37 +803,69 @@ def test_pick_rate_from_most_similar_pair_of_rates_by_order_of_providers():
     assert best == 0.72
 
 
-def test_get_exchange_rate_in_intervals_by_date(dao_exchange_rate, dao_provider, base_currency, currencies, logger):
+def test_pick_middle_rate_of_floats_mixed_with_decimals():
+    best = ExchangeRateManager.pick_the_best([0.0, Decimal("0.5"), 1.0])
+
+    assert best == Decimal("0.5")
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pick_the_best_many_is_identical_to_pick_the_best(seed):
+    """
+    Rates are random mix of missing rates, repeated and equal rates with different exponents, short decimals scaled to integers
+    and long decimals from floats compared as objects, and rows mixing floats with Decimal rates of equal values.
+    """
+    generator = random.Random(seed)
+
+    def random_rate():
+        return generator.choice([
+            lambda: None,
+            lambda: Decimal(generator.choice(["0.5", "0.50", "0.7", "1", "1.25", "0.75"])),
+            lambda: Decimal(str(round(generator.uniform(0, 2), generator.randint(0, 8)))),
+            lambda: Decimal(generator.random()),
+        ])()
+
+    rates = [[random_rate() for _ in range(generator.randint(0, 6))] for _ in range(500)]
+    float_rates = [[generator.choice([None, 0.25, 0.5, generator.random()]) for _ in range(5)] for _ in range(500)]
+    mixed_rates = [[generator.choice([None, 0.5, 0.75, generator.random(), random_rate()]) for _ in range(generator.randint(0, 6))] for _ in range(500)]
+
+    def pick_the_best_of_each(rows):
+        return [ExchangeRateManager.pick_the_best([r for r in row if r is not None]) if any(r is not None for r in row) else None for row in rows]
+
+    for rows in (rates, float_rates, mixed_rates, rates + mixed_rates):
+        best_rates = ExchangeRateManager.pick_the_best_many(rows)
+
+        assert len(best_rates) == len(rows)
+        assert all(best is expected for best, expected in zip(best_rates, pick_the_best_of_each(rows)))
+
+    float_array = np.array([[np.nan if r is None else r for r in row] for row in float_rates])
+
+    assert ExchangeRateManager.pick_the_best_many(float_array) == pick_the_best_of_each(float_rates)
+
+
+def test_get_exchange_rate_in_intervals_by_date(dao_exchange_rate, dao_provider, currency_layer, base_currency, currencies, logger):
     """
     :param dao_exchange_rate: Mock of gold_digger.database.dao_exchange_rate.DaoExchangeRate
     :param dao_provider: Mock of gold_digger.database.dao_provider.DaoProvider
+    :param currency_layer: Mock of gold_digger.data_providers.CurrencyLayer
     :type base_currency: str
     :type currencies: set[str]
     :type logger: logging.Logger
     """
     date_of_exchange_ = date(2020, 11, 30)
-    start_date_6_days_ago = date_of_exchange_ - timedelta(days=6)
-    start_date_30_days_ago = date_of_exchange_ - timedelta(days=30)
-    provider = Provider(name="currency_layer")
+    provider = Provider(id=1, name="currency_layer")
     rates = {
-        "EUR": [ExchangeRate(provider=provider, date=date_of_exchange_, currency="EUR", rate=Decimal(10.0))],
-        "CZK": [ExchangeRate(provider=provider, date=date_of_exchange_, currency="CZK", rate=Decimal(15.0))],
+        "EUR": [ExchangeRate(provider_id=provider.id, date=date_of_exchange_, currency="EUR", rate=Decimal(10.0))],
+        "CZK": [ExchangeRate(provider_id=provider.id, date=date_of_exchange_, currency="CZK", rate=Decimal(15.0))],
     }
-    sum_of_rates = {
-        "EUR": {
-            date_of_exchange_: [(provider, 1, Decimal(10.0))],
-            start_date_6_days_ago: [(provider, 7, Decimal(70.0))],
-            start_date_30_days_ago: [(provider, 31, Decimal(310.0))],
-        },
-        "CZK": {
-            date_of_exchange_: [(provider, 1, Decimal(15.0))],
-            start_date_6_days_ago: [(provider, 7, Decimal(140.0))],
-            start_date_30_days_ago: [(provider, 31, Decimal(775.0))],
-        },
-    }
-    dao_exchange_rate.get_sum_of_rates_in_period.side_effect = lambda start_date, _, currency: sum_of_rates[currency][start_date]
-    dao_exchange_rate.get_rates_by_date_currency.side_effect = lambda _, currency: rates[currency]
-    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [provider], base_currency, currencies)
+    # EUR average is 10 in both periods, CZK average is 20 in the last 7 days and 25 in the last 31 days
+    rates_in_period = [(provider.id, "EUR", date_of_exchange_ - timedelta(days=days), Decimal(10)) for days in range(31)]
+    rates_in_period += [(provider.id, "CZK", date_of_exchange_ - timedelta(days=days), Decimal(20)) for days in range(7)]
+    rates_in_period += [(provider.id, "CZK", date_of_exchange_ - timedelta(days=days), Decimal(26)) for days in range(7, 30)]
+    rates_in_period += [(provider.id, "CZK", date_of_exchange_ - timedelta(days=30), Decimal(37))]
+    dao_exchange_rate.get_rates_by_dates_currencies.return_value = rates["EUR"] + rates["CZK"]
+    dao_exchange_rate.get_rates_in_period.return_value = rates_in_period
+    exchange_rate_manager = ExchangeRateManager(dao_exchange_rate, dao_provider, [currency_layer], base_currency, currencies)
 
     exchange_rate_in_intervals = exchange_rate_manager.get_exchange_rate_in_intervals_by_date(date_of_exchange_, "EUR", "CZK", logger)
 
@@ -336,3 +883,5 @@ def test_get_exchange_rate_in_intervals_by_date(dao_exchange_rate, dao_provider,
             "exchange_rate": "2.5",
         },
     ]
+    dao_exchange_rate.get_rates_in_period.assert_called_once_with(date(2020, 10, 31), date_of_exchange_, {"EUR", "CZK"})
+    dao_exchange_rate.get_sum_of_rates_in_period.assert_not_called()
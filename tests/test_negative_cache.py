@@ -0,0 +1,42 @@
+from gold_digger.utils.negative_cache import NegativeCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_miss_expires_after_ttl():
+    timer = FakeTimer()
+    negative_cache = NegativeCache(maxsize=10, timer=timer)
+
+    negative_cache.add("key", NegativeCache.WEEKEND, 60)
+    timer.now = 59
+    assert negative_cache.get("key") == NegativeCache.WEEKEND
+
+    timer.now = 60
+    assert negative_cache.get("key") is None
+    assert negative_cache.get("other") is None
+
+
+def test_miss_without_positive_ttl_is_not_stored():
+    negative_cache = NegativeCache(maxsize=10)
+
+    negative_cache.add("key", NegativeCache.ERROR, 0)
+
+    assert negative_cache.get("key") is None
+
+
+def test_least_recently_used_miss_is_evicted():
+    negative_cache = NegativeCache(maxsize=2)
+
+    negative_cache.add("first", NegativeCache.MISSING, 60)
+    negative_cache.add("second", NegativeCache.MISSING, 60)
+    negative_cache.get("first")
+    negative_cache.add("third", NegativeCache.MISSING, 60)
+
+    assert negative_cache.get("first") == NegativeCache.MISSING
+    assert negative_cache.get("second") is None
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import sleep
+
+import pytest
+
+from gold_digger.utils.single_flight import SingleFlight
+
+
+def test_overlapping_calls_are_executed_once():
+    single_flight = SingleFlight()
+    started, release = Event(), Event()
+    calls = []
+
+    def fetch(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        first = executor.submit(single_flight.do, "key", fetch, 1)
+        started.wait(5)
+        waiting = [executor.submit(single_flight.do, "key", fetch, 1) for _ in range(2)]
+        other_key = single_flight.do("other", lambda: "other")
+        sleep(0.1)  # let the waiting calls join the first one
+        release.set()
+
+        assert [first.result(), *(w.result() for w in waiting)] == [2, 2, 2]
+
+    assert calls == [1]
+    assert other_key == "other"
+    assert single_flight.do("key", fetch, 3) == 6  # finished call isn't reused
+
+
+def test_exception_is_raised_to_all_callers():
+    single_flight = SingleFlight()
+    started, release = Event(), Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        raise ValueError("Provider failed")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(single_flight.do, "key", fetch)
+        started.wait(5)
+        waiting = executor.submit(single_flight.do, "key", fetch)
+        sleep(0.1)  # let the waiting call join the first one
+        release.set()
+
+        for call in (first, waiting):
+            with pytest.raises(ValueError):
+                call.result()